@@ -14,10 +14,7 @@ import codecs
 import numpy as np
 import pandas as pd
 
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer
 
-from gensim.models import KeyedVectors
 from keras.preprocessing.text import Tokenizer
 from keras.preprocessing.sequence import pad_sequences
 from keras.layers import Dense, Input, LSTM, Embedding, Dropout, Activation
@@ -30,6 +27,8 @@ import sys
 from importlib import reload
 
 import preprocessing
+import quora_data
+import word_vectors
 
 reload(sys)
 # Since the default on Python 3 is UTF-8 already, there is no point in leaving those statements in.
@@ -50,6 +49,8 @@ MAX_SEQUENCE_LENGTH = 30
 MAX_NB_WORDS = 200000
 EMBEDDING_DIM = 300
 VALIDATION_SPLIT = 0.1
+PREPROCESS_JOBS = None  # worker processes for text cleaning, None = all cores
+PREPROCESS_CACHE = preprocessing.PREPROCESSING_CACHE_PATH  # cleaned-question cache, None = off
 
 num_lstm = 250#np.random.randint(175, 275)
 num_dense = 150#np.random.randint(100, 150)
@@ -67,7 +68,7 @@ STAMP = 'lstm_%d_%d_%.2f_%.2f' % (num_lstm, num_dense, rate_drop_lstm, rate_drop
 # ----------------------------------------------------------------------------
 print('Indexing word vectors')
 
-word2vec = KeyedVectors.load_word2vec_format(EMBEDDING_FILE, binary=True)
+word2vec = word_vectors.load_word_vectors(EMBEDDING_FILE)
 print('Found %s word vectors of word2vec' % len(word2vec.vocab))
 
 
@@ -77,39 +78,6 @@ print('Found %s word vectors of word2vec' % len(word2vec.vocab))
 print('Processing text dataset')
 
 
-#
-# The function "text_to_wordlist" is from
-# https://www.kaggle.com/currie32/quora-question-pairs/the-importance-of-cleaning-text
-# ----------------------------------------------------------------------------
-def text_to_wordlist(text, remove_stopwords=False, stem_words=False):
-    # Clean the text, with the option to remove stopwords and to stem words.
-
-    # Convert words to lower case and split them
-    text = text.lower().split()
-
-    # Optionally, remove stop words
-    if remove_stopwords:
-        stops = set(stopwords.words("english"))
-        text = [w for w in text if not w in stops]
-
-    text = " ".join(text)
-
-    # Clean the text
-    text = preprocessing.word_patterns_replace(text)
-
-    # Optionally, shorten words to their stems
-    # Ex. >>> print(stemmer.stem("running"))
-    #     run
-    if stem_words:
-        text = text.split()
-        stemmer = SnowballStemmer('english')
-        stemmed_words = [stemmer.stem(word) for word in text]
-        text = " ".join(stemmed_words)
-
-    # Return a list of words
-    return text
-
-
 #
 # Read Training & Validation data
 # ----------------------------------------------------------------------------
@@ -131,13 +99,12 @@ def text_to_wordlist(text, remove_stopwords=False, stem_words=False):
 train_texts_1 = []
 train_texts_2 = []
 train_labels = []
-with codecs.open(TRAIN_DATA_FILE, encoding='utf-8') as f:
-    reader = csv.reader(f, delimiter=',')
-    header = next(reader)
-    for values in reader:
-        train_texts_1.append(text_to_wordlist(values[3]))
-        train_texts_2.append(text_to_wordlist(values[4]))
-        train_labels.append(int(values[5]))
+for q1, q2, label in quora_data.iter_columns(TRAIN_DATA_FILE, ('question1', 'question2', 'is_duplicate')):
+    train_texts_1.append(q1)
+    train_texts_2.append(q2)
+    train_labels.append(int(label))
+train_texts_1 = list(preprocessing.preprocess_corpus(train_texts_1, PREPROCESS_JOBS, cache_path=PREPROCESS_CACHE))
+train_texts_2 = list(preprocessing.preprocess_corpus(train_texts_2, PREPROCESS_JOBS, cache_path=PREPROCESS_CACHE))
 print('Found %s texts in train.csv' % len(train_texts_1))
 
 #
@@ -146,13 +113,12 @@ print('Found %s texts in train.csv' % len(train_texts_1))
 valid_texts_1 = []
 valid_texts_2 = []
 valid_labels = []
-with codecs.open(VALID_DATA_FILE, encoding='utf-8') as f:
-    reader = csv.reader(f, delimiter=',')
-    header = next(reader)
-    for values in reader:
-        valid_texts_1.append(text_to_wordlist(values[3]))
-        valid_texts_2.append(text_to_wordlist(values[4]))
-        valid_labels.append(int(values[5]))
+for q1, q2, label in quora_data.iter_columns(VALID_DATA_FILE, ('question1', 'question2', 'is_duplicate')):
+    valid_texts_1.append(q1)
+    valid_texts_2.append(q2)
+    valid_labels.append(int(label))
+valid_texts_1 = list(preprocessing.preprocess_corpus(valid_texts_1, PREPROCESS_JOBS, cache_path=PREPROCESS_CACHE))
+valid_texts_2 = list(preprocessing.preprocess_corpus(valid_texts_2, PREPROCESS_JOBS, cache_path=PREPROCESS_CACHE))
 print('Found %s texts in validation.csv' % len(valid_texts_1))
 
 #
@@ -161,13 +127,12 @@ print('Found %s texts in validation.csv' % len(valid_texts_1))
 test_texts_1 = []
 test_texts_2 = []
 test_ids = []
-with codecs.open(TEST_DATA_FILE, encoding='utf-8') as f:
-    reader = csv.reader(f, delimiter=',')
-    header = next(reader)
-    for values in reader:
-        test_texts_1.append(text_to_wordlist(values[1]))
-        test_texts_2.append(text_to_wordlist(values[2]))
-        test_ids.append(values[0])
+for q1, q2, test_id in quora_data.iter_columns(TEST_DATA_FILE, ('question1', 'question2', 'test_id')):
+    test_texts_1.append(q1)
+    test_texts_2.append(q2)
+    test_ids.append(test_id)
+test_texts_1 = list(preprocessing.preprocess_corpus(test_texts_1, PREPROCESS_JOBS, cache_path=PREPROCESS_CACHE))
+test_texts_2 = list(preprocessing.preprocess_corpus(test_texts_2, PREPROCESS_JOBS, cache_path=PREPROCESS_CACHE))
 print('Found %s texts in test.csv' % len(test_texts_1))
 
 
@@ -0,0 +1,54 @@
+"""char_ngram_features against per-row n-gram Counters and sets.
+
+    python -m benchmarks.bench_char_ngrams [--csv test.csv] [--rows 20000] [--jobs 1 8 32]
+"""
+import argparse
+import collections
+import time
+
+import numpy as np
+
+import feature_engineer as fe
+from benchmarks.bench_overlap import load_pairs
+
+
+def row_wise(data):
+    # What the features cost built from char_ngrams one pair at a time
+    rows = []
+    for s1, s2 in zip(data.q1_split, data.q2_split):
+        row = []
+        for n in fe.CHAR_NGRAM_SIZES:
+            c1, c2 = [collections.Counter(g for w in split for g in fe.char_ngrams(n, w)) for split in (s1, s2)]
+            norms = np.sqrt(sum(v * v for v in c1.values()) * sum(v * v for v in c2.values()))
+            shared, union, smaller = len(set(c1) & set(c2)), len(set(c1) | set(c2)), min(len(c1), len(c2))
+            row += [sum(c1[g] * c2[g] for g in c1) / norms if norms else 0, shared / union if union else 0,
+                    shared / smaller if smaller else 0]
+        rows.append(row)
+    return np.array(rows, dtype=np.float32)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='Quora pair csv')
+    parser.add_argument('--rows', type=int, default=20000, help='number of pairs')
+    parser.add_argument('--jobs', type=int, nargs='*', default=[1], help='worker counts for char_ngram_features')
+    args = parser.parse_args(argv)
+
+    data = load_pairs(args.csv, args.rows)
+    print('char n-gram features on %d pairs' % len(data))
+    st = time.perf_counter()
+    expected = row_wise(data)
+    t_before = time.perf_counter() - st
+    print('  row-wise Counters:   %8.1fs %10.0f pairs/s' % (t_before, len(data) / t_before))
+    for n_jobs in args.jobs:
+        st = time.perf_counter()
+        block = fe.char_ngram_features(data, n_jobs=n_jobs)
+        elapsed = time.perf_counter() - st
+        print('  char_ngram_features n_jobs=%-3d %5.1fs %10.0f pairs/s  %.1fx' % (
+            n_jobs, elapsed, len(data) / elapsed, t_before / elapsed))
+        # Hash collisions in 2 ** 20 buckets may move a few values slightly
+        print('  max difference: %.2g' % np.abs(block - expected).max())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""fuzzy_features against the seven row-wise fuzz.* applies it replaces.
+
+    python -m benchmarks.bench_fuzzy [--csv test.csv] [--rows 20000] [--jobs 1 8 32]
+"""
+import argparse
+import time
+
+import numpy as np
+
+import feature_engineer as fe
+from benchmarks.bench_overlap import load_pairs
+
+
+def row_wise(data):
+    from fuzzywuzzy import fuzz
+    scorers = [fuzz.QRatio, fuzz.WRatio, fuzz.partial_ratio, fuzz.partial_token_set_ratio,
+               fuzz.partial_token_sort_ratio, fuzz.token_set_ratio, fuzz.token_sort_ratio]
+    columns = [data.apply(lambda x: scorer(str(x['question1']), str(x['question2'])), axis=1)
+               for scorer in scorers]
+    return np.column_stack(columns).astype(np.float32)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='Quora pair csv')
+    parser.add_argument('--rows', type=int, default=20000, help='number of pairs')
+    parser.add_argument('--jobs', type=int, nargs='*', default=[1], help='worker counts for fuzzy_features')
+    args = parser.parse_args(argv)
+
+    data = load_pairs(args.csv, args.rows)
+    print('fuzzy features on %d pairs' % len(data))
+    st = time.perf_counter()
+    expected = row_wise(data)
+    t_before = time.perf_counter() - st
+    print('  row-wise apply:      %8.1fs %10.0f pairs/s' % (t_before, len(data) / t_before))
+    for n_jobs in args.jobs:
+        st = time.perf_counter()
+        block = fe.fuzzy_features(data, n_jobs=n_jobs)
+        elapsed = time.perf_counter() - st
+        print('  fuzzy_features n_jobs=%-3d %5.1fs %10.0f pairs/s  %.1fx' % (
+            n_jobs, elapsed, len(data) / elapsed, t_before / elapsed))
+        np.testing.assert_array_equal(block, expected)
+    print('  outputs match')
+
+
+if __name__ == '__main__':
+    main()
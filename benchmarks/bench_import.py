@@ -0,0 +1,74 @@
+"""Cold-start import cost of every model script, in `python -X importtime` terms.
+
+preprocessing and feature_engineer are imported as they are. The model
+scripts do all their work at module level, so only their top-level import
+statements are extracted and run. Each one runs in a fresh interpreter under
+-X importtime; the report lists the total and the modules that cost the most.
+
+    python -m benchmarks.bench_import [--top 5] [--max-ms 2000] [script.py ...]
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['preprocessing.py', 'feature_engineer.py']
+MODEL_SCRIPTS = ['LSTM_sample.py', 'LSTM_advanced.py', 'CNN_sample.py', 'LSTM_non_static_w2v.py',
+                 'BLSTM_non_static_w2v.py']
+
+
+def import_statements(script):
+    if script in MODULES:
+        return 'import %s' % script[:-len('.py')]
+    with open(os.path.join(ROOT, script), encoding='utf-8') as f:
+        source = f.read()
+    return '\n'.join(ast.get_source_segment(source, node)
+                     for node in ast.parse(source, script).body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def importtime(code):
+    """Run `code` under -X importtime; return ({module: (self_us, cumulative_us)}, error)."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    modules = {}
+    errors = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            errors.append(line)
+            continue
+        fields = line[len('import time:'):].split('|')
+        if not fields[0].strip().isdigit():
+            continue  # header line
+        name = fields[2][1:].rstrip()
+        # Only top-level entries (no extra indentation) add up to the total
+        modules[name.strip()] = (int(fields[0]), int(fields[1]), not name.startswith(' '))
+    error = errors[-1] if proc.returncode else None
+    return modules, error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scripts', nargs='*', default=MODULES + MODEL_SCRIPTS)
+    parser.add_argument('--top', type=int, default=5, help='number of most expensive modules to list')
+    parser.add_argument('--max-ms', type=float, help='exit with an error when a script imports slower than this')
+    args = parser.parse_args(argv)
+
+    too_slow = []
+    for script in args.scripts:
+        modules, error = importtime(import_statements(script))
+        total = sum(cumulative for _, cumulative, top in modules.values() if top) / 1000.
+        print('%-26s %9.1f ms%s' % (script, total, '  (failed: %s)' % error if error else ''))
+        ranked = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (self_us, cumulative, top) in [m for m in ranked if m[1][2]][:args.top]:
+            print('    %-36s self %8.1f ms  cumulative %8.1f ms' % (name, self_us / 1000., cumulative / 1000.))
+        if args.max_ms is not None and total > args.max_ms:
+            too_slow.append(script)
+
+    if too_slow:
+        sys.exit('import slower than %.0f ms: %s' % (args.max_ms, ', '.join(too_slow)))
+
+
+if __name__ == '__main__':
+    main()
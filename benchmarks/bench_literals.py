@@ -0,0 +1,53 @@
+"""Literal 'replace' passes as a chain of str.replace against one multi-pattern scan per run.
+
+    python -m benchmarks.bench_literals [--csv train.csv] [--limit N]
+
+Each pass is timed on the text the earlier passes leave behind, i.e. on what
+it really sees inside word_patterns_replace.
+"""
+import argparse
+import time
+
+import preprocessing
+from benchmarks.corpus import iter_questions
+
+
+def seconds(apply_pass, texts, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        st = time.perf_counter()
+        for t in texts:
+            apply_pass(t)
+        best = min(best, time.perf_counter() - st)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='Quora pair csv with question1/question2 columns')
+    parser.add_argument('--limit', type=int, default=20000, help='number of questions')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    texts = [' '.join(q.lower().split()) for q in iter_questions(args.csv, limit=args.limit, repeat=args.limit)]
+    chain = preprocessing.compile_rules(preprocessing.WORD_PATTERN_RULES)
+    fused = preprocessing.compile_rules(preprocessing.WORD_PATTERN_RULES, fuse_literals=True)
+
+    print('literal passes on %d questions (us per question)' % len(texts))
+    print('  %-5s %-6s %-6s %9s %9s' % ('pass', 'rules', 'scans', 'chain', 'fused'))
+    total_chain = total_fused = 0.0
+    for idx, (kind, members) in enumerate(preprocessing.WORD_PATTERN_RULES):
+        if kind == 'replace' and len(members) > 1:
+            t_chain = seconds(chain[idx], texts, args.rounds)
+            t_fused = seconds(fused[idx], texts, args.rounds)
+            assert [chain[idx](t) for t in texts] == [fused[idx](t) for t in texts]
+            total_chain += t_chain
+            total_fused += t_fused
+            print('  %-5d %-6d %-6d %9.2f %9.2f' % (idx, len(members), len(preprocessing.literal_groups(members)),
+                                                    1e6 * t_chain / len(texts), 1e6 * t_fused / len(texts)))
+        texts = [chain[idx](t) for t in texts]
+    print('  total             %9.2f %9.2f' % (1e6 * total_chain / len(texts), 1e6 * total_fused / len(texts)))
+
+
+if __name__ == '__main__':
+    main()
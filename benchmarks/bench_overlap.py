@@ -0,0 +1,88 @@
+"""set_overlap_features against the row-wise data.apply features it replaces.
+
+    python -m benchmarks.bench_overlap [--csv train.csv] [--rows 404290]
+
+Without --csv, --rows pairs are drawn at random from the golden questions.
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+import feature_engineer as fe
+from benchmarks.corpus import GOLDEN_QUESTIONS
+
+
+def load_pairs(path, rows):
+    if path is not None:
+        data = pd.read_csv(path, nrows=rows).fillna(' ')
+    else:
+        rng = random.Random(0)
+        data = pd.DataFrame({'question1': [rng.choice(GOLDEN_QUESTIONS) for _ in range(rows)],
+                             'question2': [rng.choice(GOLDEN_QUESTIONS) for _ in range(rows)]})
+    data['q1_split'] = data['question1'].map(lambda x: str(x).lower().split())
+    data['q2_split'] = data['question2'].map(lambda x: str(x).lower().split())
+    return data
+
+
+def idf_weights(data):
+    # calculate_tfidf's dict, spelled for both old and new scikit-learn
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer(min_df=1)
+    vectorizer.fit(data['question1'].tolist() + data['question2'].tolist())
+    names = getattr(vectorizer, 'get_feature_names_out', None) or vectorizer.get_feature_names
+    return dict(zip(names(), vectorizer.idf_))
+
+
+def row_wise(data, stops, weights):
+    X = pd.DataFrame(index=data.index)
+    X['word_count_diff'] = data.apply(fe.wc_diff, axis=1)
+    X['word_count_ratio'] = data.apply(fe.wc_ratio, axis=1)
+    X['total_unique_words'] = data.apply(fe.total_unique_words, axis=1)
+    X['wc_diff_unique'] = data.apply(fe.wc_diff_unique, axis=1)
+    X['wc_ratio_unique'] = data.apply(fe.wc_ratio_unique, axis=1)
+    X['total_unq_words_stop'] = data.apply(fe.total_unq_words_stop, stops=stops, axis=1)
+    X['wc_diff_unique_stop'] = data.apply(fe.wc_diff_unique_stop, stops=stops, axis=1)
+    X['wc_ratio_unique_stop'] = data.apply(fe.wc_ratio_unique_stop, stops=stops, axis=1)
+    X['same_start'] = data.apply(fe.same_start_word, axis=1)
+    X['same_end'] = data.apply(fe.same_end_word, axis=1)
+    X['common_words'] = data.apply(fe.common_words, axis=1)
+    X['common_words_unique'] = data.apply(fe.common_words_unit, axis=1)
+    X['word_match'] = data.apply(fe.word_match_share, axis=1)
+    X['word_match_stops'] = data.apply(fe.word_match_share_stops, stops=stops, axis=1)
+    X['tfidf_wm'] = data.apply(fe.tfidf_word_match_share, weights=weights, axis=1)
+    X['tfidf_wm_stops'] = data.apply(fe.tfidf_word_match_share_stops, stops=stops, weights=weights, axis=1)
+    X['jaccard'] = data.apply(fe.jaccard, axis=1)
+    return X
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='Quora train csv')
+    parser.add_argument('--rows', type=int, default=404290, help='number of pairs (404290 = full train set)')
+    args = parser.parse_args(argv)
+
+    data = load_pairs(args.csv, args.rows)
+    weights = idf_weights(data)
+    stops = fe.stop_words
+
+    st = time.perf_counter()
+    with np.errstate(invalid='ignore'):
+        before = row_wise(data, stops, weights)
+    t_before = time.perf_counter() - st
+    st = time.perf_counter()
+    after = fe.set_overlap_features(data, stops, weights)
+    t_after = time.perf_counter() - st
+
+    print('set overlap features (%d columns) on %d pairs' % (after.shape[1], len(data)))
+    print('  row-wise apply: %8.1fs' % t_before)
+    print('  sparse:         %8.1fs' % t_after)
+    print('  speedup: %.1fx' % (t_before / t_after))
+    pd.testing.assert_frame_equal(after.astype(float), before.astype(float), rtol=1e-12)
+    print('  outputs match')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Questions per second of word_patterns_replace, before and after the rule table.
+
+    python -m benchmarks.bench_preprocessing [--csv train.csv] [--limit N] [--jobs 1 8 32]
+
+With --jobs it also reports how preprocess_corpus scales with the worker count.
+"""
+import argparse
+import contextlib
+import time
+
+import preprocessing
+from benchmarks import baseline_preprocessing
+from benchmarks.corpus import iter_questions
+
+
+def questions_per_second(func, questions, rounds=3):
+    best = float('inf')
+    for _ in range(rounds):
+        st = time.perf_counter()
+        for q in questions:
+            func(q)
+        best = min(best, time.perf_counter() - st)
+    return len(questions) / best
+
+
+@contextlib.contextmanager
+def without_tokenizer():
+    # Time the rule chain alone; the WordNet tokenizer is the same on both sides
+    saved = preprocessing.tokenizer, baseline_preprocessing.tokenizer
+    preprocessing.tokenizer = baseline_preprocessing.tokenizer = lambda s: s
+    try:
+        yield
+    finally:
+        preprocessing.tokenizer, baseline_preprocessing.tokenizer = saved
+
+
+def report(label, questions, rounds):
+    before = questions_per_second(baseline_preprocessing.word_patterns_replace, questions, rounds)
+    after = questions_per_second(preprocessing.word_patterns_replace, questions, rounds)
+    print(label)
+    print('  before: %10.0f questions/s' % before)
+    print('  after:  %10.0f questions/s' % after)
+    print('  speedup: %.2fx' % (after / before))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='Quora pair csv with question1/question2 columns')
+    parser.add_argument('--limit', type=int, default=20000, help='number of questions to clean')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--jobs', type=int, nargs='*', default=[], help='worker counts for preprocess_corpus')
+    args = parser.parse_args(argv)
+
+    questions = list(iter_questions(args.csv, limit=args.limit, repeat=args.limit))
+    # Lower-case first, like text_to_wordlist does before calling the rules
+    questions = [' '.join(q.lower().split()) for q in questions]
+
+    report('word_patterns_replace on %d questions' % len(questions), questions, args.rounds)
+    with without_tokenizer():
+        report('rule chain only (tokenizer stubbed out)', questions, args.rounds)
+
+    if args.jobs:
+        print('preprocess_corpus (text_to_wordlist) on %d questions' % len(questions))
+        for n_jobs in args.jobs:
+            st = time.perf_counter()
+            for _ in preprocessing.preprocess_corpus(questions, n_jobs=n_jobs):
+                pass
+            print('  n_jobs=%-3d %10.0f questions/s' % (n_jobs, len(questions) / (time.perf_counter() - st)))
+
+
+if __name__ == '__main__':
+    main()
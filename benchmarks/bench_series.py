@@ -0,0 +1,42 @@
+"""Rows per second of word_patterns_replace_series against a row-wise Series.map.
+
+    python -m benchmarks.bench_series [--csv train.csv] [--rows 1000000]
+
+Without --csv the golden questions are repeated up to --rows.
+"""
+import argparse
+import time
+
+import pandas as pd
+
+import preprocessing
+from benchmarks.corpus import iter_questions
+
+
+def timed(label, func, texts):
+    st = time.perf_counter()
+    out = func(texts)
+    elapsed = time.perf_counter() - st
+    print('  %-28s %8.1fs %12.0f rows/s' % (label, elapsed, len(texts) / elapsed))
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='Quora pair csv with question1/question2 columns')
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    questions = list(iter_questions(args.csv, limit=args.rows, repeat=args.rows))
+    texts = pd.Series([' '.join(q.lower().split()) for q in questions])
+    preprocessing.load_wordnet_lexicon()
+
+    print('word_patterns_replace on %d rows' % len(texts))
+    expected = timed('Series.map (row-wise)', lambda s: s.map(preprocessing.word_patterns_replace), texts)
+    out = timed('word_patterns_replace_series', preprocessing.word_patterns_replace_series, texts)
+    mismatches = int((out.astype(object) != expected.astype(object)).sum())
+    print('  mismatches: %d' % mismatches)
+
+
+if __name__ == '__main__':
+    main()
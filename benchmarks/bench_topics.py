@@ -0,0 +1,56 @@
+"""topic_features against the per-row LDA/LSI applies it replaces.
+
+    python -m benchmarks.bench_topics [--csv train.csv] [--rows 20000] [--topics 100]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import feature_engineer as fe
+from benchmarks.bench_overlap import load_pairs
+
+
+def row_wise(data, dictionary, lda_model, lsi_model, num_topics):
+    # The 400 Series.apply passes build_features used to run
+    X = pd.DataFrame(index=data.index)
+    for kind, model in (('lda', lda_model), ('lsi', lsi_model)):
+        for q in ('question1', 'question2'):
+            topics = data[q].apply(lambda x: dict(model[dictionary.doc2bow(fe.clean_doc(x))]))
+            for idx in range(num_topics):
+                X['%s_topic_%s_%s' % (kind, idx, q)] = topics.apply(lambda x: x.get(idx, 0))
+    return X
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='Quora pair csv')
+    parser.add_argument('--rows', type=int, default=20000, help='number of pairs')
+    parser.add_argument('--topics', type=int, default=100, help='number of topics')
+    args = parser.parse_args(argv)
+
+    data = load_pairs(args.csv, args.rows)
+    questions = data.question1.tolist() + data.question2.tolist()
+    st = time.perf_counter()
+    dictionary, lda_model, lsi_model = fe.train_lda(fe.clean_docs(questions), num_topics=args.topics)
+    print('topic features on %d pairs, %d topics (training %.1fs)' % (
+        len(data), args.topics, time.perf_counter() - st))
+
+    st = time.perf_counter()
+    expected = row_wise(data, dictionary, lda_model, lsi_model, args.topics)
+    t_before = time.perf_counter() - st
+    print('  per-row apply:   %8.1fs' % t_before)
+    st = time.perf_counter()
+    lda, lsi = fe.topic_features(questions, dictionary, lda_model, lsi_model, args.topics)
+    elapsed = time.perf_counter() - st
+    print('  topic_features:  %8.1fs  %.0fx' % (elapsed, t_before / elapsed))
+    n = len(data)
+    np.testing.assert_allclose(np.hstack([lsi[:n], lsi[n:]]), expected.values[:, 2 * args.topics:],
+                               rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(np.hstack([lda[:n], lda[n:]]), expected.values[:, :2 * args.topics], atol=1e-2)
+    print('  outputs match')
+
+
+if __name__ == '__main__':
+    main()
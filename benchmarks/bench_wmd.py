@@ -0,0 +1,61 @@
+"""Pairs per second of wmd_features, exact and approximate.
+
+    python -m benchmarks.bench_wmd [--csv train.csv] [--rows 20000] [--vectors store_dir] [--jobs 1 8]
+
+Without --vectors, random 300-d vectors over the words of the pairs
+stand in for the embedding. If POT is installed, the per-row
+KeyedVectors.wmdistance calls wmd_features replaces are timed too.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import feature_engineer as fe
+import word_vectors
+from benchmarks.bench_overlap import load_pairs
+
+
+def random_model(data, dim=300):
+    words = sorted(set(w for s in data.q1_split.tolist() + data.q2_split.tolist() for w in s))
+    vectors = np.random.RandomState(0).randn(len(words), dim).astype(np.float32)
+    return word_vectors._keyed_vectors(words, vectors)
+
+
+def row_wise(data, model):
+    s1 = data.q1_split.map(lambda s: [w for w in s if w not in fe.stop_words])
+    s2 = data.q2_split.map(lambda s: [w for w in s if w not in fe.stop_words])
+    return np.array([model.wmdistance(a, b) for a, b in zip(s1, s2)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='Quora pair csv')
+    parser.add_argument('--rows', type=int, default=20000, help='number of pairs')
+    parser.add_argument('--vectors', help='word_vectors store or word2vec .bin')
+    parser.add_argument('--jobs', type=int, nargs='*', default=[1], help='worker counts for wmd_features')
+    args = parser.parse_args(argv)
+
+    data = load_pairs(args.csv, args.rows)
+    model = word_vectors.load_word_vectors(args.vectors) if args.vectors else random_model(data)
+    print('word mover\'s distance on %d pairs' % len(data))
+    try:
+        import ot  # noqa: F401 -- wmdistance needs POT
+    except ImportError:
+        print('  per-row wmdistance:      skipped, POT is not installed')
+    else:
+        st = time.perf_counter()
+        row_wise(data, model)
+        elapsed = time.perf_counter() - st
+        print('  per-row wmdistance:       %7.1fs %8.0f pairs/s' % (elapsed, len(data) / elapsed))
+    for n_jobs in args.jobs:
+        for exact in (True, False):
+            st = time.perf_counter()
+            fe.wmd_features(data, model, exact=exact, n_jobs=n_jobs)
+            elapsed = time.perf_counter() - st
+            print('  %-11s n_jobs=%-3d   %7.1fs %8.0f pairs/s' % (
+                'exact' if exact else 'approximate', n_jobs, elapsed, len(data) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
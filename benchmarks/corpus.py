@@ -0,0 +1,72 @@
+"""Small golden corpus of Quora-style questions.
+
+Shared by the parity tests and the benchmarks. The questions are picked to hit
+every branch of the preprocessing rules: currency, percentages, floats,
+contractions, units, slashes, hyphenated compounds and the odd unicode char.
+"""
+import csv
+import itertools
+
+GOLDEN_QUESTIONS = [
+    "What is the step by step guide to invest in share market in india?",
+    "What is the story of Kohinoor (Koh-i-Noor) Diamond?",
+    "How can I increase the speed of my internet connection while using a VPN?",
+    "Why am I mentally very lonely? How can I solve it?",
+    "Which one dissolve in water quikly sugar, salt, methane and carbon di oxide?",
+    "Astrology: I am a Capricorn Sun Cap moon and cap rising...what does that say about me?",
+    "Should I buy tiago?",
+    "How can I be a good geologist?",
+    "When do you use シ instead of し?",
+    "Motorola (company): Can I hack my Charter Motorolla DCX3400?",
+    "Method to find separation of slits using fresnel biprism?",
+    "How do I read and find my YouTube comments?",
+    "What can make Physics easy to learn?",
+    "What was your first sexual experience like?",
+    "What are the laws to change your status from a student visa to a green card in the US, how do they compare to the immigration laws in Canada?",
+    "What would a Trump presidency mean for current international master’s students on an F1 visa?",
+    "What does manipulation mean?",
+    "Why do girls want to be friends with the guy they reject?",
+    "Why are so many Quora users posting questions that are readily answered on Google?",
+    "Which is the best digital marketing institution in banglore?",
+    "I'm a 19-year-old. I spend $5000 which is 20% of my 9/11 sayings… . Aréaééé 0.999 5kgs 10kg 555kph 5hours e-mail e - mail? jj korea J.K.",
+    "'online' ‘god’ 'suroor' 'non aspiration' dyke” 'dm ''biba'' 'couldn't've 'mia mia' if “膜”  ‘weekends’ player’s ‘would’ ‘would ''how “her”",
+    "I am a 19-year-old. man who love neural-based paper and F-14 flight",
+    "Barack Obama is the husband of Michelle Obama",
+    "\"Ted's Indian-made <20K 10 V dicks that cost <$10,000 hasn't been detected/protected at (9+2)/11 with [/math] and MOOCs/E-learning (900/1,800 bpm Tu-95).\n PIF: 14-years-old Trump–Clinton U.S. Presidential debate is good for 10Km? <\\html>\"",
+    "What is the output for in main {char *ptr=\"\"hello\"\"; ptr [0] ='m'; printf (\"\"%s\"\" , *s);} ?",
+    "If light has zero mass , then as per this [math]E=mc^2[/math] , light must have zero energy. Is it so ?",
+    "How would I find the necessary number of turns on a transformer primary if the secondary voltage required is 120 V at 60 Hz ?",
+    "A distribution transformer is rated at 18 kVA , 20,000/480 V , and 60 hz. can this transformer safely supply 15kVA to a 415-V load at 50hz? Why or not?",
+    "what's the difference between a 2.4GHz and 5GHz router, and can't I use both?",
+    "Is 60k a good salary for a 25 year old in the U.S.?",
+    "How do I convert 100km to miles? What about 100 km/h to mph and 60mph to kph?",
+    "My 3kgs dumbbell weighs 3kg , my 5mg pill, 5ml syrup, 30ms latency, 100MHz clock, 120bpm beat",
+    "Which laptop is better: Dell XPS 13 or MacBook Pro 13\" (2016)?",
+    "I've been told you'd like it, they're sure we'll go, isn't it?",
+    "What does e.g. mean and what does i.e. mean? Is J K Rowling j k rowling?",
+    "How do I get a 3.5 GPA from a 2.8 GPA in 2 years? Is 4+3 a lot?",
+    "Where can I buy a 12V 5A adapter and a 220-v fan < 50 dollars?",
+    "What's the best way to learn C++/Java in 2 months at 10 hours per day?",
+    "Why is the 1,000,000 dollar question so hard; can one solve x^2+y^2=z^2?",
+    "Who's the best co-founder for a non-profit, well-known, state-of-the-art start-up?",
+    "",
+    " ",
+    "?",
+]
+
+
+def iter_questions(path=None, limit=None, repeat=1):
+    """Yield questions from a Quora pair csv, or the golden corpus when path is None."""
+    if path is None:
+        questions = itertools.chain.from_iterable(itertools.repeat(GOLDEN_QUESTIONS, repeat))
+    else:
+        questions = _iter_csv_questions(path)
+    return itertools.islice(questions, limit)
+
+
+def _iter_csv_questions(path):
+    with open(path, encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield row['question1']
+            yield row['question2']
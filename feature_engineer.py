@@ -3,14 +3,24 @@ import numpy as np
 import gensim
 from fuzzywuzzy import fuzz
 from nltk.corpus import stopwords
-from tqdm import tqdm
 from scipy.stats import skew, kurtosis
-from scipy.spatial.distance import cosine, cityblock, canberra, minkowski, braycurtis
 from nltk import word_tokenize
 from nltk.tokenize import RegexpTokenizer
 from nltk.stem.porter import PorterStemmer
+import collections
+import functools
+import hashlib
+import inspect
+import itertools
+import json
+import multiprocessing
 import logging
+import os
+import pickle
 import sys
+import time
+
+log = logging.getLogger(__name__)
 
 # Set parameters
 stop_words = set(stopwords.words('english'))
@@ -125,7 +135,9 @@ def calculate_tfidf(qs):
     vectorizer = TfidfVectorizer(min_df=1)
     vectorizer.fit_transform(qs)
     idf = vectorizer.idf_
-    dict_tfidf = dict(zip(vectorizer.get_feature_names(), idf))
+    # get_feature_names is get_feature_names_out from scikit-learn 1.0 on
+    names = getattr(vectorizer, 'get_feature_names_out', None) or vectorizer.get_feature_names
+    dict_tfidf = dict(zip(names(), idf))
     # log.info('\nMost common words and weights:')
     # log.info(sorted(dict_tfidf.items(), key=lambda x: x[1] if x[1] > 0 else 9999)[:10])
     # log.info('\nLeast common words and weights: ')
@@ -134,6 +146,30 @@ def calculate_tfidf(qs):
     return dict_tfidf
 
 
+def fit_tfidf(question_chunks):
+    """calculate_tfidf of all the questions in question_chunks, an iterable of lists of questions.
+
+    Only the document frequencies are kept from chunk to chunk, so the
+    questions can be streamed from disk. Same weights as calculate_tfidf
+    of the concatenated chunks.
+    """
+    import collections
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    analyzer = TfidfVectorizer(min_df=1).build_analyzer()
+    counts = collections.Counter()
+    n = 0
+    for questions in question_chunks:
+        for q in questions:
+            counts.update(set(analyzer(q)))
+        n += len(questions)
+    words = sorted(counts)
+    # TfidfVectorizer's smooth_idf formula
+    df = np.array([counts[w] for w in words], dtype=np.float64) + 1
+    idf = np.log((n + 1) / df) + 1
+    return dict(zip(words, idf))
+
+
 def jaccard(row):
     wic = set(row['q1_split']).intersection(set(row['q2_split']))
     uw = set(row['q1_split']).union(row['q2_split'])
@@ -257,6 +293,182 @@ def get_weight(count, eps=10000, min_count=2):
         return 1 / (count + eps)
 
 
+def _binary_rows(ids, lengths, n_cols):
+    # CSR matrix with a 1 for every distinct id of every row
+    from scipy.sparse import csr_matrix
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    m = csr_matrix((np.ones(len(ids)), ids, indptr), shape=(len(lengths), n_cols))
+    m.sum_duplicates()
+    m.data[:] = 1
+    return m
+
+
+def _row_sums(m, column_weights=None):
+    if column_weights is None:
+        return np.asarray(m.sum(axis=1)).ravel()
+    return m @ column_weights
+
+
+def _ratio(l1, l2):
+    # Vectorized wc_ratio / wc_ratio_unique: nan when l2 is 0, 0 when l1 is 0, else l2 / l1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(l2 == 0, np.nan, np.where(l1 == 0, 0., l2 / l1))
+
+
+def _match_share(shared, total, n1, n2):
+    # word_match_share and friends: 0 when either question has no words left
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((n1 == 0) | (n2 == 0), 0., shared / total)
+
+
+def set_overlap_features(data, stops, weights):
+    """Features 11-20, 55-60 and 68 of build_features in one pass over data.
+
+    q1_split and q2_split become binary token matrices over one shared
+    vocabulary, so every set size is a row sum: intersections are the
+    elementwise product of the two matrices, stop words a column mask and
+    the tf-idf weights a column vector. The characters of question1 and
+    question2 (feature 56) get the same treatment with code points as
+    columns. Same values as the row-wise functions above.
+    """
+    n = data.shape[0]
+    token_lists = data.q1_split.tolist() + data.q2_split.tolist()
+    lengths = np.fromiter(map(len, token_lists), dtype=np.int64, count=2 * n)
+    ids, vocab = pd.factorize(pd.Series(list(itertools.chain.from_iterable(token_lists)), dtype=object))
+    tokens = _binary_rows(ids, lengths, len(vocab))
+    q1, q2 = tokens[:n], tokens[n:]
+    both = q1.multiply(q2).tocsr()
+
+    not_stop = (~vocab.isin(list(stops))).astype(np.float64)
+    idf = np.array([weights.get(w, 0) for w in vocab], dtype=np.float64)
+
+    len1, len2 = lengths[:n], lengths[n:]
+    unq1, unq2, common = _row_sums(q1), _row_sums(q2), _row_sums(both)
+    unq1_stop, unq2_stop = _row_sums(q1, not_stop), _row_sums(q2, not_stop)
+    common_stop = _row_sums(both, not_stop)
+    union = unq1 + unq2 - common
+
+    # First and last token of every question, for same_start / same_end
+    starts = np.cumsum(lengths) - lengths
+    padded = np.append(ids, -1)
+    first, last = padded[starts], padded[starts + lengths - 1]
+    has_words = (len1 > 0) & (len2 > 0)
+
+    questions = data.question1.astype(str).tolist() + data.question2.astype(str).tolist()
+    codes = np.frombuffer(''.join(questions).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    chars = _binary_rows(codes, np.fromiter(map(len, questions), dtype=np.int64, count=2 * n), 0x110000)
+
+    X = pd.DataFrame(index=data.index)
+    X['word_count_diff'] = np.abs(len1 - len2)
+    X['word_count_ratio'] = _ratio(len1 * 1.0, len2)
+    X['total_unique_words'] = union.astype(np.int64)
+    X['wc_diff_unique'] = np.abs(unq1 - unq2).astype(np.int64)
+    X['wc_ratio_unique'] = _ratio(unq1, unq2)
+    X['total_unq_words_stop'] = (unq1_stop + unq2_stop - common_stop).astype(np.int64)
+    X['wc_diff_unique_stop'] = np.abs(unq1_stop - unq2_stop).astype(np.int64)
+    X['wc_ratio_unique_stop'] = _ratio(unq1_stop, unq2_stop)
+    X['same_start'] = np.where(has_words, (first[:n] == first[n:]).astype(np.float64), np.nan)
+    X['same_end'] = np.where(has_words, (last[:n] == last[n:]).astype(np.float64), np.nan)
+    X['common_words'] = common.astype(np.int64)
+    X['common_words_unique'] = _row_sums(chars[:n].multiply(chars[n:])).astype(np.int64)
+    X['word_match'] = _match_share(2 * common, unq1 + unq2, unq1, unq2)
+    X['word_match_stops'] = _match_share(2 * common_stop, unq1_stop + unq2_stop, unq1_stop, unq2_stop)
+    X['tfidf_wm'] = _match_share(2 * _row_sums(both, idf), _row_sums(q1, idf) + _row_sums(q2, idf), unq1, unq2)
+    X['tfidf_wm_stops'] = _match_share(2 * _row_sums(both, idf * not_stop),
+                                       _row_sums(q1, idf * not_stop) + _row_sums(q2, idf * not_stop),
+                                       unq1_stop, unq2_stop)
+    X['jaccard'] = np.where(union > 0, common / np.maximum(union, 1), 0.)
+    return X
+
+
+# 61~67, in the order build_features writes them
+FUZZY_COLUMNS = ['fuzz_qratio', 'fuzz_WRatio', 'fuzz_partial_ratio', 'fuzz_partial_token_set_ratio',
+                 'fuzz_partial_token_sort_ratio', 'fuzz_token_set_ratio', 'fuzz_token_sort_ratio']
+
+
+def _fuzzy_forms(s):
+    # What every fuzz.* scorer derives from a string: processed, token-sorted and token set
+    processed = fuzz.utils.full_process(s, force_ascii=True)
+    tokens = processed.split()
+    return processed, ' '.join(sorted(tokens)), frozenset(tokens)
+
+
+def _token_set_strings(tokens1, tokens2):
+    # The three strings fuzz._token_set compares
+    sect = ' '.join(sorted(tokens1 & tokens2))
+    combined_1to2 = (sect + ' ' + ' '.join(sorted(tokens1 - tokens2))).strip()
+    combined_2to1 = (sect + ' ' + ' '.join(sorted(tokens2 - tokens1))).strip()
+    return sect.strip(), combined_1to2, combined_2to1
+
+
+def fuzzy_scores(s1, s2, forms1=None, forms2=None):
+    """The seven fuzzywuzzy scores of FUZZY_COLUMNS for one pair, sharing the work between them.
+
+    Every string is processed and token-sorted once, and each ratio that
+    several scorers need (WRatio reuses QRatio and the token ratios) is
+    computed once. Same values as calling the fuzz.* functions one by one.
+    """
+    p1, sorted1, tokens1 = forms1 or _fuzzy_forms(s1)
+    p2, sorted2, tokens2 = forms2 or _fuzzy_forms(s2)
+
+    partial = fuzz.partial_ratio(s1, s2)
+    token_sort = fuzz.ratio(sorted1, sorted2)
+    partial_token_sort = fuzz.partial_ratio(sorted1, sorted2)
+    if not p1 or not p2:
+        return 0, 0, partial, 0, partial_token_sort, 0, token_sort
+
+    qratio = fuzz.ratio(p1, p2)
+    sect, combined_1to2, combined_2to1 = _token_set_strings(tokens1, tokens2)
+    token_set = max(fuzz.ratio(sect, combined_1to2), fuzz.ratio(sect, combined_2to1),
+                    fuzz.ratio(combined_1to2, combined_2to1))
+    partial_token_set = max(fuzz.partial_ratio(sect, combined_1to2), fuzz.partial_ratio(sect, combined_2to1),
+                            fuzz.partial_ratio(combined_1to2, combined_2to1))
+
+    # fuzz.WRatio, from the scores above
+    len_ratio = float(max(len(p1), len(p2))) / min(len(p1), len(p2))
+    if len_ratio < 1.5:
+        wratio = max(qratio, token_sort * .95, token_set * .95)
+    else:
+        partial_scale = .6 if len_ratio > 8 else .9
+        wratio = max(qratio, fuzz.partial_ratio(p1, p2) * partial_scale,
+                     partial_token_sort * .95 * partial_scale, partial_token_set * .95 * partial_scale)
+    wratio = fuzz.utils.intr(wratio)
+
+    return qratio, wratio, partial, partial_token_set, partial_token_sort, token_set, token_sort
+
+
+def _fuzzy_chunk(pairs):
+    block = np.empty((len(pairs), len(FUZZY_COLUMNS)), dtype=np.float32)
+    forms = {}
+    for i, (s1, s2) in enumerate(pairs):
+        for s in (s1, s2):
+            if s not in forms:
+                forms[s] = _fuzzy_forms(s)
+        block[i] = fuzzy_scores(s1, s2, forms[s1], forms[s2])
+    return block
+
+
+def fuzzy_features(data, n_jobs=None, chunksize=20000):
+    """float32 block of the FUZZY_COLUMNS scores of every pair in data.
+
+    Pairs are scored in chunks of chunksize over n_jobs processes (all
+    cores by default, 1 runs in-process); within a chunk every distinct
+    question is processed once.
+    """
+    pairs = list(zip(data.question1.astype(str), data.question2.astype(str)))
+    chunks = [pairs[i:i + chunksize] for i in range(0, len(pairs), chunksize)]
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1 or len(chunks) <= 1:
+        blocks = [_fuzzy_chunk(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(min(n_jobs, len(chunks))) as pool:
+            blocks = pool.map(_fuzzy_chunk, chunks)
+    if not blocks:
+        return np.empty((0, len(FUZZY_COLUMNS)), dtype=np.float32)
+    return np.concatenate(blocks)
+
+
 def wmd(divided_s1, divided_s2):
     s1 = [w for w in divided_s1 if w not in stop_words]
     s2 = [w for w in divided_s2 if w not in stop_words]
@@ -269,6 +481,132 @@ def norm_wmd(divided_s1, divided_s2):
     return norm_model.wmdistance(s1, s2)
 
 
+WMD_COLUMNS = ['wmd', 'wcd', 'rwmd']
+
+# Word vectors of the WMD workers (see _wmd_init)
+_wmd_vectors = None
+
+
+def _wmd_init(vectors):
+    # vectors is the embedding matrix, or the path of its .npy to memory-map
+    global _wmd_vectors
+    _wmd_vectors = np.load(vectors, mmap_mode='r') if isinstance(vectors, str) else vectors
+    _word_distances.cache_clear()
+
+
+@functools.lru_cache(maxsize=50000)
+def _word_distances(words1, words2):
+    # Euclidean distances between the distinct words of a pair, shared by
+    # every pair with the same two vocabularies
+    from scipy.spatial.distance import cdist
+    return cdist(_wmd_vectors[list(words1)], _wmd_vectors[list(words2)])
+
+
+def _emd(d1, d2, distances):
+    # Exact earth mover's distance between the weights d1 and d2
+    try:
+        from ot import emd2
+    except ImportError:
+        pass
+    else:
+        return float(emd2(d1, d2, distances))
+    if len(d1) == 1 or len(d2) == 1:
+        # All the mass moves from (or to) the single word
+        return float(np.dot(d2, distances[0]) if len(d1) == 1 else np.dot(d1, distances[:, 0]))
+    from scipy.optimize import linprog
+    n1, n2 = distances.shape
+    # Row sums equal d1, column sums equal d2 (the last one is implied)
+    constraints = np.zeros((n1 + n2 - 1, n1 * n2))
+    for i in range(n1):
+        constraints[i, i * n2:(i + 1) * n2] = 1
+    for j in range(n2 - 1):
+        constraints[n1 + j, j::n2] = 1
+    result = linprog(distances.ravel(), A_eq=constraints, b_eq=np.concatenate([d1, d2[:-1]]),
+                     bounds=(0, None), method='highs')
+    return float(result.fun)
+
+
+def word_movers_distances(ids1, ids2, exact=True):
+    """WMD, word centroid distance and relaxed WMD of two documents of word ids.
+
+    Same conventions as KeyedVectors.wmdistance on the vectors _wmd_init
+    set: inf when a document is empty, 0 when both are the same single
+    word, and inf when every word distance is zero. The centroid and
+    relaxed distances are lower bounds of the WMD; with exact=False the
+    relaxed distance stands in for it and no transport problem is solved.
+    """
+    if not len(ids1) or not len(ids2):
+        return np.inf, np.inf, np.inf
+    words1, counts1 = np.unique(ids1, return_counts=True)
+    words2, counts2 = np.unique(ids2, return_counts=True)
+    if len(words1) == 1 and len(words2) == 1 and words1[0] == words2[0]:
+        return 0., 0., 0.
+    d1 = counts1 / float(len(ids1))
+    d2 = counts2 / float(len(ids2))
+    distances = _word_distances(tuple(words1.tolist()), tuple(words2.tolist()))
+
+    centroid = (np.dot(d1, _wmd_vectors[words1].astype(np.float64)) -
+                np.dot(d2, _wmd_vectors[words2].astype(np.float64)))
+    wcd = float(np.sqrt(np.dot(centroid, centroid)))
+    rwmd = float(max(np.dot(d1, distances.min(axis=1)), np.dot(d2, distances.min(axis=0))))
+    if abs(distances.sum()) < 1e-8:
+        return np.inf, wcd, rwmd
+    return (_emd(d1, d2, distances) if exact else rwmd), wcd, rwmd
+
+
+def _wmd_chunk(args):
+    pairs, exact = args
+    block = np.empty((len(pairs), len(WMD_COLUMNS)), dtype=np.float64)
+    done = {}
+    for i, pair in enumerate(pairs):
+        if pair not in done:
+            done[pair] = word_movers_distances(np.array(pair[0], dtype=np.int64),
+                                               np.array(pair[1], dtype=np.int64), exact)
+        block[i] = done[pair]
+    return block
+
+
+def _document_ids(model, divided_s):
+    # The in-vocabulary non-stop words wmd() hands to wmdistance, as row ids of model.vectors
+    key_to_index = getattr(model, 'key_to_index', None)
+    ids = []
+    for w in divided_s:
+        if w in stop_words:
+            continue
+        idx = key_to_index.get(w) if key_to_index is not None else getattr(model.vocab.get(w), 'index', None)
+        if idx is not None:
+            ids.append(idx)
+    return tuple(ids)
+
+
+def wmd_features(data, model, exact=True, n_jobs=None, chunksize=10000):
+    """WMD_COLUMNS of every pair of q1_split and q2_split, over model's vectors.
+
+    wmd is wmd() (norm_wmd() with norm_model), wcd and rwmd its word
+    centroid and relaxed lower bounds. exact=False returns rwmd in place
+    of the exact solution. Pairs are mapped to word ids here and solved in
+    chunks of chunksize over n_jobs processes (all cores by default, 1
+    runs in-process); a memory-mapped model is reopened by the workers
+    instead of copied to them.
+    """
+    pairs = [(_document_ids(model, s1), _document_ids(model, s2))
+             for s1, s2 in zip(data.q1_split, data.q2_split)]
+    chunks = [(pairs[i:i + chunksize], exact) for i in range(0, len(pairs), chunksize)]
+    vectors = model.vectors
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1 or len(chunks) <= 1:
+        _wmd_init(vectors)
+        blocks = [_wmd_chunk(chunk) for chunk in chunks]
+    else:
+        if isinstance(vectors, np.memmap) and vectors.filename:
+            vectors = vectors.filename
+        with multiprocessing.Pool(min(n_jobs, len(chunks)), initializer=_wmd_init, initargs=(vectors,)) as pool:
+            blocks = pool.map(_wmd_chunk, chunks)
+    block = np.concatenate(blocks) if blocks else np.empty((0, len(WMD_COLUMNS)))
+    return pd.DataFrame(block, index=data.index, columns=WMD_COLUMNS)
+
+
 def sent2vec(s):
     # words = str(s).lower().decode('utf-8')
     words = str(s).lower()
@@ -286,94 +624,332 @@ def sent2vec(s):
     return v / np.sqrt((v ** 2).sum())
 
 
+def _sent2vec_words(s):
+    # The words sent2vec sums, before the vocabulary lookup
+    words = word_tokenize(str(s).lower())
+    return [w for w in words if w not in stop_words and w.isalpha()]
+
+
+def sent2vec_matrix(questions, model):
+    """sent2vec of every question in questions, as one float32 matrix.
+
+    Each question becomes a row of a sparse word-count matrix over the
+    embedding vocabulary, so all the vector sums are a single sparse-dense
+    product with model.vectors; only the rows of the words that occur are
+    read. Questions without a known word get a row of nan, like sent2vec.
+    """
+    from scipy.sparse import csr_matrix
+    key_to_index = getattr(model, 'key_to_index', None)
+    indptr = [0]
+    indices = []
+    for q in questions:
+        for w in _sent2vec_words(q):
+            idx = key_to_index.get(w) if key_to_index is not None else getattr(model.vocab.get(w), 'index', None)
+            if idx is not None:
+                indices.append(idx)
+        indptr.append(len(indices))
+    counts = csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr),
+                        shape=(len(questions), model.vectors.shape[0]))
+    v = np.asarray(counts @ model.vectors, dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return v / np.sqrt((v ** 2).sum(axis=1))[:, np.newaxis]
+
+
+def _vectors_digest(model):
+    # Identifies an embedding by its size and a sample of its rows
+    h = hashlib.sha1(repr(model.vectors.shape).encode('utf-8'))
+    h.update(np.ascontiguousarray(model.vectors[:100]).tobytes())
+    h.update(np.ascontiguousarray(model.vectors[-100:]).tobytes())
+    return h.hexdigest()
+
+
+def _embedding_version(model):
+    # The embedding and the sent2vec code, for the question vector cache
+    h = hashlib.sha1(_vectors_digest(model).encode('utf-8'))
+    for func in (_sent2vec_words, sent2vec_matrix):
+        h.update(inspect.getsource(func).encode('utf-8'))
+    return 'sent2vec-' + h.hexdigest()[:16]
+
+
+def question_vectors(questions, model, cache_path=None):
+    """sent2vec_matrix of questions, computed once per distinct question and cached on disk.
+
+    The float32 vectors are kept in the preprocessing cache (cache_path),
+    keyed by the question text and the embedding, so later runs and the
+    other split only compute questions they have not seen.
+    """
+    import preprocessing
+    if cache_path is None:
+        cache_path = preprocessing.PREPROCESSING_CACHE_PATH
+    compute = lambda texts: [row.tobytes() for row in sent2vec_matrix(texts, model)]
+    vectors = np.empty((len(questions), model.vectors.shape[1]), dtype=np.float32)
+    cached = preprocessing.through_cache(map(str, questions), compute, _embedding_version(model), cache_path)
+    for i, blob in enumerate(cached):
+        vectors[i] = np.frombuffer(blob, dtype=np.float32)
+    return vectors
+
+
+VECTOR_COLUMNS = ['cosine_distance', 'cityblock_distance', 'canberra_distance', 'minkowski_distance',
+                  'braycurtis_distance', 'skew_q1vec', 'skew_q2vec', 'kur_q1vec', 'kur_q2vec']  # 71~79
+
+
+def vector_distance_features(question1_vectors, question2_vectors, chunksize=100000):
+    """Features 71-79 of build_features from the two question vector matrices.
+
+    The scipy.spatial.distance functions and the scipy.stats moments are
+    computed as row-wise reductions over chunks of chunksize rows, in
+    float64 and after a single nan_to_num per chunk. Same values as the
+    per-row calls, including nan for the distances to an all-zero vector.
+    """
+    n = question1_vectors.shape[0]
+    out = np.empty((n, len(VECTOR_COLUMNS)), dtype=np.float64)
+    for start in range(0, n, chunksize):
+        u = np.nan_to_num(np.asarray(question1_vectors[start:start + chunksize], dtype=np.float64))
+        v = np.nan_to_num(np.asarray(question2_vectors[start:start + chunksize], dtype=np.float64))
+        abs_diff = np.abs(u - v)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = 1.0 - np.einsum('ij,ij->i', u, v) / np.sqrt(np.einsum('ij,ij->i', u, u) *
+                                                                 np.einsum('ij,ij->i', v, v))
+            canberra = np.nansum(abs_diff / (np.abs(u) + np.abs(v)), axis=1)
+            braycurtis = abs_diff.sum(axis=1) / np.abs(u + v).sum(axis=1)
+        block = out[start:start + len(u)]
+        block[:, 0] = np.clip(cosine, 0.0, 2.0)
+        block[:, 1] = abs_diff.sum(axis=1)
+        block[:, 2] = canberra
+        block[:, 3] = (abs_diff ** 3).sum(axis=1) ** (1.0 / 3)
+        block[:, 4] = braycurtis
+        block[:, 5], block[:, 6] = skew(u, axis=1), skew(v, axis=1)
+        block[:, 7], block[:, 8] = kurtosis(u, axis=1), kurtosis(v, axis=1)
+    return pd.DataFrame(out, columns=VECTOR_COLUMNS)
+
+
+_doc_tokenizer = RegexpTokenizer(r'\w+')
+_stemmer = PorterStemmer()
+
+
+@functools.lru_cache(maxsize=2 ** 20)
+def _stem(word):
+    return _stemmer.stem(word)
+
+
 def clean_doc(s):
     # clean and tokenize document string
-    raw = s.lower()
-    tokenizer = RegexpTokenizer(r'\w+')
-    tokens = tokenizer.tokenize(raw)
+    tokens = _doc_tokenizer.tokenize(s.lower())
+    # remove stop words from tokens and stem them
+    return [_stem(i) for i in tokens if i not in stop_words]
 
-    # remove stop words from tokens
-    stopped_tokens = [i for i in tokens if i not in stop_words]
 
-    # Create p_stemmer of class PorterStemmer
-    p_stemmer = PorterStemmer()
-    # stem tokens
-    stemmed_tokens = [p_stemmer.stem(i) for i in stopped_tokens]
-    return stemmed_tokens
+def clean_docs(questions):
+    """clean_doc of every question, computed once per distinct question."""
+    codes, uniques = pd.factorize(pd.Series(list(map(str, questions)), dtype=object))
+    cleaned = [clean_doc(q) for q in uniques]
+    return [cleaned[c] for c in codes]
 
 
-def train_lda(texts, num_topics=20):
+def train_lda(texts, num_topics=20, workers=None):
+    # workers=1 trains the single-core LdaModel, otherwise LdaMulticore
+    # runs on workers processes (all cores but one by default)
     dictionary = gensim.corpora.Dictionary(texts)
     # convert tokenized documents into a document-term matrix
     corpus = [dictionary.doc2bow(text) for text in texts]
     del texts
-    lda = gensim.models.ldamodel.LdaModel(corpus, num_topics=num_topics, id2word=dictionary, passes=20)
+    if workers == 1:
+        lda = gensim.models.ldamodel.LdaModel(corpus, num_topics=num_topics, id2word=dictionary, passes=20)
+    else:
+        lda = gensim.models.ldamulticore.LdaMulticore(corpus, num_topics=num_topics, id2word=dictionary,
+                                                      passes=20, workers=workers)
     lsi = gensim.models.lsimodel.LsiModel(corpus, num_topics=num_topics, id2word=dictionary)
     return dictionary, lda, lsi
 
 
+def topic_features(questions, dictionary, lda_model, lsi_model, num_topics, chunksize=10000):
+    """Dense float32 (n, num_topics) LDA and LSI topic matrices of questions.
+
+    Every distinct question is cleaned and inferred once, in chunks of
+    chunksize documents: one LdaModel.inference and one sparse-dense
+    product with the LSI projection per chunk. Same values as
+    dict(model[bow]).get(idx, 0), including LDA's minimum_probability
+    cut-off and the near-zero LSI weights full2sparse drops.
+    """
+    codes, uniques = pd.factorize(pd.Series(list(map(str, questions)), dtype=object))
+    corpus = [dictionary.doc2bow(text) for text in clean_docs(uniques)]
+    lda = np.zeros((len(corpus), num_topics), dtype=np.float32)
+    lsi = np.zeros((len(corpus), num_topics), dtype=np.float32)
+    minimum_probability = max(lda_model.minimum_probability, 1e-8)
+    projection = lsi_model.projection.u[:, :lsi_model.num_topics]
+    for start in range(0, len(corpus), chunksize):
+        chunk = corpus[start:start + chunksize]
+        gamma, _ = lda_model.inference(chunk)
+        topics = gamma / gamma.sum(axis=1)[:, np.newaxis]
+        topics[topics < minimum_probability] = 0
+        lda[start:start + len(chunk)] = topics[:, :num_topics]
+
+        bows = gensim.matutils.corpus2csc(chunk, num_terms=lsi_model.num_terms, num_docs=len(chunk),
+                                          dtype=projection.dtype)
+        topics = np.asarray(bows.T @ projection)
+        topics[np.abs(topics) <= 1e-9] = 0
+        lsi[start:start + len(chunk), :topics.shape[1]] = topics[:, :num_topics]
+    return lda[codes], lsi[codes]
+
+
 def char_ngrams(n, word):
     return [word[i:i + n] for i in range(len(word)-n+1)]
 
 
-def prepare_df(path):
-    df = pd.read_csv(path)
+# Character n-gram similarities, three per n: the order build_features writes them
+CHAR_NGRAM_SIZES = (2, 3, 4, 5)
+CHAR_NGRAM_COLUMNS = ['char%d_%s' % (n, kind) for n in CHAR_NGRAM_SIZES
+                      for kind in ('cosine', 'jaccard', 'containment')]
+
+
+def _ngram_buckets(codes, n, hash_bits):
+    # Hash bucket of the n code points starting at every position: a
+    # polynomial hash wrapping in uint64, spread over 2 ** hash_bits
+    # buckets by multiplying with the golden ratio
+    count = len(codes) - n + 1
+    h = np.zeros(max(count, 0), dtype=np.uint64)
+    for k in range(n):
+        h = h * np.uint64(1000003) + codes[k:k + count]
+    return ((h * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(64 - hash_bits)).astype(np.int64)
+
+
+def _char_ngram_chunk(token_lists, hash_bits=20):
+    # CHAR_NGRAM_COLUMNS of a chunk, given the q1_split lists of its pairs
+    # followed by their q2_split lists. All words are one code point
+    # array with a space after every word, and an n-gram counts where its
+    # window holds no space, i.e. char_ngrams(n, word) of every word.
+    from scipy.sparse import csr_matrix
+
+    m = len(token_lists) // 2
+    texts = [' '.join(tokens) + ' ' for tokens in token_lists]
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer(''.join(texts).encode('utf-32-le', 'surrogatepass'), dtype=np.uint32).astype(np.uint64)
+    rows = np.repeat(np.arange(len(texts)), lengths)
+    spaces = np.concatenate([[0], np.cumsum(codes == ord(' '))])
+    block = np.zeros((m, len(CHAR_NGRAM_COLUMNS)), dtype=np.float32)
+    for j, n in enumerate(CHAR_NGRAM_SIZES):
+        count = max(len(codes) - n + 1, 0)
+        inside = spaces[n:n + count] == spaces[:count]
+        buckets = _ngram_buckets(codes, n, hash_bits)[inside]
+        counts = csr_matrix((np.ones(len(buckets)), (rows[:count][inside], buckets)),
+                            shape=(len(texts), 2 ** hash_bits))
+        present = counts.copy()
+        present.data[:] = 1
+        c1, c2, p1, p2 = counts[:m], counts[m:], present[:m], present[m:]
+
+        norms = np.sqrt(_row_sums(c1.multiply(c1)) * _row_sums(c2.multiply(c2)))
+        shared, size1, size2 = _row_sums(p1.multiply(p2)), _row_sums(p1), _row_sums(p2)
+        union, smaller = size1 + size2 - shared, np.minimum(size1, size2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            block[:, 3 * j] = np.where(norms > 0, _row_sums(c1.multiply(c2)) / norms, 0.)
+            block[:, 3 * j + 1] = np.where(union > 0, shared / union, 0.)
+            block[:, 3 * j + 2] = np.where(smaller > 0, shared / smaller, 0.)
+    return block
+
+
+def char_ngram_features(data, n_jobs=None, chunksize=20000, hash_bits=20):
+    """float32 block of the CHAR_NGRAM_COLUMNS of every pair in data.
+
+    For n = 2..5, the char_ngrams of the words of q1_split and q2_split
+    give per question a vector of n-gram counts, hashed into 2 **
+    hash_bits columns of a sparse matrix: cosine is that of the count
+    vectors, jaccard and containment (shared over the smaller) those of
+    the sets of n-grams. A pair with no n-gram on one side scores 0. All
+    are row-wise sparse products, for chunks of chunksize pairs over
+    n_jobs processes (all cores by default, 1 runs in-process).
+    """
+    splits = list(zip(data.q1_split, data.q2_split))
+    chunks = [[s1 for s1, _ in splits[i:i + chunksize]] + [s2 for _, s2 in splits[i:i + chunksize]]
+              for i in range(0, len(splits), chunksize)]
+    compute = functools.partial(_char_ngram_chunk, hash_bits=hash_bits)
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1 or len(chunks) <= 1:
+        blocks = [compute(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.Pool(min(n_jobs, len(chunks))) as pool:
+            blocks = pool.map(compute, chunks)
+    if not blocks:
+        return np.empty((0, len(CHAR_NGRAM_COLUMNS)), dtype=np.float32)
+    return np.concatenate(blocks)
+
+
+def question_entities(data, n_jobs=None, cache_path=None):
+    """Named entities of every distinct question in data.
+
+    Returns the entity table (one row per question id and entity) and the
+    question ids of question1 and question2. NER runs once per distinct
+    question, batched over n_jobs processes and memoized in cache_path.
+    """
+    import preprocessing
+    if cache_path is None:
+        cache_path = preprocessing.PREPROCESSING_CACHE_PATH
+    n = data.shape[0]
+    ids, questions = pd.factorize(pd.concat([data.question1, data.question2]).astype(str))
+    table = pd.DataFrame(list(preprocessing.entity_table(range(len(questions)), questions, n_jobs,
+                                                         cache_path=cache_path)),
+                         columns=['qid', 'entity'])
+    return table, ids[:n], ids[n:]
+
+
+def entity_overlap_features(data, n_jobs=None, cache_path=None):
+    table, q1_ids, q2_ids = question_entities(data, n_jobs, cache_path)
+    entities = table.groupby('qid')['entity'].agg(frozenset).to_dict()
+    empty = frozenset()
+    e1 = [entities.get(i, empty) for i in q1_ids]
+    e2 = [entities.get(i, empty) for i in q2_ids]
+
+    X = pd.DataFrame(index=data.index)
+    X['entity_count_q1'] = [len(e) for e in e1]
+    X['entity_count_q2'] = [len(e) for e in e2]
+    X['common_entities'] = [len(a & b) for a, b in zip(e1, e2)]
+    union = np.array([len(a | b) for a, b in zip(e1, e2)], dtype=float)
+    X['entity_jaccard'] = np.where(union > 0, X['common_entities'] / np.maximum(union, 1), 0.)
+    return X
+
+
+def prepare_frame(df, clean_text=False, n_jobs=None, cache_path=None):
+    # Empty questions, the optional cleaning and the split columns of one frame of pairs
     df = df.fillna(' ')
 
+    if clean_text:
+        # Same cleaning (and the same on-disk cache) as the Keras scripts
+        import preprocessing
+        if cache_path is None:
+            cache_path = preprocessing.PREPROCESSING_CACHE_PATH
+        n = len(df)
+        qs = df['question1'].astype(str).tolist() + df['question2'].astype(str).tolist()
+        qs = list(preprocessing.preprocess_corpus(qs, n_jobs, cache_path=cache_path))
+        df['question1'] = qs[:n]
+        df['question2'] = qs[n:]
+
     # 斷詞(中文的話這段要另外做斷詞)
     df['q1_split'] = df['question1'].map(lambda x: str(x).lower().split())
     df['q2_split'] = df['question2'].map(lambda x: str(x).lower().split())
     return df
 
 
-def load_glove(path):
-    model = gensim.models.KeyedVectors.load_word2vec_format(path, binary=True)
-
-    norm_model = gensim.models.KeyedVectors.load_word2vec_format(path, binary=True)
-    norm_model.init_sims(replace=True)
-    return model, norm_model
+def prepare_df(path, clean_text=False, n_jobs=None, cache_path=None):
+    # path may also be the Parquet/Feather copy written by quora_data.py
+    import quora_data
+    return prepare_frame(quora_data.read_table(path), clean_text, n_jobs, cache_path)
 
 
-def build_features(data, stops):
-    X = pd.DataFrame()
+def load_glove(path):
+    # Both models are read-only memory maps of one store (see word_vectors.py);
+    # the .bin at path is converted to it the first time
+    import word_vectors
+    model = word_vectors.load_word_vectors(path)
+    norm_model = word_vectors.load_word_vectors(path, normalized=True, like=model)
+    return model, norm_model
 
-    log.info('Calculate tfidf')
-    qs = pd.Series(data['question1'].tolist() + data['question2'].tolist())
-    st = time.time()
-    weights = calculate_tfidf(qs)
-    log.info('...time for cal tfidf: %.2f m' % ((time.time()-st) / 60))
-    del qs
 
-    log.info('Building features')
+def _text_features(data, state):
+    X = pd.DataFrame(index=data.index)
     X['len_q1'] = data.question1.apply(word_len)   # 1:Length of Q1 str
     X['len_q2'] = data.question2.apply(word_len)   # 2:Length of Q2 str
     X['len_diff'] = abs(X.len_q1 - X.len_q2)   # 3:Length difference between Q1 and Q2
 
-    log.info('Building char features')
-    X['len_char_q1'] = data.q1_split.apply(word_len_char)  # 4:Char length of Q1
-    X['len_char_q2'] = data.q2_split.apply(word_len_char)  # 5:Char length of Q2
-    X['len_char_diff'] = data.apply(len_char_diff, axis=1, raw=True)  # 6:Char length difference between Q1 and Q2
-    X['char_diff_unq_stop'] = data.apply(char_diff_unique_stop, stops=stops, axis=1, raw=True)  # 7: set(6)
-    X['char_ratio'] = data.apply(char_ratio, axis=1, raw=True)  # 8:Char length Q1 / char length Q2
-
-    log.info('Building word count features')
-    X['word_count_q1'] = data.q1_split.apply(word_count)  # 9:Word count of Q1
-    X['word_count_q2'] = data.q2_split.apply(word_count)  # 10:Word count of Q2
-    X['word_count_diff'] = data.apply(wc_diff, axis=1, raw=True)  # 11:Word count difference between  Q1 and Q2
-    X['word_count_ratio'] = data.apply(wc_ratio, axis=1, raw=True)  # 12:Word count Q1 / word count Q2
-
-    X['total_unique_words'] = data.apply(total_unique_words, axis=1, raw=True)  # 13:Word count set(Q1 + Q2)
-    X['wc_diff_unique'] = data.apply(wc_diff_unique, axis=1, raw=True)  # 14:Word count set(Q1) - word count set(Q2)
-    X['wc_ratio_unique'] = data.apply(wc_ratio_unique, axis=1, raw=True)  # 15:Word count set(Q1) / word count set(Q2)
-
-    X['total_unq_words_stop'] = data.apply(total_unq_words_stop, stops=stops, axis=1, raw=True)  # 16: 13 - stop words
-    X['wc_diff_unique_stop'] = data.apply(wc_diff_unique_stop, stops=stops, axis=1, raw=True)  # 17: 14 - stop words
-    X['wc_ratio_unique_stop'] = data.apply(wc_ratio_unique_stop, stops=stops, axis=1, raw=True)  # 18: 15 - stop words
-
-    log.info('Building mark features')
-    X['same_start'] = data.apply(same_start_word, axis=1, raw=True)  # 19 same start = 1 else = 0
-    X['same_end'] = data.apply(same_end_word, axis=1, raw=True)  # 20 same end = 1 else = 0
-
     X['num_capital_q1'] = data.question1.apply(num_capital)  # 21
     X['num_capital_q2'] = data.question2.apply(num_capital)  # 22
     X['num_capital_diff'] = abs(X.num_capital_q1 - X.num_capital_q2)  # 23
@@ -381,99 +957,652 @@ def build_features(data, stops):
     X['num_ques_mark_q1'] = data.question1.apply(num_ques_mark)  # 24
     X['num_ques_mark_q2'] = data.question2.apply(num_ques_mark)  # 25
     X['num_ques_mark_diff'] = abs(X.num_ques_mark_q1 - X.num_ques_mark_q2)  # 26
+    return X
+
+
+def _split_features(data, state):
+    X = pd.DataFrame(index=data.index)
+    X['len_char_q1'] = data.q1_split.apply(word_len_char)  # 4:Char length of Q1
+    X['len_char_q2'] = data.q2_split.apply(word_len_char)  # 5:Char length of Q2
+    X['len_char_diff'] = data.apply(len_char_diff, axis=1)  # 6:Char length difference between Q1 and Q2
+    X['char_diff_unq_stop'] = data.apply(char_diff_unique_stop, stops=state.stops, axis=1)  # 7: set(6)
+    X['char_ratio'] = data.apply(char_ratio, axis=1)  # 8:Char length Q1 / char length Q2
+
+    X['word_count_q1'] = data.q1_split.apply(word_count)  # 9:Word count of Q1
+    X['word_count_q2'] = data.q2_split.apply(word_count)  # 10:Word count of Q2
 
-    log.info('Building another features')
     # 27 ~ 27+28(14*2)-1=54: First word in sentence(one hot)
     for start in common_start:
         X['start_%s_%s' % (start, 'q1')] = data.q1_split.apply(start_with, args=(start,))
     for start in common_start:  # 為了讓csv看起來更漂亮(更像one hot)
         X['start_%s_%s' % (start, 'q2')] = data.q2_split.apply(start_with, args=(start,))
+    return X
+
 
-    X['common_words'] = data.apply(common_words, axis=1, raw=True)  # 55:兩句相同的字數
-    X['common_words_unique'] = data.apply(common_words_unit, axis=1, raw=True)  # 56:兩句相同的字母數
+def _overlap_features(data, state):
+    # 11~20, 55~60 and 68 in one pass over sparse token matrices, with
+    # tf-idf weights fitted on data unless fitted ones are given
+    weights = state.weights
+    if weights is None:
+        weights = calculate_tfidf(pd.Series(data['question1'].tolist() + data['question2'].tolist()))
+    return set_overlap_features(data, state.stops, weights)
 
-    X['word_match'] = data.apply(word_match_share, axis=1, raw=True)  # 57:字的重複比例 between Q1 and Q2
-    X['word_match_stops'] = data.apply(word_match_share_stops, stops=stops,
-                                       axis=1, raw=True)  # 58:字的重複比例 without stop word between Q1 and Q2
-    X['tfidf_wm'] = data.apply(tfidf_word_match_share, weights=weights,
-                               axis=1, raw=True)  # 59:字的重複比例 between Q1 and Q2 (TF-IDF值)
-    X['tfidf_wm_stops'] = data.apply(tfidf_word_match_share_stops, stops=stops, weights=weights,
-                                     axis=1, raw=True)  # 60:字的重複比例 without stop word between Q1 and Q2 (TF-IDF值)
 
-    log.info('Building fuzzy features')
+def _fuzzy_group(data, state):
     # 61~67:Build fuzzy features
-    X['fuzz_qratio'] = data.apply(lambda x: fuzz.QRatio(str(x['question1']), str(x['question2'])), axis=1)
-    X['fuzz_WRatio'] = data.apply(lambda x: fuzz.WRatio(str(x['question1']), str(x['question2'])), axis=1)
-    X['fuzz_partial_ratio'] = data.apply(lambda x: fuzz.partial_ratio(str(x['question1']), str(x['question2'])),
-                                         axis=1)
-    X['fuzz_partial_token_set_ratio'] = data.apply(
-        lambda x: fuzz.partial_token_set_ratio(str(x['question1']), str(x['question2'])), axis=1)
-    X['fuzz_partial_token_sort_ratio'] = data.apply(
-        lambda x: fuzz.partial_token_sort_ratio(str(x['question1']), str(x['question2'])), axis=1)
-    X['fuzz_token_set_ratio'] = data.apply(lambda x: fuzz.token_set_ratio(str(x['question1']), str(x['question2'])),
-                                           axis=1)
-    X['fuzz_token_sort_ratio'] = data.apply(
-        lambda x: fuzz.token_sort_ratio(str(x['question1']), str(x['question2'])), axis=1)
-
-    X['jaccard'] = data.apply(jaccard, axis=1, raw=True)  # 68:jaccard distance
-
-    log.info('Build word2vec/glove distance features')
-    # Build word2vec/glove distance features
-    X['wmd'] = data.apply(lambda x: wmd(x['q1_split'], x['q2_split']), axis=1)  # 69
-    X['norm_wmd'] = data.apply(lambda x: norm_wmd(x['q1_split'], x['q2_split']), axis=1)  # 70
-
-    question1_vectors = np.zeros((data.shape[0], 300))
-
-    log.info('Sent2Vec')
-    # Sent2Vec
-    for i, q in tqdm(enumerate(data.question1.values)):
-        question1_vectors[i, :] = sent2vec(q)
-
-    question2_vectors = np.zeros((data.shape[0], 300))
-    for i, q in tqdm(enumerate(data.question2.values)):
-        question2_vectors[i, :] = sent2vec(q)
-
-    log.info('Building distance features')
-    # Build distance features
-    X['cosine_distance'] = [cosine(x, y) for (x, y) in zip(np.nan_to_num(question1_vectors),
-                                                           np.nan_to_num(question2_vectors))]
-    X['cityblock_distance'] = [cityblock(x, y) for (x, y) in zip(np.nan_to_num(question1_vectors),
-                                                                 np.nan_to_num(question2_vectors))]
-    X['canberra_distance'] = [canberra(x, y) for (x, y) in zip(np.nan_to_num(question1_vectors),
-                                                               np.nan_to_num(question2_vectors))]
-    X['minkowski_distance'] = [minkowski(x, y, 3) for (x, y) in zip(np.nan_to_num(question1_vectors),
-                                                                    np.nan_to_num(question2_vectors))]
-    X['braycurtis_distance'] = [braycurtis(x, y) for (x, y) in zip(np.nan_to_num(question1_vectors),
-                                                                   np.nan_to_num(question2_vectors))]
-
-    X['skew_q1vec'] = [skew(x) for x in np.nan_to_num(question1_vectors)]
-    X['skew_q2vec'] = [skew(x) for x in np.nan_to_num(question2_vectors)]
-    X['kur_q1vec'] = [kurtosis(x) for x in np.nan_to_num(question1_vectors)]
-    X['kur_q2vec'] = [kurtosis(x) for x in np.nan_to_num(question2_vectors)]  # 79
-
-    # LDA features
-    topics_q1 = data.question1.apply(lambda x: dict(lda_model[dictionary.doc2bow(clean_doc(x))]))
-    for idx in range(num_topics):
-        X['lda_topic_%s_%s' % (idx, 'q1')] = topics_q1.apply(lambda x: x.get(idx, 0))
-    del topics_q1
-    topics_q2 = data.question2.apply(lambda x: dict(lda_model[dictionary.doc2bow(clean_doc(x))]))
-    for idx in range(num_topics):
-        X['lda_topic_%s_%s' % (idx, 'q2')] = topics_q2.apply(lambda x: x.get(idx, 0))
-    del topics_q2
-
-    # LSI features
-    topics_q1 = data.question1.apply(lambda x: dict(lsi_model[dictionary.doc2bow(clean_doc(x))]))
-    for idx in range(num_topics):
-        X['lsi_topic_%s_%s' % (idx, 'q1')] = topics_q1.apply(lambda x: x.get(idx, 0))
-    del topics_q1
-    topics_q2 = data.question2.apply(lambda x: dict(lsi_model[dictionary.doc2bow(clean_doc(x))]))
-    for idx in range(num_topics):
-        X['lsi_topic_%s_%s' % (idx, 'q2')] = topics_q2.apply(lambda x: x.get(idx, 0))
-    del topics_q2
+    return pd.DataFrame(fuzzy_features(data, state.n_jobs), index=data.index, columns=FUZZY_COLUMNS)
+
+
+def _wmd_group(data, state):
+    # 69, 70 and their word centroid and relaxed word mover's lower bounds
+    distances = wmd_features(data, state.model, n_jobs=state.n_jobs)
+    norm_distances = wmd_features(data, state.norm_model, n_jobs=state.n_jobs)
+    return pd.concat([distances, norm_distances.add_prefix('norm_')], axis=1)
+
 
+def _vector_group(data, state):
+    # 71~79: sent2vec, once per distinct question, and the distances between the vectors
+    vectors = question_vectors(data.question1.tolist() + data.question2.tolist(), state.model)
+    X = vector_distance_features(vectors[:data.shape[0]], vectors[data.shape[0]:])
+    X.index = data.index
     return X
 
 
+# LDA inference draws the starting topic weights of every document from
+# the model's random state; _topic_group seeds it with this, so the same
+# data gets the same features in any process and a cache hit equals a rebuild
+TOPIC_SEED = 0
+
+
+def _topic_group(data, state):
+    # LDA and LSI features, the model's own random state put back afterwards
+    n = data.shape[0]
+    random_state = state.lda_model.random_state
+    state.lda_model.random_state = np.random.RandomState(TOPIC_SEED)
+    try:
+        lda_topics, lsi_topics = topic_features(data.question1.tolist() + data.question2.tolist(),
+                                                state.dictionary, state.lda_model, state.lsi_model, state.num_topics)
+    finally:
+        state.lda_model.random_state = random_state
+    columns = ['%s_topic_%s_%s' % (kind, idx, q) for kind in ('lda', 'lsi') for q in ('q1', 'q2')
+               for idx in range(state.num_topics)]
+    topics = np.hstack([lda_topics[:n], lda_topics[n:], lsi_topics[:n], lsi_topics[n:]])
+    return pd.DataFrame(topics, index=data.index, columns=columns)
+
+
+def _char_ngram_group(data, state):
+    # Hashed character n-gram cosine, jaccard and containment for n = 2..5
+    return pd.DataFrame(char_ngram_features(data, state.n_jobs), index=data.index, columns=CHAR_NGRAM_COLUMNS)
+
+
+def _entity_group(data, state):
+    # Named entities of both questions: counts, shared count and jaccard
+    return entity_overlap_features(data, state.n_jobs)
+
+
+def _fuzzy_backend():
+    # The matcher fuzzywuzzy scores with, python-Levenshtein's or the
+    # difflib fallback, whose ratios can differ
+    return '%s.%s' % (fuzz.SequenceMatcher.__module__, fuzz.SequenceMatcher.__name__)
+
+
+def _topic_models_digest(state):
+    # Identifies the dictionary and the trained LDA and LSI models
+    h = hashlib.sha1(repr(sorted(state.dictionary.token2id.items())).encode('utf-8'))
+    h.update(np.ascontiguousarray(state.lda_model.state.get_lambda()).tobytes())
+    h.update(np.ascontiguousarray(state.lsi_model.projection.u).tobytes())
+    return '%s %s' % (state.num_topics, h.hexdigest())
+
+
+class FeatureGroup(object):
+    """A unit of build_features, cached as a whole.
+
+    compute(data, state) returns the group's columns as a DataFrame,
+    state being the QuoraFeatureExtractor with the stop words and fitted
+    models. functions are the other module functions it runs,
+    params(state) a string for the settings and models it reads: together
+    with the source of compute and the input data they make up the cache
+    key.
+    """
+
+    def __init__(self, name, compute, functions=(), params=None):
+        self.name = name
+        self.compute = compute
+        self.functions = functions
+        self.params = params or (lambda state: '')
+
+    def key(self, state, data_key):
+        h = hashlib.sha1(self.name.encode('utf-8'))
+        for func in (self.compute,) + tuple(self.functions):
+            h.update(inspect.getsource(func).encode('utf-8'))
+        h.update(self.params(state).encode('utf-8'))
+        h.update(data_key.encode('utf-8'))
+        return h.hexdigest()[:16]
+
+
+def _weights_digest(weights):
+    # Fitted tf-idf weights, or 'data' for weights fitted on every frame anew
+    if weights is None:
+        return 'data'
+    return hashlib.sha1(repr(sorted(weights.items())).encode('utf-8')).hexdigest()
+
+
+FEATURE_GROUPS = [
+    FeatureGroup('text', _text_features, (word_len, num_capital, num_ques_mark)),
+    FeatureGroup('split', _split_features,
+                 (word_len_char, len_char_diff, char_diff_unique_stop, char_ratio, word_count, start_with),
+                 lambda state: repr((sorted(state.stops), common_start))),
+    FeatureGroup('overlap', _overlap_features,
+                 (calculate_tfidf, set_overlap_features, _binary_rows, _row_sums, _ratio, _match_share),
+                 lambda state: repr((sorted(state.stops), _weights_digest(state.weights)))),
+    FeatureGroup('fuzzy', _fuzzy_group, (fuzzy_features, _fuzzy_chunk, fuzzy_scores, _fuzzy_forms,
+                                         _token_set_strings),
+                 lambda state: _fuzzy_backend()),
+    FeatureGroup('wmd', _wmd_group, (wmd_features, _document_ids, _wmd_chunk, word_movers_distances,
+                                     _word_distances, _emd),
+                 lambda state: repr((_vectors_digest(state.model), _vectors_digest(state.norm_model),
+                                     sorted(stop_words)))),
+    FeatureGroup('vectors', _vector_group, (question_vectors, vector_distance_features, _sent2vec_words),
+                 lambda state: repr((_embedding_version(state.model), sorted(stop_words)))),
+    FeatureGroup('topics', _topic_group, (topic_features, clean_docs, clean_doc),
+                 lambda state: repr((_topic_models_digest(state), sorted(stop_words), TOPIC_SEED))),
+    FeatureGroup('char_ngrams', _char_ngram_group, (char_ngram_features, _char_ngram_chunk, _ngram_buckets,
+                                                     _row_sums)),
+    FeatureGroup('entities', _entity_group, (entity_overlap_features, question_entities)),
+]
+
+
+def feature_columns(num_topics, entity_features=False):
+    """Column order of build_features."""
+    columns = ['len_q1', 'len_q2', 'len_diff', 'len_char_q1', 'len_char_q2', 'len_char_diff',
+               'char_diff_unq_stop', 'char_ratio', 'word_count_q1', 'word_count_q2',  # 1~10
+               'word_count_diff', 'word_count_ratio', 'total_unique_words', 'wc_diff_unique', 'wc_ratio_unique',
+               'total_unq_words_stop', 'wc_diff_unique_stop', 'wc_ratio_unique_stop',
+               'same_start', 'same_end',  # 11~20
+               'num_capital_q1', 'num_capital_q2', 'num_capital_diff',
+               'num_ques_mark_q1', 'num_ques_mark_q2', 'num_ques_mark_diff']  # 21~26
+    columns += ['start_%s_%s' % (start, q) for q in ('q1', 'q2') for start in common_start]  # 27~54
+    columns += ['common_words', 'common_words_unique', 'word_match', 'word_match_stops',
+                'tfidf_wm', 'tfidf_wm_stops']  # 55~60
+    columns += FUZZY_COLUMNS + ['jaccard', 'wmd', 'norm_wmd'] + VECTOR_COLUMNS  # 61~79
+    columns += ['%s_topic_%s_%s' % (kind, idx, q) for kind in ('lda', 'lsi') for q in ('q1', 'q2')
+                for idx in range(num_topics)]
+    columns += ['wcd', 'rwmd', 'norm_wcd', 'norm_rwmd']
+    columns += CHAR_NGRAM_COLUMNS
+    if entity_features:
+        columns += ['entity_count_q1', 'entity_count_q2', 'common_entities', 'entity_jaccard']
+    return columns
+
+
+# Narrowest dtype holding every value of a column exactly: counts fit
+# uint16 and the start_* one-hots uint8, while same_start and same_end
+# are float16 to keep their NaN for questions without words. The other
+# columns are float32, the precision xgboost.DMatrix and Keras convert
+# their inputs to anyway.
+COUNT_COLUMNS = ['len_q1', 'len_q2', 'len_diff', 'len_char_q1', 'len_char_q2', 'len_char_diff',
+                 'char_diff_unq_stop', 'word_count_q1', 'word_count_q2', 'word_count_diff', 'total_unique_words',
+                 'wc_diff_unique', 'total_unq_words_stop', 'wc_diff_unique_stop', 'num_capital_q1',
+                 'num_capital_q2', 'num_capital_diff', 'num_ques_mark_q1', 'num_ques_mark_q2', 'num_ques_mark_diff',
+                 'common_words', 'common_words_unique', 'entity_count_q1', 'entity_count_q2', 'common_entities']
+FLAG_COLUMNS = ['same_start', 'same_end']
+
+
+def feature_schema(num_topics, entity_features=False):
+    """(column, dtype) of every column of build_features, in feature_columns order."""
+    counts, flags = set(COUNT_COLUMNS), set(FLAG_COLUMNS)
+    schema = []
+    for col in feature_columns(num_topics, entity_features):
+        if col in counts:
+            dtype = np.uint16
+        elif col.startswith('start_'):
+            dtype = np.uint8
+        elif col in flags:
+            dtype = np.float16
+        else:
+            dtype = np.float32
+        schema.append((col, np.dtype(dtype)))
+    return schema
+
+
+def schema_groups(schema):
+    """Columns of schema by dtype, as feature store groups named after it ('uint16', 'float32', ...)."""
+    groups = {}
+    for col, dtype in schema:
+        groups.setdefault(dtype.name, []).append(col)
+    return groups
+
+
+# What a column is widened to when its schema dtype cannot hold it
+WIDER_DTYPES = (np.dtype(np.float32), np.dtype(np.float64))
+
+
+def _holds(values, dtype):
+    # Whether dtype holds values: exactly for the integer and float16
+    # columns; float32 only has to keep every finite value finite, its
+    # rounding being what xgboost.DMatrix and Keras apply anyway
+    with np.errstate(invalid='ignore', over='ignore'):
+        cast = values.astype(dtype)
+        if dtype.kind == 'f' and dtype.itemsize >= 4:
+            return np.array_equal(np.isfinite(cast), np.isfinite(values))
+        return np.array_equal(cast.astype(values.dtype), values, equal_nan=True)
+
+
+def assemble_features(frames, schema, index, widen=True):
+    """DataFrame of the schema columns of the group frames, with the schema dtypes.
+
+    Every dtype gets one preallocated column-major block, filled column
+    by column; the columns of the frame are views of the blocks, so
+    nothing is held twice. The entries of the list frames are set to None
+    as soon as they are copied, so their memory is released on the way.
+    A column with a value its schema dtype cannot hold (a count past
+    65535, a NaN, a float32 overflow) is stored in the first of
+    WIDER_DTYPES that holds it instead, or with widen=False raises a
+    ValueError.
+    """
+    source = {}
+    for i, frame in enumerate(frames):
+        for col in frame.columns:
+            source[col] = i
+    dtypes = {}
+    for col, dtype in schema:
+        if not _holds(frames[source[col]][col].values, dtype):
+            if not widen:
+                raise ValueError('%s does not fit %s, the dtype of its group in feature_schema' % (col, dtype))
+            values = frames[source[col]][col].values
+            wider = next((wider for wider in WIDER_DTYPES if wider != dtype and np.can_cast(dtype, wider) and
+                          _holds(values, wider)), WIDER_DTYPES[-1])
+            log.warning('%s does not fit %s, stored as %s' % (col, dtype, wider))
+            dtype = wider
+        dtypes[col] = dtype
+    slots, widths = {}, collections.Counter()
+    for col, dtype in dtypes.items():
+        slots[col] = widths[dtype]
+        widths[dtype] += 1
+    blocks = {dtype: np.empty((len(index), width), dtype=dtype, order='F') for dtype, width in widths.items()}
+    remaining = collections.Counter(source[col] for col in dtypes)
+    for col in dtypes:
+        i = source[col]
+        blocks[dtypes[col]][:, slots[col]] = frames[i][col].values
+        remaining[i] -= 1
+        if not remaining[i]:
+            frames[i] = None
+    return pd.DataFrame({col: blocks[dtypes[col]][:, slots[col]] for col in dtypes}, index=index, copy=False)
+
+
+def data_digest(data):
+    """Hash of the question and split columns every feature group reads."""
+    h = hashlib.sha1()
+    for col in ('question1', 'question2'):
+        h.update('\x00'.join(map(str, data[col])).encode('utf-8', 'surrogatepass'))
+    for col in ('q1_split', 'q2_split'):
+        h.update('\x00'.join('\x1f'.join(s) for s in data[col]).encode('utf-8', 'surrogatepass'))
+    return h.hexdigest()
+
+
+def build_groups(groups, data, state, cache_dir=None, profile=None, schema=None, widen=True):
+    """Concatenated columns of the FeatureGroups groups for data, with the fitted state.
+
+    With a schema (see feature_schema) the result holds just its columns,
+    in its order and dtypes (see assemble_features and its widen), else
+    all columns as the groups computed them.
+
+    With a cache_dir, every group is looked up there under its key and
+    only the groups without an entry (changed code, parameters, models or
+    data) are computed and then stored; hits, misses and the time the
+    hits saved are logged. A StageProfile profile gets a stage per group,
+    named '<group> (cached)' for a cache hit.
+    """
+    import feature_store
+    import stage_profile
+
+    data_key = data_digest(data) if cache_dir is not None else None
+    frames = []
+    saved = 0.
+    hits = misses = 0
+    for group in groups:
+        st = time.time()
+        entry = None
+        if cache_dir is not None:
+            entry = os.path.join(cache_dir, '%s-%s' % (group.name, group.key(state, data_key)))
+            if os.path.exists(os.path.join(entry, 'timing.json')):
+                with stage_profile.stage(profile, '%s (cached)' % group.name, len(data)):
+                    frame = feature_store.read_features(entry)
+                frame.index = data.index
+                with open(os.path.join(entry, 'timing.json')) as f:
+                    seconds = json.load(f)['seconds']
+                saved += seconds - (time.time() - st)
+                hits += 1
+                log.info('feature group %s: cache hit, %.1f s instead of %.1f s' % (
+                    group.name, time.time() - st, seconds))
+                frames.append(frame)
+                continue
+        log.info('Building %s features' % group.name)
+        with stage_profile.stage(profile, group.name, len(data)):
+            frame = group.compute(data, state)
+        seconds = time.time() - st
+        if entry is not None:
+            misses += 1
+            feature_store.write_group(entry, group.name, frame, fmt='parquet')
+            with open(os.path.join(entry, 'timing.json'), 'w') as f:
+                json.dump({'seconds': seconds}, f)
+            log.info('feature group %s: cache miss, computed in %.1f s' % (group.name, seconds))
+        frames.append(frame)
+    if cache_dir is not None:
+        log.info('feature groups: %d hits, %d misses, %.1f m saved' % (hits, misses, saved / 60))
+    if schema is not None:
+        return assemble_features(frames, schema, data.index, widen)
+    return pd.concat(frames, axis=1)
+
+
+class QuoraFeatureExtractor(object):
+    """build_features as fit and transform, with the fitted state in one artifact.
+
+    fit(data) learns the tf-idf weights, the gensim dictionary and the
+    LDA and LSI models from a frame of pairs (see prepare_df) and opens
+    the embeddings at w2v_path (a word_vectors store or word2vec .bin).
+    n_jobs is the number of processes of the groups that run a pool (None:
+    all cores). transform(data) and transform_file(path, store_dir) build the features
+    of any other pairs with that state and never refit it. save(path)
+    pickles the state, with the settings and a digest of the train data
+    it was fit with (see fit_mismatches), into one file; load(path) brings it back in a new
+    process, reopening the embeddings as memory maps instead of storing
+    them.
+    """
+
+    def __init__(self, w2v_path=None, num_topics=100, stops=None, entity_features=False, lda_workers=None,
+                 n_jobs=None):
+        self.w2v_path = w2v_path
+        self.num_topics = num_topics
+        self.stops = stop_words if stops is None else stops
+        self.entity_features = entity_features
+        self.lda_workers = lda_workers
+        self.n_jobs = n_jobs
+        self.weights = None
+        self.dictionary = self.lda_model = self.lsi_model = None
+        self.model = self.norm_model = None
+        # data_digest of the pairs fit() saw
+        self.train_digest = None
+
+    def fit(self, data, profile=None):
+        import stage_profile
+
+        self.train_digest = data_digest(data)
+        questions = data['question1'].tolist() + data['question2'].tolist()
+        with stage_profile.stage(profile, 'calculate_tfidf', len(questions)):
+            self.weights = calculate_tfidf(pd.Series(questions))
+        with stage_profile.stage(profile, 'train_lda', len(questions)):
+            self.dictionary, self.lda_model, self.lsi_model = train_lda(clean_docs(questions), self.num_topics,
+                                                                        self.lda_workers)
+        if self.model is None and self.w2v_path is not None:
+            with stage_profile.stage(profile, 'load_glove'):
+                self.model, self.norm_model = load_glove(self.w2v_path)
+        return self
+
+    def schema(self):
+        return feature_schema(self.num_topics, self.entity_features)
+
+    def fit_mismatches(self, data, w2v_path, num_topics, stops):
+        """Names of the settings, of w2v_path, num_topics, stops and the train data, this extractor was not fit with."""
+        fitted = {'w2v_path': self.w2v_path, 'num_topics': self.num_topics, 'stops': sorted(self.stops),
+                  'train data': self.train_digest}
+        wanted = {'w2v_path': w2v_path, 'num_topics': num_topics, 'stops': sorted(stops),
+                  'train data': data_digest(data)}
+        return [name for name in wanted if fitted[name] != wanted[name]]
+
+    def transform(self, data, cache_dir=None, profile=None, widen=True):
+        """The feature_columns of data, a frame of pairs (see prepare_df), in the compact dtypes of schema().
+
+        A column with values its dtype cannot hold becomes float32, or
+        with widen=False raises a ValueError (see assemble_features).
+        """
+        groups = [group for group in FEATURE_GROUPS if self.entity_features or group.name != 'entities']
+        return build_groups(groups, data, self, cache_dir, profile, self.schema(), widen)
+
+    def transform_file(self, path, store_dir, chunksize=100000, cache_dir=None, clean_text=False, fmt='npy',
+                       dtype=None, profile=None, n_jobs=1):
+        """transform the pairs file at path chunk by chunk into the feature store store_dir.
+
+        The file is read chunksize rows at a time and every chunk's
+        features are written to store_dir as parts of its groups, one per
+        dtype of schema(), before the next chunk is read, so memory depends on chunksize rather than on the size of the file.
+        Once all are written the parts are listed in the manifest; a
+        column some chunk had to widen is widened in all of them first
+        (see _add_chunks), so every group keeps one dtype.
+        With n_jobs > 1 (None: all cores) the chunks are row ranges built
+        by that many worker processes, see _transform_shards; the store is
+        byte for byte the one a single process writes.
+        """
+        import feature_store
+        import quora_data
+        import stage_profile
+
+        if os.path.exists(os.path.join(store_dir, feature_store.MANIFEST_FILE)):
+            raise ValueError('%s already holds features; appending would duplicate rows' % store_dir)
+        if n_jobs is None:
+            n_jobs = multiprocessing.cpu_count()
+        if n_jobs != 1:
+            return self._transform_shards(path, store_dir, chunksize, cache_dir, clean_text, fmt, dtype, profile,
+                                          n_jobs)
+        rows = 0
+        chunks = []
+        for index, chunk in enumerate(quora_data.iter_chunks(path, chunksize)):
+            st = time.time()
+            X = self._transform_chunk(chunk, clean_text, cache_dir, profile)
+            with stage_profile.stage(profile, 'write_part', len(X)):
+                chunks.append(_write_chunk(store_dir, index, X, fmt, dtype))
+            rows += len(X)
+            log.info('...%d rows of features in %s (%.0f rows/s)' % (
+                rows, store_dir, len(X) / (time.time() - st)))
+        with stage_profile.stage(profile, 'add_parts', rows):
+            _add_chunks(store_dir, self.schema(), chunks, fmt, dtype)
+        return store_dir
+
+    def _transform_chunk(self, chunk, clean_text=False, cache_dir=None, profile=None, text_cache_path=None):
+        # The questions are cleaned by self.n_jobs processes, through the
+        # cleaning cache at text_cache_path (None: the default one). The
+        # topic group seeds LDA inference itself, so a chunk gets the same
+        # features whichever process builds it
+        import stage_profile
+
+        with stage_profile.stage(profile, 'prepare_frame', len(chunk)):
+            data = prepare_frame(chunk, clean_text, self.n_jobs, text_cache_path)
+        return self.transform(data, cache_dir, profile)
+
+    def _transform_shards(self, path, store_dir, chunksize, cache_dir, clean_text, fmt, dtype, profile, n_jobs):
+        """transform_file over a pool of n_jobs worker processes.
+
+        The file is cut into row ranges of chunksize rows, which the workers
+        read, transform and write as parts of the store's groups on their own.
+        The parts are added to the manifest in row order once all are
+        written. The workers get the fitted state through a directory next
+        to the store rather than pickled: the embeddings of w2v_path and
+        the LDA and LSI arrays are memory-mapped there, so all of them
+        share one page-cached copy. A csv is copied to Parquet in that
+        directory first, as every worker would otherwise parse it from the
+        top to reach its rows; pass the Parquet copy clean_csv writes to
+        skip that pass.
+        """
+        import shutil
+        import feature_store
+        import preprocessing
+        import quora_data
+        import stage_profile
+
+        if self.model is not None and self.w2v_path is None:
+            raise ValueError('workers memory-map the embeddings of w2v_path; fit or load the extractor with one')
+        shared_dir = store_dir.rstrip('/' + os.sep) + '.shared'
+        parts = []
+        try:
+            if os.path.splitext(path)[1] == '.csv':
+                log.warning('sharding the csv %s: copying it to Parquet first, pass a columnar file to skip this'
+                            % path)
+                with stage_profile.stage(profile, 'to_columnar'):
+                    os.makedirs(shared_dir, exist_ok=True)
+                    path = quora_data.to_columnar(path, os.path.join(shared_dir, 'pairs.parquet'),
+                                                  chunksize=chunksize)
+            rows = quora_data.count_rows(path)
+            # The workers clean through the cleaning cache of this process
+            text_cache_path = preprocessing.PREPROCESSING_CACHE_PATH if clean_text else None
+            tasks = [(path, store_dir, index, start, min(start + chunksize, rows), cache_dir, clean_text,
+                      text_cache_path, fmt, dtype) for index, start in enumerate(range(0, rows, chunksize))]
+            if not tasks:
+                return store_dir
+            self._save_shared(shared_dir)
+            st = time.time()
+            with stage_profile.stage(profile, 'shards', rows):
+                with multiprocessing.Pool(min(n_jobs, len(tasks)), initializer=_shard_init,
+                                          initargs=(shared_dir,)) as pool:
+                    for part in pool.imap(_shard_transform, tasks):
+                        parts.append(part)
+                        log.info('...%d of %d shards of features in %s (%.0f rows/s)' % (
+                            len(parts), len(tasks), store_dir, tasks[len(parts) - 1][4] / (time.time() - st)))
+        finally:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+        with stage_profile.stage(profile, 'add_parts', rows):
+            _add_chunks(store_dir, self.schema(), parts, fmt, dtype)
+        return store_dir
+
+    def _save_shared(self, directory):
+        # The extractor without its topic models, which go to gensim files
+        # with every array in an .npy of its own for _load_shared to map
+        os.makedirs(directory, exist_ok=True)
+        lda_model, lsi_model = self.lda_model, self.lsi_model
+        self.lda_model = self.lsi_model = None
+        try:
+            self.save(os.path.join(directory, 'extractor.pkl'))
+        finally:
+            self.lda_model, self.lsi_model = lda_model, lsi_model
+        if lda_model is not None:
+            lda_model.save(os.path.join(directory, 'lda'), sep_limit=0)
+            lsi_model.save(os.path.join(directory, 'lsi'), sep_limit=0)
+        return directory
+
+    @classmethod
+    def _load_shared(cls, directory):
+        from gensim.models import LdaModel, LsiModel
+
+        extractor = cls.load(os.path.join(directory, 'extractor.pkl'))
+        if os.path.exists(os.path.join(directory, 'lda')):
+            extractor.lda_model = LdaModel.load(os.path.join(directory, 'lda'), mmap='r')
+            extractor.lsi_model = LsiModel.load(os.path.join(directory, 'lsi'), mmap='r')
+        return extractor
+
+    def save(self, path):
+        state = dict(self.__dict__)
+        # The embeddings stay in their store and are memory-mapped again by load
+        state['model'] = state['norm_model'] = None
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        extractor = cls()
+        with open(path, 'rb') as f:
+            extractor.__dict__.update(pickle.load(f))
+        if extractor.w2v_path is not None:
+            extractor.model, extractor.norm_model = load_glove(extractor.w2v_path)
+        return extractor
+
+
+_shard_extractor = None
+
+
+def _shard_init(shared_dir):
+    # Pool initializer of _transform_shards: the fitted state, once per
+    # worker, with the cleaning and the groups running in-process as
+    # daemonic pool workers cannot have pools of their own
+    global _shard_extractor
+    _shard_extractor = QuoraFeatureExtractor._load_shared(shared_dir)
+    _shard_extractor.n_jobs = 1
+
+
+def _shard_transform(task):
+    import quora_data
+
+    path, store_dir, index, start, stop, cache_dir, clean_text, text_cache_path, fmt, dtype = task
+    X = _shard_extractor._transform_chunk(quora_data.read_rows(path, start, stop), clean_text, cache_dir,
+                                          text_cache_path=text_cache_path)
+    return _write_chunk(store_dir, index, X, fmt, dtype)
+
+
+def _write_chunk(store_dir, index, X, fmt, dtype):
+    # The features X of chunk index of transform_file as parts of the
+    # store, a group per dtype X got, widened columns included
+    import feature_store
+
+    return {name: feature_store.write_part(store_dir, name, index, X[columns], fmt=fmt, dtype=dtype)
+            for name, columns in schema_groups(list(zip(X.columns, X.dtypes))).items()}
+
+
+def _add_chunks(store_dir, schema, chunks, fmt, dtype):
+    """List the parts of the chunks of transform_file in the manifest, in row order.
+
+    A column that one chunk had to widen (see assemble_features) is
+    widened in every chunk: the parts of the chunks that stored it
+    narrower are read back and written again, so each group of the store
+    has one dtype and the same columns in every part.
+    """
+    import feature_store
+
+    dtypes = dict(schema)
+    for parts in chunks:
+        for name, part in parts.items():
+            for col in part['columns']:
+                dtypes[col] = np.result_type(dtypes[col], np.dtype(name))
+    groups = schema_groups([(col, dtypes[col]) for col, _ in schema])
+    for index, parts in enumerate(chunks):
+        if {name: part['columns'] for name, part in parts.items()} == groups:
+            continue
+        X = pd.concat([feature_store.read_part(store_dir, part) for part in parts.values()], axis=1)
+        for part in parts.values():
+            os.remove(os.path.join(store_dir, part['file']))
+        X = X[[col for col, _ in schema]].astype({col: dtypes[col] for col, _ in schema})
+        chunks[index] = _write_chunk(store_dir, index, X, fmt, dtype)
+    widened = [col for col, col_dtype in schema if dtypes[col] != col_dtype]
+    if widened:
+        log.warning('widened %s in every part of %s' % (', '.join(widened), store_dir))
+    for name in groups:
+        feature_store.add_parts(store_dir, name, [parts[name] for parts in chunks])
+    return store_dir
+
+
+def _module_extractor(stops, weights, entity_features):
+    # An extractor around the models of the module-level globals, which
+    # __main__ used to set up for build_features
+    extractor = QuoraFeatureExtractor(num_topics=globals().get('num_topics', 100), stops=stops,
+                                      entity_features=entity_features)
+    extractor.weights = weights
+    for name in ('dictionary', 'lda_model', 'lsi_model', 'model', 'norm_model'):
+        setattr(extractor, name, globals().get(name))
+    return extractor
+
+
+def build_features(data, stops, entity_features=False, cache_dir=None, weights=None):
+    # QuoraFeatureExtractor.transform with the module-level models; weights
+    # are fitted tf-idf weights, None fits them on data
+    return _module_extractor(stops, weights, entity_features).transform(data, cache_dir)
+
+
+def build_features_streaming(path, store_dir, stops, chunksize=100000, weights=None, entity_features=False,
+                             cache_dir=None, clean_text=False, fmt='npy', dtype=None):
+    """QuoraFeatureExtractor.transform_file with the module-level models.
+
+    weights=None fits the tf-idf weights on the questions of the whole
+    file first, in a separate streaming pass, so the features are the ones
+    build_features gives for the whole file.
+    """
+    import quora_data
+
+    if weights is None:
+        frames = (prepare_frame(chunk, clean_text)
+                  for chunk in quora_data.iter_chunks(path, chunksize, columns=['question1', 'question2']))
+        weights = fit_tfidf(frame['question1'].tolist() + frame['question2'].tolist() for frame in frames)
+    return _module_extractor(stops, weights, entity_features).transform_file(
+        path, store_dir, chunksize, cache_dir, clean_text, fmt, dtype)
+
+
 if __name__ == '__main__':
     # test = True
     test = False
@@ -482,70 +1611,89 @@ if __name__ == '__main__':
         data_path = '/data1/quora_pair/50q_pair.csv'
         data_path_test = '/data1/quora_pair/50q_pair.csv'
         w2v_path = '/data1/resources/GoogleNews-vectors-negative300.bin'
-        out_path = '/data1/resources/train_features.csv'
-        out_path_test = '/data1/resources/test_features.csv'
+        out_path = '/data1/resources/train_features'
+        out_path_test = '/data1/resources/test_features'
+        cache_dir = '/data1/resources/feature_cache'
         num_topics = 20
     else:
         data_path = '/home/csist/Dataset/QuoraQP/train_clean.csv'
         data_path_test = '/home/csist/Dataset/QuoraQP/test_clean.csv'
         w2v_path = '/home/csist/workspace/resources/GoogleNews-vectors-negative300.bin'
-        out_path = 'added_features/train_features.csv'
-        out_path_test = 'added_features/test_features.csv'
+        out_path = 'added_features/train_features'
+        out_path_test = 'added_features/test_features'
+        cache_dir = 'added_features/cache'
         num_topics = 100
+    # Worker processes building the test features, None for all cores
+    n_jobs = None
     log.info('stop words: {0}'.format(stop_words))
 
-    import time
+    extractor_path = out_path + '_extractor.pkl'
+    profile_path = out_path + '_profile'
+    import feature_store
+    import stage_profile
+    profile = stage_profile.StageProfile()
     log.info('Reading data frame')
     st = time.time()
     # read data frame and build split feature for instance '1 2 3' to ['1', '2', '3']
-    df = prepare_df(data_path)
+    with profile.stage('prepare_df') as record:
+        df = prepare_df(data_path)
+        record.rows = len(df)
     log.info('...time for read data frame: %.2f s' % (time.time()-st))
 
-    # Load glove model
-    log.info('Loading w2v')
-    st = time.time()
-    model, norm_model = load_glove(w2v_path)
-    # model, norm_model = None, None
-    log.info('...time for load w2v: %.2f m' % ((time.time()-st) / 60))
-
-    # Build LDA model
-    log.info('Building LDA and LSI model')
-    log.warning('**************** dictionary should be build by all data... ********************')
-    st = time.time()
-    texts = [i for i in pd.Series(df['question1'].tolist() + df['question2'].tolist()).apply(clean_doc)]
-    dictionary, lda_model, lsi_model = train_lda(texts, num_topics=num_topics)
-    del texts
-    log.info('...time for train lda and lsi: %.2f m' % ((time.time()-st) / 60))
+    extractor = None
+    if os.path.exists(extractor_path):
+        # Fitted before: the weights and topic models are read back and the
+        # embeddings memory-mapped, nothing is refit unless it was fit with
+        # other settings or on other train data
+        log.info('Loading fitted extractor %s' % extractor_path)
+        st = time.time()
+        with profile.stage('load extractor'):
+            extractor = QuoraFeatureExtractor.load(extractor_path)
+        log.info('...time for load extractor: %.2f s' % (time.time()-st))
+        mismatches = extractor.fit_mismatches(df, w2v_path, num_topics, stop_words)
+        if mismatches:
+            log.warning('%s was fit with another %s; refitting' % (extractor_path, ', '.join(mismatches)))
+            extractor = None
+    if extractor is None:
+        # Fit the tf-idf weights, LDA and LSI models on train and load the w2v model
+        log.info('Fitting extractor (tf-idf, LDA and LSI models, w2v)')
+        log.warning('**************** dictionary should be build by all data... ********************')
+        st = time.time()
+        with profile.stage('fit'):
+            extractor = QuoraFeatureExtractor(w2v_path, num_topics=num_topics, stops=stop_words).fit(df, profile)
+        extractor.save(extractor_path)
+        log.info('...time for fit extractor: %.2f m' % ((time.time()-st) / 60))
 
     # Build features
     log.info('Building features')
     st = time.time()
-    df_new_feature = build_features(df, stop_words)
+    with profile.stage('build train features', len(df)):
+        df_new_feature = extractor.transform(df, cache_dir=cache_dir, profile=profile)
     log.info('...time for build features: %.2f m' % ((time.time()-st) / 60))
     del df
 
-    # Save feature data to csv
-    log.info('save csv in %s' % out_path)
+    # Save feature data to the feature store (see feature_store.py), one
+    # group per compact dtype, a column widened to float32 going with the
+    # float32 group
+    log.info('save features in %s' % out_path)
     st = time.time()
-    df_new_feature.to_csv(out_path, index=False)
-    log.info('...time for save csv: %.2f m' % ((time.time()-st) / 60))
+    with profile.stage('write_features', len(df_new_feature)):
+        feature_store.write_features(out_path, df_new_feature,
+                                     groups=schema_groups(list(zip(df_new_feature.columns, df_new_feature.dtypes))))
+    log.info('...time for save features: %.2f m' % ((time.time()-st) / 60))
     del df_new_feature
 
-    log.info('Reading test data frame')
-    st = time.time()
-    # read data frame and build split feature for instance '1 2 3' to ['1', '2', '3']
-    df = prepare_df(data_path_test)
-    log.info('...time for read test data: %.2f s' % (time.time()-st))
-
-    # Build test features
-    log.info('Building test features')
-    st = time.time()
-    df_new_feature_test = build_features(df, stop_words)
-    log.info('...time for build features: %.2f m' % ((time.time()-st) / 60))
-    del df
-
-    # Save test feature data to csv
-    log.info('test feature save csv in %s' % out_path)
+    # Build test features chunk by chunk into the feature store, so the
+    # 2.3M test pairs never need to be in memory at once; they use the
+    # tf-idf weights fitted on train like every other fitted model. The
+    # chunks are shared out over n_jobs worker processes
+    log.info('Building test features in %s' % out_path_test)
     st = time.time()
-    df_new_feature_test.to_csv(out_path_test, index=False)
-    log.info('...time for save csv: %.2f m' % ((time.time()-st) / 60))
+    with profile.stage('build test features'):
+        extractor.transform_file(data_path_test, out_path_test, chunksize=100000, cache_dir=cache_dir,
+                                 profile=profile, n_jobs=n_jobs)
+    log.info('...time for build test features: %.2f m' % ((time.time()-st) / 60))
+
+    # Which stages to optimize or drop: time, memory and throughput per stage
+    json_path, md_path = profile.write(profile_path)
+    log.info('stage profile in %s and %s:\n%s' % (json_path, md_path, profile.to_markdown()))
@@ -0,0 +1,300 @@
+"""Columnar store for the build_features output.
+
+    python feature_store.py added_features/train_features.csv added_features/train_features [--format parquet]
+
+converts a feature csv written by earlier versions of feature_engineer.py
+into a store: a directory holding one file per feature group and a
+manifest.json with the row count and, per group, its file, format, dtype
+and columns:
+
+    <group>.npy      (rows, columns) matrix in column-major order, so that
+                     every column is one contiguous run of the memory map
+    <group>.parquet  one Parquet column per feature
+
+A group streamed in with append_group, or written part by part by several
+processes with write_part and add_parts, has one such file per chunk,
+<group>-00000.npy, <group>-00001.npy, ...
+
+Groups are written as float64 (or their own integer dtype) unless a dtype
+such as np.float32 is asked for. read_features loads any subset of
+columns without reading the others, and load_group hands the .npy memory
+map of a group straight to a consumer such as xgboost.DMatrix.
+"""
+import os
+import json
+import argparse
+import time
+
+import numpy as np
+
+MANIFEST_FILE = 'manifest.json'
+FORMATS = ('npy', 'parquet')
+
+
+def read_manifest(store_dir):
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'rows': None, 'groups': []}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(store_dir, manifest):
+    # Renamed over the old one, so readers never see half a manifest
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def feature_columns(store_dir):
+    """All columns of the store, group by group in the order they were written."""
+    return [col for group in read_manifest(store_dir)['groups'] for col in group['columns']]
+
+
+def _write_file(path, frame, fmt, dtype):
+    # One group file, under a temporary name until it is complete; returns its dtype name
+    if fmt == 'npy':
+        group_dtype = np.dtype(dtype) if dtype is not None else np.result_type(*frame.dtypes)
+        if group_dtype.kind not in 'biuf':
+            raise ValueError('npy groups hold numeric columns only, not %s' % group_dtype)
+        matrix = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=group_dtype,
+                                           shape=frame.shape, fortran_order=True)
+        for idx, col in enumerate(frame.columns):
+            matrix[:, idx] = frame[col].values
+        matrix.flush()
+        del matrix
+        dtype_name = group_dtype.name
+    else:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        frame = frame.set_axis([str(col) for col in frame.columns], axis=1)
+        if dtype is not None:
+            frame = frame.astype(dtype)
+        pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path + '.tmp')
+        dtype_name = np.dtype(dtype).name if dtype is not None else None
+    os.replace(path + '.tmp', path)
+    return dtype_name
+
+
+def _group_files(group):
+    # A group written at once has one file, an appended one a file per part
+    return group['parts'] if 'parts' in group else [group['file']]
+
+
+def _remove_files(store_dir, group, keep=()):
+    for file_name in _group_files(group):
+        if file_name not in keep:
+            os.remove(os.path.join(store_dir, file_name))
+
+
+def write_group(store_dir, name, frame, fmt='npy', dtype=None):
+    """Write the columns of frame as the feature group name of the store at store_dir.
+
+    A group of the same name is replaced; every group of a store has the
+    same number of rows and no column is in two groups. dtype (e.g.
+    np.float32) casts every column, None keeps float64 and integer
+    columns as they are.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('fmt must be one of %s, not %r' % (FORMATS, fmt))
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = read_manifest(store_dir)
+    groups = [group for group in manifest['groups'] if group['name'] != name]
+    if manifest['rows'] is not None and groups and manifest['rows'] != len(frame):
+        raise ValueError('group %r has %d rows, the store %d' % (name, len(frame), manifest['rows']))
+    columns = [str(col) for col in frame.columns]
+    taken = set(col for group in groups for col in group['columns'])
+    clash = [col for col in columns if col in taken]
+    if clash:
+        raise ValueError('columns already stored in another group: %s' % ', '.join(clash))
+
+    file_name = '%s.%s' % (name, fmt)
+    path = os.path.join(store_dir, file_name)
+    dtype_name = _write_file(path, frame, fmt, dtype)
+
+    for group in manifest['groups']:
+        if group['name'] == name:
+            _remove_files(store_dir, group, keep=(file_name,))
+    entry = {'name': name, 'file': file_name, 'format': fmt, 'dtype': dtype_name, 'columns': columns}
+    # A replaced group keeps its place in the column order
+    names = [group['name'] for group in manifest['groups']]
+    if name in names:
+        manifest['groups'][names.index(name)] = entry
+    else:
+        manifest['groups'].append(entry)
+    manifest['rows'] = len(frame)
+    _write_manifest(store_dir, manifest)
+    return path
+
+
+def _part_entry(manifest, name, columns, fmt):
+    # The manifest entry of group name that parts are added to, checked or created
+    names = [group['name'] for group in manifest['groups']]
+    if name in names:
+        entry = manifest['groups'][names.index(name)]
+        if entry['columns'] != columns or entry['format'] != fmt:
+            raise ValueError('appended rows do not match the %s columns of group %r' % (entry['format'], name))
+        if 'parts' not in entry:
+            entry['parts'], entry['part_rows'] = [entry.pop('file')], [manifest['rows']]
+    else:
+        entry = {'name': name, 'parts': [], 'part_rows': [], 'format': fmt, 'dtype': None, 'columns': columns}
+        manifest['groups'].append(entry)
+    return entry
+
+
+def write_part(store_dir, name, index, frame, fmt='npy', dtype=None):
+    """Write the rows of frame as part index of group name, leaving the manifest alone.
+
+    Several processes may write the parts of one group at the same time;
+    add_parts then lists them in the manifest, in row order. Returns what
+    add_parts needs to know about the part.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('fmt must be one of %s, not %r' % (FORMATS, fmt))
+    os.makedirs(store_dir, exist_ok=True)
+    file_name = '%s-%05d.%s' % (name, index, fmt)
+    dtype_name = _write_file(os.path.join(store_dir, file_name), frame, fmt, dtype)
+    return {'file': file_name, 'rows': len(frame), 'format': fmt, 'dtype': dtype_name,
+            'columns': [str(col) for col in frame.columns]}
+
+
+def read_part(store_dir, part):
+    """The rows of a part written by write_part, as a DataFrame, whether or not the manifest lists it."""
+    import pandas as pd
+
+    columns = part['columns']
+    arrays = _read_columns(os.path.join(store_dir, part['file']), part['format'], range(len(columns)), columns,
+                           mmap=False)
+    return pd.DataFrame(dict(zip(columns, arrays)), columns=columns)
+
+
+def add_parts(store_dir, name, parts):
+    """Append parts written by write_part to the group name, in the order given.
+
+    All parts of a group must have the same dtype; a part with another one
+    raises a ValueError and the manifest is left as it was.
+    """
+    manifest = read_manifest(store_dir)
+    for part in parts:
+        entry = _part_entry(manifest, name, part['columns'], part['format'])
+        if entry['parts'] and entry['dtype'] != part['dtype']:
+            raise ValueError('a %s part does not match the %s parts of group %r' % (
+                part['dtype'], entry['dtype'], name))
+        entry['dtype'] = part['dtype']
+        entry['parts'].append(part['file'])
+        entry['part_rows'].append(part['rows'])
+        manifest['rows'] = sum(entry['part_rows'])
+    _write_manifest(store_dir, manifest)
+    return store_dir
+
+
+def append_group(store_dir, name, frame, fmt='npy', dtype=None):
+    """Append the rows of frame to the feature group name, as one more part file.
+
+    The first append creates the group (use it for a store holding just
+    this group); later ones must bring the same columns. Only the
+    manifest names a part, so a part interrupted while being written is
+    never read.
+    """
+    if fmt not in FORMATS:
+        raise ValueError('fmt must be one of %s, not %r' % (FORMATS, fmt))
+    entry = _part_entry(read_manifest(store_dir), name, [str(col) for col in frame.columns], fmt)
+    return add_parts(store_dir, name, [write_part(store_dir, name, len(entry['parts']), frame, fmt, dtype)])
+
+
+def write_features(store_dir, frame, groups=None, fmt='npy', dtype=None):
+    """Write frame to the store at store_dir, one write_group per feature group.
+
+    groups maps group names to lists of columns of frame, in the order
+    they should be stored; None stores all columns as one 'features' group.
+    """
+    if groups is None:
+        groups = {'features': list(frame.columns)}
+    for name, columns in groups.items():
+        write_group(store_dir, name, frame[columns], fmt=fmt, dtype=dtype)
+    return store_dir
+
+
+def _read_columns(path, fmt, indices, names, mmap):
+    # The columns names (at indices of the group) of one group file, as numpy arrays
+    if fmt == 'npy':
+        matrix = np.load(path, mmap_mode='r' if mmap else None)
+        return [np.array(matrix[:, idx]) for idx in indices]
+    import pyarrow.parquet as pq
+    table = pq.read_table(path, columns=names, memory_map=mmap)
+    return [table.column(col).to_numpy() for col in names]
+
+
+def load_group(store_dir, name, mmap=True):
+    """The (rows, columns) matrix of a group and its column names.
+
+    An npy group written at once comes back as a read-only memory map
+    (mmap=False reads it into memory); the parts of an appended group
+    and Parquet groups are read into a numpy array.
+    """
+    for group in read_manifest(store_dir)['groups']:
+        if group['name'] == name:
+            break
+    else:
+        raise KeyError('no feature group %r in %s' % (name, store_dir))
+    matrices = []
+    for file_name in _group_files(group):
+        path = os.path.join(store_dir, file_name)
+        if group['format'] == 'npy':
+            matrices.append(np.load(path, mmap_mode='r' if mmap else None))
+        else:
+            import pyarrow.parquet as pq
+            matrices.append(pq.read_table(path, memory_map=mmap).to_pandas().values)
+    matrix = matrices[0] if len(matrices) == 1 else np.concatenate(matrices)
+    return matrix, group['columns']
+
+
+def read_features(store_dir, columns=None, mmap=True):
+    """DataFrame of the given columns of the store (all by default), in that order.
+
+    Only the groups holding those columns are opened, and of an npy
+    group only the requested columns of its memory map are read; Parquet
+    groups read just those columns as well.
+    """
+    import pandas as pd
+
+    manifest = read_manifest(store_dir)
+    if columns is None:
+        columns = [col for group in manifest['groups'] for col in group['columns']]
+    wanted = set(columns)
+    found = {}
+    for group in manifest['groups']:
+        names = [col for col in group['columns'] if col in wanted]
+        if not names:
+            continue
+        indices = [group['columns'].index(col) for col in names]
+        parts = [_read_columns(os.path.join(store_dir, file_name), group['format'], indices, names, mmap)
+                 for file_name in _group_files(group)]
+        for idx, col in enumerate(names):
+            found[col] = parts[0][idx] if len(parts) == 1 else np.concatenate([part[idx] for part in parts])
+    missing = [col for col in columns if col not in found]
+    if missing:
+        raise KeyError('not in the feature store %s: %s' % (store_dir, ', '.join(missing)))
+    return pd.DataFrame({col: found[col] for col in columns}, index=pd.RangeIndex(manifest['rows'] or 0),
+                        columns=list(columns))
+
+
+def main(argv=None):
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('csv', help='feature csv written by feature_engineer.py')
+    parser.add_argument('store_dir', help='store directory to write')
+    parser.add_argument('--format', choices=FORMATS, default='npy', help='file format of the group')
+    parser.add_argument('--float32', action='store_true', help='store float32 instead of float64')
+    args = parser.parse_args(argv)
+
+    st = time.time()
+    frame = pd.read_csv(args.csv)
+    write_features(args.store_dir, frame, fmt=args.format, dtype=np.float32 if args.float32 else None)
+    print('%s -> %s (%d columns, %.1fs)' % (args.csv, args.store_dir, frame.shape[1], time.time() - st))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,143 +1,754 @@
+import os
 import re
-import nltk
-from nltk.corpus import wordnet
-from nltk import ne_chunk, pos_tag, word_tokenize
-from nltk.tree import Tree
-nltk.data.path.append('/data1/nltk_data')
+import csv
+import gzip
+import hashlib
+import inspect
+import sqlite3
+import functools
+import itertools
+import multiprocessing
+import argparse
+import json
+import time
 
+# NLTK is only imported, and its data path only extended, the first time a
+# function needs a corpus or a model, so importing this module stays cheap.
+NLTK_DATA_PATH = '/data1/nltk_data'
 
-def word_patterns_replace(text):
+
+def _nltk():
+    import nltk
+    if NLTK_DATA_PATH not in nltk.data.path:
+        nltk.data.path.append(NLTK_DATA_PATH)
+    return nltk
+
+
+# Ordered rule table for word_patterns_replace. Each entry is one pass over the
+# text and the passes run in the listed order:
+#   'replace' -- literal strings, applied one after another with str.replace
+#   'regex'   -- regular expressions; several rules in one entry are fused into
+#                a single alternation and dispatched on the branch that matched,
+#                so they must not interact with each other. A leading group all
+#                of them share (e.g. the digit in front of a unit) is matched once.
+# Rules that cannot fire any more (e.g. '?' or '(' after the "Clean shorthands"
+# filter has replaced them by spaces) are kept so the table stays a faithful
+# copy of the original chain.
+WORD_PATTERN_RULES = (
     # Transfer special chars
-    text = re.sub('\$', " dollar ", text)
-    text = re.sub('\%', " percent ", text)
-    # text = re.sub('\&', " and ", text)  # 'and' is no in w2v but '&' have vec in w2v...
-    text = re.sub("…", " ", text)
-    text = re.sub("é", "e", text)
+    # ('&' -> ' and ' is left out: 'and' is no in w2v but '&' have vec in w2v...)
+    ('replace', (('$', ' dollar '),
+                 ('%', ' percent '),
+                 ('…', ' '),
+                 ('é', 'e'))),
 
     # Remove comma between numbers, i.e. 15,000 -> 15000
-    text = re.sub('(?<=[0-9])\,(?=[0-9])', "", text)
+    ('regex', ((r'(?<=[0-9])\,(?=[0-9])', ''),)),
 
-    # replace the float numbers with a random number, it will be parsed as number afterward, and also been replaced with word "number"
-    text = re.sub('[0-9]+\.[0-9]+', " 1 ", text)
+    # Replace the float numbers with a random number, it will be parsed as number afterward,
+    # and also been replaced with word "number"
+    ('regex', ((r'[0-9]+\.[0-9]+', ' 1 '),)),
 
     # Clean shorthands
-    text = re.sub(r"[^A-Za-z0-9^,!.\/'+-=]", " ", text)
-    text = re.sub(r"what's", "what is ", text)
-    text = re.sub(r"\'s", " ", text)
-    text = re.sub(r"\'ve", " have ", text)
-    text = re.sub(r"can't", "cannot ", text)
-    text = re.sub(r"n't", " not ", text)
-    text = re.sub(r"i'm", "i am ", text)
-    text = re.sub(r"\'re", " are ", text)
-    text = re.sub(r"\'d", " would ", text)
-    text = re.sub(r"\'ll", " will ", text)
-
-    text = re.sub(r",", " ", text)
-    text = re.sub(r"\.", " ", text)
-    text = re.sub(r"!", " ! ", text)
-    text = re.sub(r" 9 11 ", "911", text)
-    text = re.sub(r"\/", " ", text)
-    text = re.sub(r"\^", " ^ ", text)
-    text = re.sub(r"\+", " + ", text)
-    text = re.sub(r"\=", " = ", text)
-    text = re.sub(r"'", " ", text)
-    text = re.sub(r"60k", " 60000 ", text)
-    text = re.sub(r":", " : ", text)
-    text = re.sub(r" e g ", " eg ", text)
-    text = re.sub(r" b g ", " bg ", text)
-    text = re.sub(r" u s ", " american ", text)
-    text = re.sub(r"\0s", "0", text)
-    text = re.sub(r"e - mail", "e_mail", text)
-    text = re.sub(r" j k ", " JK ", text)
-    text = re.sub(r" J K ", " JK ", text)
-    text = re.sub(r" J\.K\. ", " JK ", text)
-    text = re.sub(r"\s{2,}", " ", text)
-
-    text = text.replace('?', ' ? ')
-    text = text.replace(':', ' : ')
-    text = text.replace(', ', ' , ')
-    text = text.replace('. ', ' . ')
-    text = text.replace('.\"', ' .\"')
-    text = text.replace(',\"\",', ',\" \",')
-    text = text.replace('(', ' ( ')
-    text = text.replace(')', ' ) ')
-    text = text.replace('\'s ', ' \'s ')
-    text = text.replace('s\' ', ' s\' ')
-    text = text.replace('n\'t ', ' not ')
-    text = text.replace('\'m ', ' \'m ')
-
-    # Detection symbol or tag
-    text = text.replace('/', ' / ')
-    text = re.sub(r"([\W]) / ([A-Za-z])", r"\1/\2", text)
-    text = text.replace('<$', ' < $')
-    text = re.sub(r"<([0-9])", r"< \1", text)
-
-    #text = re.sub(r"[\W] / [\w]", "/", text)
+    ('regex', ((r"[^A-Za-z0-9^,!.\/'+-=]", ' '),)),
+    ('replace', (("what's", 'what is '),
+                 ("'s", ' '),
+                 ("'ve", ' have '),
+                 ("can't", 'cannot '),
+                 ("n't", ' not '),
+                 ("i'm", 'i am '),
+                 ("'re", ' are '),
+                 ("'d", ' would '),
+                 ("'ll", ' will '),
+                 (',', ' '),
+                 ('.', ' '),
+                 ('!', ' ! '),
+                 (' 9 11 ', '911'),
+                 ('/', ' '),
+                 ('^', ' ^ '),
+                 ('+', ' + '),
+                 ('=', ' = '),
+                 ("'", ' '),
+                 ('60k', ' 60000 '),
+                 (':', ' : '),
+                 (' e g ', ' eg '),
+                 (' b g ', ' bg '),
+                 (' u s ', ' american '),
+                 ('\0s', '0'),
+                 ('e - mail', 'e_mail'),
+                 (' j k ', ' JK '),
+                 (' J K ', ' JK '),
+                 (' J.K. ', ' JK '))),
+    ('regex', ((r'\s{2,}', ' '),)),
+
+    ('replace', (('?', ' ? '),
+                 (':', ' : '),
+                 (', ', ' , '),
+                 ('. ', ' . '),
+                 ('.\"', ' .\"'),
+                 (',\"\",', ',\" \",'),
+                 ('(', ' ( '),
+                 (')', ' ) '),
+                 ('\'s ', ' \'s '),
+                 ('s\' ', ' s\' '),
+                 ('n\'t ', ' not '),
+                 ('\'m ', ' \'m '),
+                 # Detection symbol or tag
+                 ('/', ' / '))),
+    ('regex', ((r"([\W]) / ([A-Za-z])", r"\1/\2"),)),
+    ('replace', (('<$', ' < $'),)),
+    ('regex', ((r"<([0-9])", r"< \1"),)),
 
     # Detect brief expression
-    text = re.sub(r'((.[A-Z])+) \.', r'\1.', text)
+    ('regex', ((r'((.[A-Z])+) \.', r'\1.'),)),
 
     # Detect unit
-    text = re.sub(r'([0-9])[M,m][H,h][Z,z]', r'\1 mhz ', text)
-    text = re.sub(r'([0-9])[H,h][Z,z]', r'\1 hz ', text)
-    text = re.sub(r'([0-9])[B,b][P,p][M,m]', r'\1 bpm ', text)
-    text = re.sub(r'([0-9])[K,k][M,m] ', r'\1 km ', text)
-    text = re.sub(r'([0-9])[C,c][M,m] ', r'\1 cm ', text)
-    text = re.sub(r'([0-9])[K,k][G,g] ', r'\1 kg ', text)
-    text = re.sub(r'([0-9])[K,k][G,g][S,s] ', r'\1 kgs ', text)
-    text = re.sub(r'([0-9])[M,m][G,g] ', r'\1 mg ', text)
-    text = re.sub(r'([0-9])[M,m][L,l] ', r'\1 ml ', text)
-    text = re.sub(r'([0-9])[M,m][S,s] ', r'\1 ms ', text)
-    text = re.sub(r'([0-9])[L,l][P,p][A,a] ', r'\1 kg ', text)
-    text = re.sub(r'\$([0-9])', r'$ \1 ', text)
-    text = re.sub(r'([0-9]) [V,v]', r'\1 volt ', text)
-    text = re.sub(r'([0-9])[V,v]', r'\1 volt ', text)
-    text = re.sub(r'([0-9])\-[V,v]', r'\1 volt ', text)
-    text = re.sub(r'([0-9])[K,k][V,v][A,a]', r'\1 kVA ', text)
-    text = re.sub(r'([0-9])[K,k][P,p][H,h]', r'\1 kph ', text)
-    text = re.sub(r'([0-9])[M,m][P,p][H,h]', r'\1 mph ', text)
-    text = re.sub(r'([0-9])hours', r'\1 hours ', text)
-    text = re.sub(r'([0-9])hour', r'\1 hour ', text)
-
-    # Digit expression
-    text = re.sub(r'([0-9]),([0-9])', r'\1\2', text)
-    text = re.sub(r'([0-9])[K,k] ', r'\g<1>000 ', text)
-    text = re.sub(r'([0-9])\+([0-9])', r'\1 + \2', text)
-
-    text = text.replace('  ', ' ')
+    ('regex', ((r'([0-9])[M,m][H,h][Z,z]', r'\1 mhz '),
+               (r'([0-9])[H,h][Z,z]', r'\1 hz '),
+               (r'([0-9])[B,b][P,p][M,m]', r'\1 bpm '),
+               (r'([0-9])[K,k][M,m] ', r'\1 km '),
+               (r'([0-9])[C,c][M,m] ', r'\1 cm '),
+               (r'([0-9])[K,k][G,g] ', r'\1 kg '),
+               (r'([0-9])[K,k][G,g][S,s] ', r'\1 kgs '),
+               (r'([0-9])[M,m][G,g] ', r'\1 mg '),
+               (r'([0-9])[M,m][L,l] ', r'\1 ml '),
+               (r'([0-9])[M,m][S,s] ', r'\1 ms '),
+               (r'([0-9])[L,l][P,p][A,a] ', r'\1 kg '))),
+    ('regex', ((r'\$([0-9])', r'$ \1 '),)),
+    ('regex', ((r'([0-9]) [V,v]', r'\1 volt '),
+               (r'([0-9])[V,v]', r'\1 volt '),
+               (r'([0-9])\-[V,v]', r'\1 volt '),
+               (r'([0-9])[K,k][V,v][A,a]', r'\1 kVA '),
+               (r'([0-9])[K,k][P,p][H,h]', r'\1 kph '),
+               (r'([0-9])[M,m][P,p][H,h]', r'\1 mph '),
+               (r'([0-9])hours', r'\1 hours '),
+               (r'([0-9])hour', r'\1 hour '),
+               # Digit expression
+               (r'([0-9]),([0-9])', r'\1\2'),
+               (r'([0-9])[K,k] ', r'\g<1>000 '),
+               (r'([0-9])\+([0-9])', r'\1 + \2'))),
+
+    ('replace', (('  ', ' '),)),
+)
+
+_TEMPLATE_GROUP = re.compile(r'\\(?:g<(\d+)>|(\d+))')
+
+
+def _split_template(template, group_number):
+    # Split a replacement template into literal strings and group numbers
+    parts = []
+    pos = 0
+    for m in _TEMPLATE_GROUP.finditer(template):
+        if m.start() > pos:
+            parts.append(template[pos:m.start()])
+        parts.append(group_number(int(m.group(1) or m.group(2))))
+        pos = m.end()
+    if pos < len(template):
+        parts.append(template[pos:])
+    return tuple(parts)
+
+
+def _shared_prefix(patterns):
+    # Longest common leading group, e.g. '([0-9])' for the unit rules
+    common = os.path.commonprefix(patterns)
+    end = common.rfind(')') + 1
+    while end > 0:
+        prefix = common[:end]
+        if all(p[end:end + 1] not in ('*', '+', '?', '{') for p in patterns):
+            try:
+                re.compile(prefix)
+                return prefix
+            except re.error:
+                pass
+        end = common.rfind(')', 0, end - 1) + 1
+    return ''
+
+
+def _compile_replace(rules):
+    def apply_pass(text):
+        for old, new in rules:
+            text = text.replace(old, new)
+        return text
+    return apply_pass
+
+
+def _compile_regex(rules):
+    if len(rules) == 1:
+        pattern, repl = rules[0]
+        return functools.partial(re.compile(pattern).sub, repl)
+
+    # Wrap every rule in its own named group after the shared prefix; the
+    # rule's own groups move behind it, so its template is renumbered.
+    patterns = [pattern for pattern, _ in rules]
+    prefix = _shared_prefix(patterns)
+    shared = re.compile(prefix).groups
+    fused = re.compile(prefix + '(?:' + '|'.join(
+        '(?P<_r%d>%s)' % (idx, pattern[len(prefix):]) for idx, pattern in enumerate(patterns)) + ')')
+    templates = {}
+    for idx, (_, repl) in enumerate(rules):
+        name = '_r%d' % idx
+        offset = fused.groupindex[name] - shared
+        templates[name] = _split_template(repl, lambda g: g if g <= shared else g + offset)
+
+    def dispatch(m):
+        return ''.join([p if p.__class__ is str else (m.group(p) or '') for p in templates[m.lastgroup]])
+    return functools.partial(fused.sub, dispatch)
+
+
+def _overlaps(a, b):
+    # Some non-empty proper suffix of a is a prefix of b
+    return any(a.endswith(b[:k]) for k in range(1, len(b)))
+
+
+def _interacts(earlier, later):
+    old, new = earlier
+    later_old = later[0]
+    # The two patterns can claim the same characters...
+    if old in later_old or later_old in old or _overlaps(old, later_old) or _overlaps(later_old, old):
+        return True
+    # ...or the later pattern can match text the earlier rule writes
+    return (not new or later_old in new or new in later_old or
+            _overlaps(new, later_old) or _overlaps(later_old, new))
+
+
+def literal_groups(rules):
+    """Split a chain of literal (old, new) rules into runs that can be applied in one scan.
+
+    Inside a run no pattern overlaps another one or anything an earlier rule
+    of the run writes, so replacing all of them in a single left-to-right scan
+    gives the same text as applying them one after another. A rule that
+    depends on an earlier one, e.g. ' 9 11 ' on the spaces ',' and '.' leave
+    behind, starts a new run.
+    """
+    groups = []
+    for rule in rules:
+        if groups and not any(_interacts(earlier, rule) for earlier in groups[-1]):
+            groups[-1].append(rule)
+        else:
+            groups.append([rule])
+    return groups
+
+
+def _compile_literals(rules):
+    # One alternation per independent run, dispatched on the matched text
+    passes = []
+    for group in literal_groups(rules):
+        if len(group) == 1:
+            passes.append(_compile_replace(group))
+            continue
+        table = dict(group)
+        matcher = re.compile('|'.join(map(re.escape, table)))
+        passes.append(functools.partial(matcher.sub, lambda m, table=table: table[m.group()]))
+
+    def apply_pass(text):
+        for apply_group in passes:
+            text = apply_group(text)
+        return text
+    return apply_pass
+
+
+_PASS_COMPILERS = {
+    'replace': _compile_replace,
+    'regex': _compile_regex,
+}
+
+
+def compile_rules(rules, fuse_literals=False):
+    """Turn a rule table like WORD_PATTERN_RULES into a list of text -> text passes.
+
+    With fuse_literals the 'replace' passes scan the text once per run of
+    independent rules (see literal_groups) instead of once per rule. Same
+    output, but CPython's str.replace is fast enough on short questions that
+    the plain chain is the quicker one (benchmarks/bench_literals.py).
+    """
+    compilers = dict(_PASS_COMPILERS)
+    if fuse_literals:
+        compilers['replace'] = _compile_literals
+    return [compilers[kind](members) for kind, members in rules]
+
+
+_WORD_PATTERN_PASSES = compile_rules(WORD_PATTERN_RULES)
+
+
+def word_patterns_replace(text):
+    if _rule_profiler is not None:
+        return _rule_profiler(text)
+
+    for apply_pass in _WORD_PATTERN_PASSES:
+        text = apply_pass(text)
 
     text = tokenizer(text)
 
-    text = re.sub(r"\-", " - ", text)
+    text = text.replace('-', ' - ')
 
     return text
 
 
+_LOOKAROUND = re.compile(r'\(\?<?[=!]')
+
+
+def word_patterns_replace_series(texts):
+    """word_patterns_replace over a whole pandas Series of str, column-wise.
+
+    Every rule of the table becomes one Series.str.replace over the column
+    (fused passes run rule by rule, which gives the same output), so with a
+    pyarrow string dtype the replacements run as Arrow kernels instead of a
+    Python loop per row. Rules Arrow's regex engine cannot run fall back to
+    Python's re. The WordNet tokenizer only runs on the rows that contain a
+    hyphen or an underscore; it leaves every other row untouched.
+    """
+    import pandas as pd
+    try:
+        texts = texts.astype('string[pyarrow]')
+    except ImportError:
+        texts = texts.astype(object)
+
+    for kind, members in WORD_PATTERN_RULES:
+        for pattern, repl in members:
+            if kind == 'replace':
+                texts = texts.str.replace(pattern, repl, regex=False)
+                continue
+            if not _LOOKAROUND.search(pattern):
+                texts = texts.str.replace(pattern, repl, regex=True)
+                continue
+            # Arrow's RE2 has no look-arounds and may leave such rules unapplied without an error
+            sub = functools.partial(re.compile(pattern).sub, repl)
+            texts = pd.Series([sub(t) if isinstance(t, str) else t for t in texts], index=texts.index,
+                              dtype=texts.dtype)
+
+    has_compound = (texts.str.contains('-', regex=False) | texts.str.contains('–', regex=False) |
+                    texts.str.contains('_', regex=False)).fillna(False).astype(bool)
+    if has_compound.any():
+        texts = texts.copy()
+        texts[has_compound] = [tokenizer(t) for t in texts[has_compound]]
+
+    return texts.str.replace('-', ' - ', regex=False)
+
+
+class RuleProfiler(object):
+    """Instrumented word_patterns_replace that keeps statistics per rule.
+
+    Every rule of the table runs on its own (fused passes are split up again,
+    which gives the same output) and records how often it ran, on how many
+    texts it fired, its number of matches, the characters those matches
+    covered (chars_matched), the characters the substitutions changed
+    (chars_changed, see _edit_size) and the time spent in it. The tokenizer and the
+    final hyphen rule are timed too. Turn it on for the whole module with
+    enable_rule_profiling(); preprocess_corpus merges the counts of its
+    worker processes back into it.
+    """
+
+    COUNTS = ('calls', 'hits', 'matches', 'chars_matched', 'chars_changed', 'seconds')
+
+    def __init__(self, rules=WORD_PATTERN_RULES):
+        self.table = rules
+        self.rules = []
+        for pass_idx, (kind, members) in enumerate(rules):
+            for pattern, repl in members:
+                self.rules.append({'pass': pass_idx, 'kind': kind, 'pattern': pattern, 'replacement': repl})
+        self.rules.append({'pass': len(rules), 'kind': 'tokenizer', 'pattern': '-|_', 'replacement': 'tokenizer'})
+        self.rules.append({'pass': len(rules) + 1, 'kind': 'replace', 'pattern': '-', 'replacement': ' - '})
+        self._apply = []
+        for rule in self.rules:
+            if rule['kind'] == 'regex':
+                self._apply.append(functools.partial(re.compile(rule['pattern']).sub, rule['replacement']))
+            elif rule['kind'] == 'replace':
+                self._apply.append(functools.partial(_replace, old=rule['pattern'], new=rule['replacement']))
+            else:
+                self._apply.append(lambda text: tokenizer(text))
+            rule.update(calls=0, hits=0, matches=0, chars_matched=0, chars_changed=0, seconds=0.)
+
+    def __call__(self, text):
+        clock = time.perf_counter
+        for rule, apply_rule in zip(self.rules, self._apply):
+            st = clock()
+            out = apply_rule(text)
+            rule['seconds'] += clock() - st
+            rule['calls'] += 1
+            if out != text:
+                matches, matched, changed = self._count(rule, text, out)
+                rule['hits'] += 1
+                rule['matches'] += matches
+                rule['chars_matched'] += matched
+                rule['chars_changed'] += changed
+            text = out
+        return text
+
+    def counts(self):
+        """The COUNTS of every rule, in rule order, for merge."""
+        return [[rule[name] for name in self.COUNTS] for rule in self.rules]
+
+    def merge(self, counts):
+        """Add the counts() of a profiler of the same rules, e.g. one of a worker process."""
+        for rule, values in zip(self.rules, counts):
+            for name, value in zip(self.COUNTS, values):
+                rule[name] += value
+
+    @staticmethod
+    def _count(rule, text, out):
+        # Matches, matched and changed characters of a rule that turned text into out
+        if rule['kind'] == 'replace':
+            matches = text.count(rule['pattern'])
+            return (matches, matches * len(rule['pattern']),
+                    matches * _edit_size(rule['pattern'], rule['replacement']))
+        if rule['kind'] == 'regex':
+            found = [(m.group(), m.expand(rule['replacement'])) for m in re.finditer(rule['pattern'], text)]
+            return (len(found), sum(len(old) for old, _ in found),
+                    sum(_edit_size(old, new) for old, new in found))
+        # The tokenizer swaps single characters for spaces in place
+        if len(out) == len(text):
+            return 1, 0, sum(a != b for a, b in zip(text, out))
+        return 1, 0, _edit_size(text, out)
+
+    def report(self):
+        """Rules sorted by cumulative time, slowest first."""
+        total = sum(rule['seconds'] for rule in self.rules) or 1.
+        rows = []
+        for rule in sorted(self.rules, key=lambda r: r['seconds'], reverse=True):
+            row = dict(rule)
+            row['share'] = rule['seconds'] / total
+            rows.append(row)
+        return rows
+
+    def write_report(self, prefix):
+        """Write the report to prefix.json and prefix.txt."""
+        rows = self.report()
+        with open(prefix + '.json', 'w') as f:
+            json.dump(rows, f, indent=1)
+        with open(prefix + '.txt', 'w') as f:
+            f.write('%9s %6s %9s %9s %9s %11s %11s  %s\n' % (
+                'ms', 'share', 'calls', 'hits', 'matches', 'matched', 'changed', 'rule'))
+            for row in rows:
+                f.write('%9.1f %5.1f%% %9d %9d %9d %11d %11d  [%d] %s %r -> %r\n' % (
+                    row['seconds'] * 1000, row['share'] * 100, row['calls'], row['hits'], row['matches'],
+                    row['chars_matched'], row['chars_changed'], row['pass'], row['kind'], row['pattern'],
+                    row['replacement']))
+            dead = [row for row in rows if row['calls'] and not row['hits']]
+            f.write('\n%d of %d rules never fired\n' % (len(dead), len(rows)))
+
+
+def _replace(text, old, new):
+    return text.replace(old, new)
+
+
+def _edit_size(old, new):
+    # Characters changed by replacing old with new: the inserted, deleted
+    # and replaced runs of their diff, e.g. 2 for '-' -> ' - ', 8 for '$' -> ' dollar '
+    import difflib
+    return sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in
+               difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes() if tag != 'equal')
+
+
+_rule_profiler = None
+
+
+def enable_rule_profiling(profiler=None):
+    """Route word_patterns_replace through a RuleProfiler until disabled; returns it."""
+    global _rule_profiler
+    _rule_profiler = profiler or RuleProfiler()
+    return _rule_profiler
+
+
+def disable_rule_profiling():
+    global _rule_profiler
+    profiler, _rule_profiler = _rule_profiler, None
+    return profiler
+
+
+# The function "text_to_wordlist" is from
+# https://www.kaggle.com/currie32/quora-question-pairs/the-importance-of-cleaning-text
+# The stop word set and the stemmer are built once per process instead of per call.
+_stops = None
+_stemmer = None
+
+
+def text_to_wordlist(text, remove_stopwords=False, stem_words=False):
+    # Clean the text, with the option to remove stopwords and to stem words.
+    global _stops, _stemmer
+
+    # Convert words to lower case and split them
+    text = text.lower().split()
+
+    # Optionally, remove stop words
+    if remove_stopwords:
+        if _stops is None:
+            _nltk()
+            from nltk.corpus import stopwords
+            _stops = set(stopwords.words("english"))
+        text = [w for w in text if not w in _stops]
+
+    text = " ".join(text)
+
+    # Clean the text
+    text = word_patterns_replace(text)
+
+    # Optionally, shorten words to their stems
+    # Ex. >>> print(stemmer.stem("running"))
+    #     run
+    if stem_words:
+        if _stemmer is None:
+            _nltk()
+            from nltk.stem import SnowballStemmer
+            _stemmer = SnowballStemmer('english')
+        text = " ".join([_stemmer.stem(word) for word in text.split()])
+
+    # Return a list of words
+    return text
+
+
+def preprocess_corpus(texts, n_jobs=None, chunksize=2000, remove_stopwords=False, stem_words=False,
+                      cache_path=None):
+    """Yield text_to_wordlist(text) for every text, in input order.
+
+    The texts are cut into chunks of `chunksize` and cleaned by `n_jobs`
+    worker processes (all cores when None). Results stream back as soon as
+    the chunk holding them is done, so `texts` may be a lazy iterable.
+    While rule profiling is on, the workers profile their chunks and the
+    counts are merged into the RuleProfiler of this process.
+
+    With `cache_path`, cleaned texts are looked up in (and added to) the
+    PreprocessingCache at that path, and only unseen questions are cleaned.
+    """
+    clean = functools.partial(text_to_wordlist, remove_stopwords=remove_stopwords, stem_words=stem_words)
+
+    def clean_all(texts):
+        if n_jobs != 1:
+            # Load the lexicon before forking so the workers share the parent's copy
+            load_wordnet_lexicon()
+            if _rule_profiler is not None:
+                return _profiled_pool_map(clean, texts, n_jobs, chunksize)
+        return _pool_map(clean, texts, n_jobs, chunksize)
+
+    if cache_path is None:
+        results = clean_all(texts)
+    else:
+        version = '%s-%d%d' % (ruleset_version(), remove_stopwords, stem_words)
+        results = through_cache(texts, clean_all, version, cache_path)
+    for text in results:
+        yield text
+
+
+def through_cache(texts, compute, version, cache_path):
+    """Yield the cached result of every text in order.
+
+    compute(texts) fills in the texts the cache at cache_path has not seen
+    under version yet, once per distinct text, and must return one str (or
+    bytes) per text.
+    """
+    cache = PreprocessingCache(cache_path)
+    try:
+        texts = iter(texts)
+        while True:
+            block = list(itertools.islice(texts, PreprocessingCache.BLOCK_SIZE))
+            if not block:
+                break
+            digests = [text_digest(text) for text in block]
+            results = cache.get_many(version, digests)
+            missing = {}
+            for digest, text in zip(digests, block):
+                if digest not in results:
+                    missing[digest] = text
+            if missing:
+                new = dict(zip(missing, compute(list(missing.values()))))
+                cache.put_many(version, new.items())
+                results.update(new)
+            for digest in digests:
+                yield results[digest]
+    finally:
+        cache.close()
+
+
+def _pool_map(func, items, n_jobs, chunksize):
+    # Ordered, streaming map over a process pool; n_jobs=1 stays in-process
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    if n_jobs == 1:
+        for item in items:
+            yield func(item)
+        return
+
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+        for result in pool.imap(func, items, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+
+
+def _profiled_chunk(args):
+    # Pool task of _profiled_pool_map: one chunk cleaned under a fresh
+    # RuleProfiler, whose counts go back with the results
+    global _rule_profiler
+    func, rules, items = args
+    previous = _rule_profiler
+    profiler = _rule_profiler = RuleProfiler(rules)
+    try:
+        return [func(item) for item in items], profiler.counts()
+    finally:
+        _rule_profiler = previous
+
+
+def _profiled_pool_map(func, items, n_jobs, chunksize):
+    # _pool_map while rules are profiled, the workers' counts merged into
+    # the profiler of this process chunk by chunk
+    profiler = _rule_profiler
+    items = iter(items)
+    chunks = iter(lambda: list(itertools.islice(items, chunksize)), [])
+    for results, counts in _pool_map(_profiled_chunk, ((func, profiler.table, chunk) for chunk in chunks), n_jobs, 1):
+        profiler.merge(counts)
+        for result in results:
+            yield result
+
+
+# Cleaned questions are shared by every model script, every CV fold and
+# feature_engineer.prepare_df through one SQLite file next to this module.
+PREPROCESSING_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocessing_cache.sqlite')
+_ruleset_version = None
+
+
+def ruleset_version():
+    """Hash of the rule table, the cleaning code and the WordNet lexicon; any change starts a fresh cache.
+
+    The code includes the helpers that compile the table into passes, and
+    the lexicon is hashed by its words, which decide what the tokenizer
+    joins.
+    """
+    global _ruleset_version
+    if _ruleset_version is None:
+        h = hashlib.sha1(repr(WORD_PATTERN_RULES).encode('utf-8'))
+        compilers = [compile_rules, _split_template, _shared_prefix] + sorted(
+            set(_PASS_COMPILERS.values()), key=lambda func: func.__name__)
+        for func in [word_patterns_replace, tokenizer, text_to_wordlist, load_wordnet_lexicon] + compilers:
+            h.update(inspect.getsource(func).encode('utf-8'))
+        h.update('\n'.join(sorted(load_wordnet_lexicon())).encode('utf-8'))
+        _ruleset_version = h.hexdigest()[:16]
+    return _ruleset_version
+
+
+def text_digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class PreprocessingCache(object):
+    """On-disk map of (rule-set version, text digest) -> cleaned text.
+
+    Quora pairs reuse the same question many times, so one row per distinct
+    question text is enough. Entries of other rule-set versions are never
+    read; drop them with purge().
+    """
+    BLOCK_SIZE = 100000
+    # SQLite caps the number of host parameters per statement
+    _MAX_PARAMS = 900
+
+    def __init__(self, path=PREPROCESSING_CACHE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=600)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS cleaned ('
+                          'version TEXT NOT NULL, digest BLOB NOT NULL, text TEXT NOT NULL, '
+                          'PRIMARY KEY (version, digest)) WITHOUT ROWID')
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, version, digests):
+        found = {}
+        unique = list(set(digests))
+        for start in range(0, len(unique), self._MAX_PARAMS):
+            batch = unique[start:start + self._MAX_PARAMS]
+            rows = self.conn.execute(
+                'SELECT digest, text FROM cleaned WHERE version = ? AND digest IN (%s)' % ','.join('?' * len(batch)),
+                [version] + batch)
+            found.update(rows)
+        self.hits += len(found)
+        self.misses += len(unique) - len(found)
+        return found
+
+    def put_many(self, version, items):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO cleaned VALUES (?, ?, ?)',
+                                  ((version, digest, text) for digest, text in items))
+
+    def purge(self, keep_version):
+        """Delete the entries of every rule-set version except `keep_version`."""
+        with self.conn:
+            self.conn.execute('DELETE FROM cleaned WHERE version != ?', (keep_version,))
+
+    def close(self):
+        self.conn.close()
+
+
+# Every word that wordnet.synsets() knows, inflected forms included, written
+# once by build_wordnet_lexicon() so the tokenizer never opens the corpus reader
+WORDNET_LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wordnet_lexicon.txt.gz')
+_wordnet_lexicon = None
+
+
+def build_wordnet_lexicon(path=WORDNET_LEXICON_PATH):
+    """Dump the set of words with at least one WordNet synset to `path`.
+
+    wordnet.synsets(w) lower-cases w and, for every part of speech, looks up w
+    itself plus the forms produced either by the exception list (geese ->
+    goose) or by one morphological substitution (dogs -> dog). Running those
+    substitutions backwards from every lemma gives exactly the (finite) set of
+    surface forms for which synsets(w) is not empty.
+    """
+    _nltk()
+    from nltk.corpus import wordnet
+    words = set()
+    for pos in ('n', 'v', 'a', 'r'):
+        lemmas = set(wordnet.all_lemma_names(pos))
+        exceptions = wordnet._exception_map[pos]
+        words.update(lemmas)
+        for form, bases in exceptions.items():
+            if form in lemmas or any(base in lemmas for base in bases):
+                words.add(form)
+        for old, new in wordnet.MORPHOLOGICAL_SUBSTITUTIONS[pos]:
+            for lemma in lemmas:
+                if lemma.endswith(new):
+                    form = lemma[:len(lemma) - len(new)] + old
+                    # The exception list replaces the rules for the forms it knows
+                    if form not in exceptions:
+                        words.add(form)
+
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write('\n'.join(sorted(words)))
+    return frozenset(words)
+
+
+def load_wordnet_lexicon(path=WORDNET_LEXICON_PATH):
+    """Load the lexicon written by build_wordnet_lexicon, building it on first use."""
+    global _wordnet_lexicon
+    if _wordnet_lexicon is None:
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                _wordnet_lexicon = frozenset(f.read().split('\n'))
+        else:
+            _wordnet_lexicon = build_wordnet_lexicon(path)
+    return _wordnet_lexicon
+
+
 def tokenizer(sentence):
-    k = len(sentence)
+    # Join hyphenated compounds whose every part is a real word, i.e. neural-based -> neural based
     sentence = sentence.replace("-", "_")
     sentence = sentence.replace('–', '_')
+    if '_' not in sentence:
+        return sentence
+
+    lexicon = load_wordnet_lexicon()
     list_s = sentence.split(" ")
-    for s_idx in range(len(list_s)):
-        s = list_s[s_idx]
-        words = s.split("_")
-        if len(words) > 1:
-            flag_not_word = False
-            for w in words:
-                k = len(w)
-                t = wordnet.synsets(w)
-                if len(w) == 1 or not wordnet.synsets(w):
-                    flag_not_word = True
-                    break
-            if not flag_not_word:
-                list_s.remove(s)
-                s = s.replace("_", " ")
-                list_s.insert(s_idx, s)
+    for s_idx, s in enumerate(list_s):
+        if '_' in s and all(len(w) != 1 and w.lower() in lexicon for w in s.split("_")):
+            list_s[s_idx] = s.replace("_", " ")
     return " ".join(list_s)
 
 
 def get_continuous_chunks(text):
-    chunked = ne_chunk(pos_tag(word_tokenize(text)))
+    nltk = _nltk()
+    return _continuous_chunks(nltk.ne_chunk(nltk.pos_tag(nltk.word_tokenize(text))))
+
+
+def _continuous_chunks(chunked):
+    from nltk.tree import Tree
     prev = None
     continuous_chunk = []
     current_chunk = []
@@ -158,20 +769,92 @@ def get_continuous_chunks(text):
     if named_entity not in continuous_chunk:
        continuous_chunk.append(named_entity)
     return continuous_chunk
+
+
+def _chunk_batch(texts):
+    # One pos_tag_sents / ne_chunk_sents call per batch keeps the tagger and
+    # the chunker loaded instead of setting them up for every sentence
+    nltk = _nltk()
+    tagged = nltk.pos_tag_sents([nltk.word_tokenize(text) for text in texts])
+    return [_continuous_chunks(chunked) for chunked in nltk.ne_chunk_sents(tagged)]
+
+
+def get_continuous_chunks_batch(texts, n_jobs=None, batch_size=500, cache_path=None):
+    """Yield get_continuous_chunks(text) for every text, in input order.
+
+    Texts are tagged and chunked `batch_size` at a time by `n_jobs` worker
+    processes (all cores when None). With `cache_path`, the chunks of every
+    distinct question are memoized in the PreprocessingCache at that path.
+    """
+    def compute(texts):
+        texts = iter(texts)
+        batches = iter(lambda: list(itertools.islice(texts, batch_size)), [])
+        for batch in _pool_map(_chunk_batch, batches, n_jobs, 1):
+            for chunks in batch:
+                yield chunks
+
+    if cache_path is None:
+        for chunks in compute(texts):
+            yield chunks
+        return
+
+    # An entity never contains a newline, and get_continuous_chunks never
+    # returns an empty list, so '\n'.join round-trips
+    version = 'ner-' + hashlib.sha1(inspect.getsource(_continuous_chunks).encode('utf-8')).hexdigest()[:16]
+    encoded = lambda missing: ('\n'.join(chunks) for chunks in compute(missing))
+    for chunks in through_cache(texts, encoded, version, cache_path):
+        yield chunks.split('\n')
+
+
+def entity_table(ids, texts, n_jobs=None, batch_size=500, cache_path=None):
+    """Yield one (id, entity) row per named entity found in each text."""
+    for qid, chunks in zip(ids, get_continuous_chunks_batch(texts, n_jobs, batch_size, cache_path)):
+        for entity in chunks:
+            if entity:
+                yield qid, entity
+
+
 # SS ="I'm a 19-year-old. I spend $5000 which is 20% of my 9/11 sayings… . Aréaééé 0.999 5kgs 10kg 555kph 5hours e-mail e - mail? jj korea J.K."
 # SSS = "'online' ‘god’ 'suroor' 'non aspiration' dyke” 'dm ''biba'' 'couldn't've 'mia mia' if “膜”  ‘weekends’ player’s ‘would’ ‘would ''how “her”"
 #SS = "I am a 19-year-old. man who love neural-based paper and F-14 flight"
 #TXT = "Barack Obama is the husband of Michelle Obama"
-# print(tokenizer(SS))
-# print(word_patterns_replace(SS)+'\n')
-# print(word_patterns_replace(SSS)+'\n')
-#print(get_continuous_chunks(TXT))
 #TXT = "\"Ted's Indian-made <20K 10 V dicks that cost <$10,000 hasn't been detected/protected at (9+2)/11 with [/math] and MOOCs/E-learning (900/1,800 bpm Tu-95).\n PIF: 14-years-old Trump–Clinton U.S. Presidential debate is good for 10Km? <\html>\""
 #TXT = "What is the output for in main {char *ptr=""hello""; ptr [0] ='m'; printf (""%s"" , *s);} ?"
 #TXT = "If light has zero mass , then as per this [math]E=mc^2[/math] , light must have zero energy. Is it so ?"
 #TXT = "What is the story of Kohinoor (Koh-i-Noor) Diamond"
 # TXT="How would I find the necessary number of turns on a transformer primary if the secondary voltage required is 120 V at 60 Hz ?"
-TXT="A distribution transformer is rated at 18 kVA , 20,000/480 V , and 60 hz. can this transformer safely supply 15kVA to a 415-V load at 50hz? Why or not?"
-print('\nINPUT:\n' + TXT)
-print('\nOUTPUT:\n' + word_patterns_replace(TXT))
+TXT = "A distribution transformer is rated at 18 kVA , 20,000/480 V , and 60 hz. can this transformer safely supply 15kVA to a 415-V load at 50hz? Why or not?"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the question cleaning rules on some text.')
+    parser.add_argument('text', nargs='?', default=TXT, help='text to clean (default: a sample question)')
+    parser.add_argument('--chunks', action='store_true', help='also print the named-entity chunks')
+    parser.add_argument('--build-lexicon', action='store_true',
+                        help='(re)build %s from the NLTK WordNet corpus' % os.path.basename(WORDNET_LEXICON_PATH))
+    parser.add_argument('--profile-rules', metavar='CSV',
+                        help='clean every question of a Quora pair csv and report per-rule statistics')
+    parser.add_argument('--report', default='rule_profile', help='report path prefix for --profile-rules')
+    args = parser.parse_args(argv)
+
+    if args.build_lexicon:
+        print('%d words written to %s' % (len(build_wordnet_lexicon()), WORDNET_LEXICON_PATH))
+    if args.profile_rules:
+        profiler = enable_rule_profiling()
+        with open(args.profile_rules, encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                text_to_wordlist(row['question1'])
+                text_to_wordlist(row['question2'])
+        disable_rule_profiling()
+        profiler.write_report(args.report)
+        print('rule profile written to %s.json and %s.txt' % (args.report, args.report))
+        return
+
+    print('\nINPUT:\n' + args.text)
+    print('\nOUTPUT:\n' + word_patterns_replace(args.text))
+    if args.chunks:
+        print('\nCHUNKS:\n' + str(get_continuous_chunks(args.text)))
+
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""Streaming cleaner and reader for the raw Quora question pair files.
+
+    python quora_data.py /path/train.csv /path/test.csv [--format parquet] [--jobs N]
+
+writes train_clean.csv and train_clean.parquet (and the same for test) next to
+each input. The cleaning is what the xgboost notebooks did to the whole file:
+'?' becomes a space and an empty question becomes a single space, so that it
+is not read back as NaN. The file is read in chunks of --chunksize rows and
+the chunks are cleaned by a process pool, with at most two chunks per worker
+in flight, so memory stays bounded whatever the file size.
+
+read_table, iter_chunks, iter_columns and read_rows read the cleaned CSV,
+Parquet and Feather copies alike, so the scripts can switch to the columnar copy by
+changing the path. A question is always read as the text in the file: '',
+'NA', 'null' and the other strings pandas.read_csv takes for NaN by default
+stay strings, in every reader and in the columnar copies.
+"""
+import os
+import csv
+import collections
+import multiprocessing
+import argparse
+import time
+
+QUESTION_COLUMNS = ('question1', 'question2')
+COLUMNAR_FORMATS = ('parquet', 'feather')
+
+
+def clean_chunk(chunk, keep_empty=False):
+    """Clean the question columns of one DataFrame chunk read with clean_csv's options.
+
+    An empty question becomes ' ' where the notebooks' replace(',"",',
+    '," ",') reached it: not in the last column (question2 of test.csv),
+    and not right after an empty question that was replaced, which used
+    up the comma between them.
+    """
+    columns = list(chunk.columns)
+    replaced = previous = None
+    for col in sorted((col for col in QUESTION_COLUMNS if col in chunk), key=columns.index):
+        idx = columns.index(col)
+        questions = chunk[col].str.replace('?', ' ', regex=False)
+        empty = (questions == '') & (idx < len(columns) - 1)
+        if replaced is not None and previous == idx - 1:
+            empty &= ~replaced
+        if not keep_empty:
+            questions = questions.mask(empty, ' ')
+        chunk[col] = questions
+        replaced, previous = empty, idx
+    return chunk
+
+
+def _read_csv(path, **kwargs):
+    # pandas.read_csv with the questions as text, never NaN
+    import pandas as pd
+    return pd.read_csv(path, keep_default_na=False, dtype={col: str for col in QUESTION_COLUMNS}, **kwargs)
+
+
+def _clean_chunk_star(args):
+    return clean_chunk(*args)
+
+
+def _bounded_imap(func, items, n_jobs, max_pending):
+    # Like Pool.imap, but without reading ahead more than max_pending items:
+    # imap's feeder thread would pull the whole chunk reader into memory.
+    if n_jobs == 1:
+        for item in items:
+            yield func(item)
+        return
+    pending = collections.deque()
+    with multiprocessing.Pool(n_jobs) as pool:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def _columnar_writer(path, fmt, schema):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fmt == 'parquet':
+        return pq.ParquetWriter(path, schema)
+    return pa.ipc.new_file(path, schema)
+
+
+def clean_csv(src, dst=None, columnar='parquet', chunksize=100000, n_jobs=None, keep_empty=False):
+    """Clean the Quora csv src chunk by chunk into dst and a columnar copy.
+
+    dst defaults to <src stem>_clean.csv; the columnar copy ('parquet',
+    'feather' or None) is written next to it with the matching extension.
+    Returns the paths written.
+    """
+    import pyarrow as pa
+
+    if dst is None:
+        dst = os.path.splitext(src)[0] + '_clean.csv'
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    paths = [dst]
+    columnar_path = None
+    if columnar is not None:
+        if columnar not in COLUMNAR_FORMATS:
+            raise ValueError('columnar must be one of %s, not %r' % (COLUMNAR_FORMATS, columnar))
+        columnar_path = os.path.splitext(dst)[0] + '.' + columnar
+        paths.append(columnar_path)
+
+    # Questions stay str and an empty question stays '', as in the raw text
+    reader = _read_csv(src, chunksize=chunksize)
+    chunks = _bounded_imap(_clean_chunk_star, ((chunk, keep_empty) for chunk in reader),
+                           n_jobs, max_pending=2 * n_jobs)
+
+    writer = schema = None
+    with open(dst, 'w', encoding='utf-8', newline='') as f:
+        try:
+            for idx, chunk in enumerate(chunks):
+                chunk.to_csv(f, header=idx == 0, index=False, quoting=csv.QUOTE_ALL)
+                if columnar_path is None:
+                    continue
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = _columnar_writer(columnar_path, columnar, schema)
+                writer.write_table(table.cast(schema))
+        finally:
+            if writer is not None:
+                writer.close()
+    return paths
+
+
+def to_columnar(src, dst, columnar='parquet', chunksize=100000):
+    """Copy the cleaned csv src as it is into the columnar file dst, chunksize rows per row group.
+
+    For readers that need row ranges of a file that was only kept as csv:
+    read_rows of the copy reads just the rows asked for. Returns dst.
+    """
+    import pyarrow as pa
+
+    if columnar not in COLUMNAR_FORMATS:
+        raise ValueError('columnar must be one of %s, not %r' % (COLUMNAR_FORMATS, columnar))
+    writer = schema = None
+    try:
+        for chunk in _read_csv(src, chunksize=chunksize):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = _columnar_writer(dst, columnar, schema)
+            writer.write_table(table.cast(schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    return dst
+
+
+def read_table(path, columns=None):
+    """Read a cleaned file (.csv, .parquet or .feather) into a DataFrame."""
+    import pandas as pd
+    ext = os.path.splitext(path)[1]
+    if ext == '.parquet':
+        return pd.read_parquet(path, columns=columns)
+    if ext == '.feather':
+        return pd.read_feather(path, columns=columns)
+    return _read_csv(path, usecols=columns)
+
+
+def iter_columns(path, columns, batch_size=100000):
+    """Yield tuples of the given columns row by row, without loading the whole file.
+
+    A csv yields str values like csv.reader; Parquet and Feather yield the
+    stored types.
+    """
+    ext = os.path.splitext(path)[1]
+    if ext in ('.parquet', '.feather'):
+        if ext == '.parquet':
+            import pyarrow.parquet as pq
+            batches = pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=list(columns))
+        else:
+            import pyarrow as pa
+            source = pa.ipc.open_file(pa.memory_map(path))
+            batches = (source.get_batch(i).select(list(columns)) for i in range(source.num_record_batches))
+        for batch in batches:
+            for row in zip(*(batch.column(col).to_pylist() for col in columns)):
+                yield row
+        return
+
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.reader(f, delimiter=',')
+        header = next(reader)
+        indices = [header.index(col) for col in columns]
+        for values in reader:
+            yield tuple(values[i] for i in indices)
+
+
+def iter_chunks(path, chunksize=100000, columns=None):
+    """Yield a cleaned file (.csv, .parquet or .feather) as DataFrames of at most chunksize rows.
+
+    Only one chunk (a record batch of the Feather file) is in memory at a
+    time; the row index runs on across chunks.
+    """
+    import pandas as pd
+    ext = os.path.splitext(path)[1]
+    if ext == '.csv':
+        for chunk in _read_csv(path, chunksize=chunksize, usecols=columns):
+            yield chunk
+        return
+
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns)
+    else:
+        import pyarrow as pa
+        source = pa.ipc.open_file(pa.memory_map(path))
+        batches = (source.get_batch(i) for i in range(source.num_record_batches))
+        if columns is not None:
+            batches = (batch.select(list(columns)) for batch in batches)
+    start = 0
+    for batch in batches:
+        for offset in range(0, batch.num_rows, chunksize):
+            chunk = batch.slice(offset, chunksize).to_pandas()
+            chunk.index = pd.RangeIndex(start, start + len(chunk))
+            start += len(chunk)
+            yield chunk
+
+
+def count_rows(path):
+    """Number of rows of a cleaned file, from the metadata of a columnar one."""
+    ext = os.path.splitext(path)[1]
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    if ext == '.feather':
+        import pyarrow as pa
+        source = pa.ipc.open_file(pa.memory_map(path))
+        return sum(source.get_batch(i).num_rows for i in range(source.num_record_batches))
+    with open(path, encoding='utf-8', newline='') as f:
+        first = next(csv.reader(f))[0]
+    return sum(len(chunk) for chunk in _read_csv(path, usecols=[first], chunksize=1000000))
+
+
+def read_rows(path, start, stop, columns=None):
+    """The rows start to stop of a cleaned file, indexed start, start + 1, ... like iter_chunks.
+
+    A csv is parsed from the top but only those rows are kept, so reading
+    a whole csv range by range takes quadratic time (see to_columnar);
+    Parquet reads just the row groups holding them and Feather slices its
+    memory map.
+    """
+    import pandas as pd
+    ext = os.path.splitext(path)[1]
+    if ext == '.csv':
+        chunk = _read_csv(path, usecols=columns, skiprows=range(1, start + 1), nrows=max(stop - start, 0))
+    elif ext == '.parquet':
+        import pyarrow.parquet as pq
+        source = pq.ParquetFile(path)
+        groups, offset, first = [], 0, None
+        for i in range(source.metadata.num_row_groups):
+            rows = source.metadata.row_group(i).num_rows
+            if offset < stop and offset + rows > start:
+                groups.append(i)
+                first = offset if first is None else first
+            offset += rows
+        if not groups:
+            chunk = source.schema_arrow.empty_table().to_pandas()
+            chunk = chunk[columns] if columns is not None else chunk
+        else:
+            table = source.read_row_groups(groups, columns=columns)
+            chunk = table.slice(start - first, stop - start).to_pandas()
+    else:
+        import pyarrow as pa
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        if columns is not None:
+            table = table.select(list(columns))
+        chunk = table.slice(start, max(stop - start, 0)).to_pandas()
+    chunk.index = pd.RangeIndex(start, start + len(chunk))
+    return chunk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('csv', nargs='+', help='raw Quora csv files (train.csv, test.csv, ...)')
+    parser.add_argument('--format', choices=COLUMNAR_FORMATS + ('none',), default='parquet',
+                        help='columnar copy written next to the cleaned csv')
+    parser.add_argument('--chunksize', type=int, default=100000, help='rows per chunk')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes, default all cores')
+    parser.add_argument('--keep-empty', action='store_true', help="leave empty questions empty (xgboost_2)")
+    args = parser.parse_args(argv)
+
+    columnar = None if args.format == 'none' else args.format
+    for src in args.csv:
+        st = time.time()
+        paths = clean_csv(src, columnar=columnar, chunksize=args.chunksize, n_jobs=args.jobs,
+                          keep_empty=args.keep_empty)
+        print('%s -> %s (%.1fs)' % (src, ', '.join(paths), time.time() - st))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Wall time, CPU time and peak memory of the stages of the feature pipeline.
+
+    profile = StageProfile()
+    with profile.stage('prepare_df') as record:
+        df = prepare_df(path)
+        record.rows = len(df)
+    ...
+    profile.write('added_features/profile')   # profile.json and profile.md
+
+Each stage records:
+
+    wall      seconds on the clock
+    cpu       user + system seconds of the process and of the child
+              processes it reaped meanwhile (the workers of a
+              multiprocessing.Pool are reaped when the pool is closed)
+    peak_rss  how far the resident set of the process rose above its
+              size at the start of the stage, in bytes
+    rows      rows the stage processed, if it says so; rows/s follows
+
+On Linux the peak is the kernel's VmHWM, reset at the start of every
+stage through /proc/self/clear_refs, so it is exact for this process;
+elsewhere it falls back to ru_maxrss, which only shows peaks above every
+earlier one. Runs of the same stage inside the same outer stages, e.g.
+one per chunk of a streamed file, are summed in the report.
+"""
+import os
+import json
+import time
+import contextlib
+
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+def _proc_memory():
+    # Current and peak resident set size in bytes, from /proc
+    sizes = {}
+    with open(PROC_STATUS) as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                key, value = line.split(':')
+                sizes[key] = int(value.split()[0]) * 1024
+    return sizes['VmRSS'], sizes['VmHWM']
+
+
+def _reset_peak():
+    # Sets VmHWM back to the current VmRSS; False where that is not possible
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _maxrss():
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _memory():
+    # (current, peak) resident set size, current being None without /proc
+    try:
+        return _proc_memory()
+    except (IOError, OSError, KeyError):
+        return None, _maxrss()
+
+
+def _cpu_seconds():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class StageRecord(object):
+    """The measurements of one run of a stage; rows may be set inside the with block."""
+
+    def __init__(self, name, rows=None, parents=()):
+        self.name = name
+        self.rows = rows
+        self.parents = tuple(parents)
+        self.depth = len(self.parents)
+        self.wall = self.cpu = 0.
+        self.peak_rss = 0
+        self._peak = 0
+
+    def as_dict(self):
+        return {'name': self.name, 'parents': list(self.parents), 'rows': self.rows, 'wall': self.wall,
+                'cpu': self.cpu, 'peak_rss': self.peak_rss}
+
+
+class StageProfile(object):
+    """Records of the stages run inside stage(), in the order they started.
+
+    Stages nest: the peak of an inner stage counts for the outer one as
+    well, and depth tells them apart in the report.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._open = []
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        record = StageRecord(name, rows, parents=[outer.name for outer in self._open])
+        current, peak = _memory()
+        if self._open:
+            # The outer stage keeps the peak reached so far before it is reset
+            self._open[-1]._peak = max(self._open[-1]._peak, peak)
+        resettable = current is not None and _reset_peak()
+        start_rss = current if resettable else peak
+        self.records.append(record)
+        self._open.append(record)
+        st, cpu = time.perf_counter(), _cpu_seconds()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - st
+            record.cpu = _cpu_seconds() - cpu
+            record._peak = max(record._peak, _memory()[1])
+            record.peak_rss = max(0, record._peak - start_rss)
+            self._open.pop()
+            if self._open:
+                self._open[-1]._peak = max(self._open[-1]._peak, record._peak)
+
+    def summary(self):
+        """One row per stage (within its outer stages) in order of first start, runs summed, the largest peak."""
+        rows = {}
+        for record in self.records:
+            key = record.parents + (record.name,)
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {'stage': record.name, 'depth': record.depth, 'calls': 0, 'rows': None,
+                                   'wall': 0., 'cpu': 0., 'peak_rss': 0}
+            row['calls'] += 1
+            row['wall'] += record.wall
+            row['cpu'] += record.cpu
+            row['peak_rss'] = max(row['peak_rss'], record.peak_rss)
+            if record.rows is not None:
+                row['rows'] = (row['rows'] or 0) + record.rows
+        total = sum(row['wall'] for row in rows.values() if row['depth'] == 0) or 1.
+        for row in rows.values():
+            row['rows_per_s'] = row['rows'] / row['wall'] if row['rows'] is not None and row['wall'] > 0 else None
+            row['share'] = row['wall'] / total
+        return list(rows.values())
+
+    def to_markdown(self):
+        lines = ['| stage | calls | rows | wall s | cpu s | peak RSS MB | rows/s | share |',
+                 '|---|---:|---:|---:|---:|---:|---:|---:|']
+        for row in self.summary():
+            lines.append('| %s%s | %d | %s | %.2f | %.2f | %.1f | %s | %.1f%% |' % (
+                '&nbsp;&nbsp;' * row['depth'], row['stage'], row['calls'],
+                '' if row['rows'] is None else row['rows'], row['wall'], row['cpu'], row['peak_rss'] / 2. ** 20,
+                '' if row['rows_per_s'] is None else '%.0f' % row['rows_per_s'], 100 * row['share']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the summary to path.json and path.md, plus the single runs to the json."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'stages': self.summary(), 'runs': [record.as_dict() for record in self.records]}, f,
+                      indent=1)
+        with open(path + '.md', 'w', encoding='utf-8') as f:
+            f.write(self.to_markdown())
+        return path + '.json', path + '.md'
+
+
+def stage(profile, name, rows=None):
+    """profile.stage(name, rows), or a record nobody reads if profile is None."""
+    if profile is None:
+        return contextlib.nullcontext(StageRecord(name, rows))
+    return profile.stage(name, rows)
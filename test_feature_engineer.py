@@ -0,0 +1,552 @@
+import os
+import random
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import feature_engineer
+import preprocessing
+import stage_profile
+from test_preprocessing import FakeNltk
+
+
+@pytest.fixture
+def pairs():
+    df = pd.DataFrame({
+        'question1': ['What is the story of Kohinoor (Koh-i-Noor) Diamond?',
+                      'How do I read and find my YouTube comments?',
+                      'Why did Barack Obama meet Angela Merkel in Berlin?',
+                      'Should I buy tiago?', ' '],
+        'question2': ['What would happen if the Indian government stole the Kohinoor (Koh-i-Noor) diamond back?',
+                      'How can I see all my Youtube comments?',
+                      'Did Angela Merkel meet Obama in Paris?',
+                      'What keeps childern active and far from phone and video games?', 'What?'],
+    })
+    df['q1_split'] = df['question1'].map(lambda x: str(x).lower().split())
+    df['q2_split'] = df['question2'].map(lambda x: str(x).lower().split())
+    return df
+
+
+def test_entity_overlap_features(monkeypatch, tmp_path, pairs):
+    monkeypatch.setattr(preprocessing, '_nltk', lambda: FakeNltk)
+    X = feature_engineer.entity_overlap_features(pairs, n_jobs=1, cache_path=str(tmp_path / 'cache.sqlite'))
+    for i, (q1, q2) in enumerate(zip(pairs.question1, pairs.question2)):
+        e1 = set(preprocessing.get_continuous_chunks(q1)) - {''}
+        e2 = set(preprocessing.get_continuous_chunks(q2)) - {''}
+        assert X['entity_count_q1'][i] == len(e1)
+        assert X['entity_count_q2'][i] == len(e2)
+        assert X['common_entities'][i] == len(e1 & e2)
+        assert np.isclose(X['entity_jaccard'][i], len(e1 & e2) / len(e1 | e2) if e1 | e2 else 0.)
+
+
+def test_set_overlap_features_match_row_functions(pairs):
+    fe = feature_engineer
+    extra = pd.DataFrame({'question1': ['', 'is it the', 'a b c', 'Kohinoor?', 'x'],
+                          'question2': ['what', 'it is', '', 'é Kohinoor kohinoor?', 'x y x']})
+    extra['q1_split'] = extra['question1'].map(lambda x: str(x).lower().split())
+    extra['q2_split'] = extra['question2'].map(lambda x: str(x).lower().split())
+    data = pd.concat([pairs, extra], ignore_index=True)
+    stops = {'is', 'the', 'it', 'what', 'a', 'do', 'i'}
+    # Zero and missing weights included, like calculate_tfidf's dict for unseen words
+    weights = {'what': 1.2, 'is': 0., 'the': 0.5, 'kohinoor': 3., 'x': 0., 'y': 0., 'a': 2.}
+
+    X = fe.set_overlap_features(data, stops, weights)
+    row_wise = {
+        'word_count_diff': fe.wc_diff,
+        'word_count_ratio': fe.wc_ratio,
+        'total_unique_words': fe.total_unique_words,
+        'wc_diff_unique': fe.wc_diff_unique,
+        'wc_ratio_unique': fe.wc_ratio_unique,
+        'total_unq_words_stop': lambda row: fe.total_unq_words_stop(row, stops),
+        'wc_diff_unique_stop': lambda row: fe.wc_diff_unique_stop(row, stops),
+        'wc_ratio_unique_stop': lambda row: fe.wc_ratio_unique_stop(row, stops),
+        'same_start': fe.same_start_word,
+        'same_end': fe.same_end_word,
+        'common_words': fe.common_words,
+        'common_words_unique': fe.common_words_unit,
+        'word_match': fe.word_match_share,
+        'word_match_stops': lambda row: fe.word_match_share_stops(row, stops),
+        'tfidf_wm': lambda row: fe.tfidf_word_match_share(row, weights),
+        'tfidf_wm_stops': lambda row: fe.tfidf_word_match_share_stops(row, stops, weights),
+        'jaccard': fe.jaccard,
+    }
+    assert list(X.columns) == list(row_wise)
+    with np.errstate(invalid='ignore'):
+        for column, func in row_wise.items():
+            expected = np.array([func(row) for _, row in data.iterrows()], dtype=float)
+            np.testing.assert_allclose(X[column].values.astype(float), expected, rtol=1e-12, err_msg=column)
+
+
+def test_fuzzy_features_match_fuzz(pairs):
+    from fuzzywuzzy import fuzz
+    scorers = [fuzz.QRatio, fuzz.WRatio, fuzz.partial_ratio, fuzz.partial_token_set_ratio,
+               fuzz.partial_token_sort_ratio, fuzz.token_set_ratio, fuzz.token_sort_ratio]
+    rng = random.Random(3)
+    words = ['how', 'do', 'I', 'learn', 'Python', 'python?', 'café', '!!', '(c++)', 'a', '', ' ']
+    q1 = pairs.question1.tolist() + ['', '?!', 'same thing', 'a', 'short', 'é']
+    q2 = pairs.question2.tolist() + ['', 'what', 'same thing', 'a b c d e f g h i j k l m n o p q r s',
+                                     'shorter and longer strings', 'e']
+    for _ in range(300):
+        q1.append(' '.join(rng.choice(words) for _ in range(rng.randint(0, 8))))
+        q2.append(' '.join(rng.choice(words) for _ in range(rng.randint(0, 8))))
+    data = pd.DataFrame({'question1': q1, 'question2': q2})
+
+    expected = np.array([[scorer(a, b) for scorer in scorers] for a, b in zip(q1, q2)], dtype=np.float32)
+    for n_jobs, chunksize in ((1, 20000), (2, 37)):
+        block = feature_engineer.fuzzy_features(data, n_jobs=n_jobs, chunksize=chunksize)
+        assert block.dtype == np.float32
+        np.testing.assert_array_equal(block, expected)
+
+
+def test_char_ngram_features_match_char_ngrams(pairs):
+    import collections
+
+    def row_wise(s1, s2):
+        row = []
+        for n in feature_engineer.CHAR_NGRAM_SIZES:
+            c1, c2 = [collections.Counter(g for w in split for g in feature_engineer.char_ngrams(n, w))
+                      for split in (s1, s2)]
+            norms = np.sqrt(sum(v * v for v in c1.values()) * sum(v * v for v in c2.values()))
+            shared, union, smaller = len(set(c1) & set(c2)), len(set(c1) | set(c2)), min(len(c1), len(c2))
+            row += [sum(c1[g] * c2[g] for g in c1) / norms if norms else 0, shared / union if union else 0,
+                    shared / smaller if smaller else 0]
+        return row
+
+    rng = random.Random(5)
+    words = ['how', 'do', 'i', 'learn', 'python', 'python?', 'café', '!!', '(c++)', 'a', 'ab', '𝔘nicode']
+    splits = list(zip(pairs.q1_split, pairs.q2_split)) + [([], ['ab']), (['a'], ['a']), (['abab'], ['ab', 'ba'])]
+    for _ in range(200):
+        splits.append(([rng.choice(words) for _ in range(rng.randint(0, 8))],
+                       [rng.choice(words) for _ in range(rng.randint(0, 8))]))
+    data = pd.DataFrame({'q1_split': [s1 for s1, _ in splits], 'q2_split': [s2 for _, s2 in splits]})
+
+    expected = np.array([row_wise(s1, s2) for s1, s2 in splits], dtype=np.float32)
+    for n_jobs, chunksize in ((1, 20000), (2, 37)):
+        block = feature_engineer.char_ngram_features(data, n_jobs=n_jobs, chunksize=chunksize)
+        assert block.dtype == np.float32 and block.shape == (len(splits), 12)
+        np.testing.assert_allclose(block, expected, rtol=1e-6)
+
+
+@pytest.fixture
+def simple_word_tokenize(monkeypatch):
+    # sent2vec and its batch version share feature_engineer.word_tokenize, so
+    # a stand-in keeps the comparison fair without NLTK's punkt model
+    tokenize = lambda s: re.findall(r"\w+|[^\w\s]", s)
+    monkeypatch.setattr(feature_engineer, 'word_tokenize', tokenize)
+    return tokenize
+
+
+@pytest.fixture
+def small_model(pairs, simple_word_tokenize):
+    from gensim.models import KeyedVectors
+    words = sorted({w for q in pairs.question1.tolist() + pairs.question2.tolist()
+                    for w in simple_word_tokenize(q.lower())})
+    model = KeyedVectors(8)
+    vectors = np.random.RandomState(1).randn(len(words) - 3, 8).astype(np.float32)
+    # The last few words stay out of vocabulary
+    if hasattr(model, 'add_vectors'):
+        model.add_vectors(words[:-3], vectors)
+    else:
+        model.add(words[:-3], vectors)
+    return model
+
+
+def test_question_vectors_match_sent2vec(monkeypatch, tmp_path, pairs, small_model):
+    monkeypatch.setattr(feature_engineer, 'model', small_model, raising=False)
+    questions = pairs.question1.tolist() + pairs.question2.tolist() + ['the', 'a zzz', 'diamond? Diamond!']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected = np.array([feature_engineer.sent2vec(q) * np.ones(8) for q in questions])
+    assert np.isnan(expected[-3]).all()
+
+    cache_path = str(tmp_path / 'cache.sqlite')
+    version = feature_engineer._embedding_version(small_model)
+    monkeypatch.setattr(feature_engineer, '_embedding_version', lambda model: version)
+    vectors = feature_engineer.question_vectors(questions, small_model, cache_path=cache_path)
+    assert vectors.dtype == np.float32
+    np.testing.assert_allclose(vectors, expected, rtol=1e-5, atol=1e-6)
+
+    # Every question is in the cache now
+    def fail(*args):
+        raise AssertionError('recomputed a cached question')
+    monkeypatch.setattr(feature_engineer, 'sent2vec_matrix', fail)
+    np.testing.assert_array_equal(feature_engineer.question_vectors(questions[::-1], small_model,
+                                                                    cache_path=cache_path), vectors[::-1])
+
+
+def test_vector_distance_features_match_scipy():
+    from scipy.spatial.distance import cosine, cityblock, canberra, minkowski, braycurtis
+    from scipy.stats import skew, kurtosis
+
+    rng = np.random.RandomState(0)
+    q1 = rng.randn(50, 30).astype(np.float32)
+    q2 = rng.randn(50, 30).astype(np.float32)
+    q1[3] = np.nan  # a question without a known word
+    q2[4] = 0
+    q1[5, :10] = q2[5, :10] = 0
+    q1[6] = q2[6]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u, v = np.nan_to_num(q1.astype(np.float64)), np.nan_to_num(q2.astype(np.float64))
+        expected = {
+            'cosine_distance': [cosine(x, y) for x, y in zip(u, v)],
+            'cityblock_distance': [cityblock(x, y) for x, y in zip(u, v)],
+            'canberra_distance': [canberra(x, y) for x, y in zip(u, v)],
+            'minkowski_distance': [minkowski(x, y, 3) for x, y in zip(u, v)],
+            'braycurtis_distance': [braycurtis(x, y) for x, y in zip(u, v)],
+            'skew_q1vec': [skew(x) for x in u],
+            'skew_q2vec': [skew(x) for x in v],
+            'kur_q1vec': [kurtosis(x) for x in u],
+            'kur_q2vec': [kurtosis(x) for x in v],
+        }
+    X = feature_engineer.vector_distance_features(q1, q2, chunksize=7)
+    assert list(X.columns) == feature_engineer.VECTOR_COLUMNS
+    for column in feature_engineer.VECTOR_COLUMNS:
+        np.testing.assert_allclose(X[column].values, expected[column], rtol=1e-9, atol=1e-12,
+                                   equal_nan=True, err_msg=column)
+
+
+def _linprog_emd2(d1, d2, distances):
+    # Reference transport solver standing in for POT's emd2
+    from scipy.optimize import linprog
+    n = len(d1)
+    constraints = np.vstack([np.kron(np.eye(n), np.ones(n)), np.kron(np.ones(n), np.eye(n))])
+    return linprog(distances.ravel(), A_eq=constraints, b_eq=np.concatenate([d1, d2]), method='highs').fun
+
+
+def test_wmd_features_match_wmdistance(monkeypatch):
+    import sys
+    import types
+    from gensim.models import KeyedVectors
+    if not hasattr(KeyedVectors, 'add_vectors'):
+        pytest.skip('needs the gensim 4 wmdistance(norm=...)')
+
+    rng = random.Random(0)
+    words = ['w%d' % i for i in range(20)] + ['the', 'dup']
+    vectors = np.random.RandomState(2).randn(len(words), 6).astype(np.float32)
+    vectors[-1] = vectors[0]
+    model = KeyedVectors(6)
+    model.add_vectors(words, vectors)
+    choices = words + ['zzz', 'what']
+    docs = [[rng.choice(choices) for _ in range(rng.randint(0, 9))] for _ in range(80)]
+    data = pd.DataFrame({'q1_split': docs[:40] + [['w1'], ['w3', 'w3'], ['w0'], ['the'], ['zzz']],
+                         'q2_split': docs[40:] + [['w1', 'zzz'], ['w3'], ['dup', 'dup'], ['w2'], ['w4']]})
+
+    expected = []
+    fake_ot = types.ModuleType('ot')
+    fake_ot.emd2 = _linprog_emd2
+    with monkeypatch.context() as m:
+        m.setitem(sys.modules, 'ot', fake_ot)
+        for s1, s2 in zip(data.q1_split, data.q2_split):
+            s1 = [w for w in s1 if w not in feature_engineer.stop_words]
+            s2 = [w for w in s2 if w not in feature_engineer.stop_words]
+            expected.append(model.wmdistance(s1, s2, norm=False))
+
+    X = feature_engineer.wmd_features(data, model, n_jobs=1, chunksize=7)
+    assert list(X.columns) == feature_engineer.WMD_COLUMNS
+    np.testing.assert_allclose(X['wmd'].values, expected, rtol=1e-6, atol=1e-9)
+    assert np.isinf(X['wmd'].values[-3:]).all() and (X['wmd'].values[-5:-3] == 0).all()
+    finite = np.isfinite(X['wmd'].values)
+    assert (X['wcd'].values[finite] <= X['wmd'].values[finite] + 1e-9).all()
+    assert (X['rwmd'].values[finite] <= X['wmd'].values[finite] + 1e-9).all()
+
+    approximate = feature_engineer.wmd_features(data, model, exact=False, n_jobs=1)
+    np.testing.assert_array_equal(approximate['wmd'].values[finite], X['rwmd'].values[finite])
+
+    parallel = feature_engineer.wmd_features(data, model, n_jobs=2, chunksize=10)
+    np.testing.assert_allclose(parallel.values, X.values, rtol=1e-9)
+
+
+def test_build_features_end_to_end(monkeypatch, tmp_path, pairs, small_model):
+    monkeypatch.setattr(preprocessing, 'PREPROCESSING_CACHE_PATH', str(tmp_path / 'cache.sqlite'))
+    dictionary, lda_model, lsi_model = feature_engineer.train_lda(
+        [feature_engineer.clean_doc(q) for q in pairs.question1.tolist() + pairs.question2.tolist()], num_topics=2)
+    for name, value in [('model', small_model), ('norm_model', small_model), ('dictionary', dictionary),
+                        ('lda_model', lda_model), ('lsi_model', lsi_model), ('num_topics', 2)]:
+        monkeypatch.setattr(feature_engineer, name, value, raising=False)
+
+    X = feature_engineer.build_features(pairs, feature_engineer.stop_words)
+    assert len(X) == len(pairs) and X.columns.is_unique
+    for column in feature_engineer.VECTOR_COLUMNS + feature_engineer.FUZZY_COLUMNS + ['lda_topic_1_q2']:
+        assert column in X.columns
+    # The lower bounds come from the WMD solve, not from the vector distances
+    distances = feature_engineer.wmd_features(pairs, small_model)
+    for column in ['wmd', 'wcd', 'rwmd']:
+        np.testing.assert_allclose(X[column].values, distances[column].values, rtol=1e-6)
+        np.testing.assert_allclose(X['norm_' + column].values, distances[column].values, rtol=1e-6)
+
+
+def test_topic_features_match_row_wise(pairs):
+    questions = pairs.question1.tolist() + pairs.question2.tolist()
+    texts = feature_engineer.clean_docs(questions + questions[:3])
+    assert texts == [feature_engineer.clean_doc(q) for q in questions + questions[:3]]
+    dictionary, lda_model, lsi_model = feature_engineer.train_lda(texts, num_topics=4, workers=1)
+
+    def row_wise(model, q):
+        return [dict(model[dictionary.doc2bow(feature_engineer.clean_doc(q))]).get(idx, 0) for idx in range(4)]
+
+    # Inference run to convergence, so that its random starting point does not matter
+    lda_model.gamma_threshold, lda_model.iterations = 1e-10, 10000
+    lda_model.random_state = np.random.RandomState(0)
+    expected_lda = np.array([row_wise(lda_model, q) for q in questions])
+    expected_lsi = np.array([row_wise(lsi_model, q) for q in questions])
+
+    lda_model.random_state = np.random.RandomState(0)
+    lda, lsi = feature_engineer.topic_features(questions, dictionary, lda_model, lsi_model, 4, chunksize=3)
+    assert lda.dtype == lsi.dtype == np.float32 and lda.shape == lsi.shape == (len(questions), 4)
+    # Converged batched and per-document inference agree, if not bit for bit
+    np.testing.assert_allclose(lda, expected_lda, atol=1e-5)
+    np.testing.assert_allclose(lsi, expected_lsi, rtol=1e-5, atol=1e-7)
+
+
+def test_build_groups_caches_each_group(tmp_path, pairs, caplog):
+    calls = []
+
+    def counted(compute):
+        def run(data, state):
+            calls.append(compute.__name__)
+            return compute(data, state)
+        return run
+
+    state = feature_engineer.QuoraFeatureExtractor(stops={'the', 'in'})
+    text, split = [feature_engineer.FeatureGroup(g.name, counted(g.compute), g.functions, g.params)
+                   for g in feature_engineer.FEATURE_GROUPS[:2]]
+    expected = feature_engineer.build_groups([text, split], pairs, state)
+    assert calls == ['_text_features', '_split_features']
+
+    cache_dir = str(tmp_path / 'cache')
+    first = feature_engineer.build_groups([text, split], pairs, state, cache_dir)
+    pd.testing.assert_frame_equal(first, expected)
+    with caplog.at_level('INFO', logger='feature_engineer'):
+        second = feature_engineer.build_groups([text, split], pairs, state, cache_dir)
+    pd.testing.assert_frame_equal(second, expected)
+    assert calls == ['_text_features', '_split_features'] * 2
+    assert '2 hits, 0 misses' in caplog.text
+
+    # Other stop words only make the group that reads them stale, other data both
+    feature_engineer.build_groups([text, split], pairs, feature_engineer.QuoraFeatureExtractor(stops={'the'}),
+                                  cache_dir)
+    assert calls[4:] == ['_split_features']
+    feature_engineer.build_groups([text, split], pairs[:3], state, cache_dir)
+    assert calls[5:] == ['_text_features', '_split_features']
+
+
+def test_feature_columns_cover_the_groups():
+    columns = feature_engineer.feature_columns(3, entity_features=True)
+    assert len(columns) == len(set(columns)) == 79 + 4 * 3 + 4 + 12 + 4
+    assert columns[68:70] == ['wmd', 'norm_wmd'] and columns[78] == 'kur_q2vec'
+
+
+def test_compact_features_match_float64(pairs, extractor):
+    groups = [g for g in feature_engineer.FEATURE_GROUPS if g.name != 'entities']
+    extractor.lda_model.random_state = np.random.RandomState(0)
+    wide = feature_engineer.build_groups(groups, pairs, extractor)
+    extractor.lda_model.random_state = np.random.RandomState(0)
+    X = extractor.transform(pairs)
+    schema = dict(extractor.schema())
+    assert list(X.columns) == feature_engineer.feature_columns(2)
+    assert X['start_why_q1'].dtype == np.uint8 and X['len_q1'].dtype == np.uint16
+    assert X['same_start'].dtype == np.float16 and X['same_start'].isna().any()
+    assert all(X[col].dtype == dtype for col, dtype in schema.items())
+    assert X.memory_usage(index=False).sum() * 2 < wide.memory_usage(index=False).sum()
+    # What xgboost and Keras read, the float32 values, is the same
+    np.testing.assert_array_equal(X.values.astype(np.float32), wide[X.columns].values.astype(np.float32))
+
+
+def test_assemble_features_widens_what_does_not_fit(caplog):
+    frames = [pd.DataFrame({'len_q1': [3, 70000], 'same_start': [1., 0.]}),
+              pd.DataFrame({'start_why_q1': [0, 1], 'len_q2': [np.nan, 4.], 'wmd': [1e300, .5]})]
+    schema = [('len_q1', np.dtype(np.uint16)), ('len_q2', np.dtype(np.uint16)),
+              ('same_start', np.dtype(np.float16)), ('start_why_q1', np.dtype(np.uint8)),
+              ('wmd', np.dtype(np.float32))]
+    with caplog.at_level('WARNING', logger='feature_engineer'):
+        X = feature_engineer.assemble_features(frames, schema, pd.RangeIndex(2))
+    assert frames == [None, None]
+    assert list(X.dtypes) == [np.float32, np.float32, np.float16, np.uint8, np.float64]
+    assert X['len_q1'].tolist() == [3, 70000] and np.isnan(X['len_q2'][0]) and X['wmd'][0] == 1e300
+    assert 'len_q1 does not fit uint16' in caplog.text and 'wmd does not fit float32' in caplog.text
+
+    # A store written in parts never widens a group in one of them
+    frames = [pd.DataFrame({'len_q1': [3, 70000]})]
+    with pytest.raises(ValueError, match='len_q1 does not fit uint16'):
+        feature_engineer.assemble_features(frames, schema[:1], pd.RangeIndex(2), widen=False)
+
+
+@pytest.fixture
+def fitted(monkeypatch, tmp_path, pairs, small_model):
+    # The module-level state build_features reads, fitted on pairs
+    monkeypatch.setattr(preprocessing, 'PREPROCESSING_CACHE_PATH', str(tmp_path / 'cache.sqlite'))
+    dictionary, lda_model, lsi_model = feature_engineer.train_lda(
+        feature_engineer.clean_docs(pairs.question1.tolist() + pairs.question2.tolist()), num_topics=2, workers=1)
+    for name, value in [('model', small_model), ('norm_model', small_model), ('dictionary', dictionary),
+                        ('lda_model', lda_model), ('lsi_model', lsi_model), ('num_topics', 2)]:
+        monkeypatch.setattr(feature_engineer, name, value, raising=False)
+
+
+def test_build_features_from_cache(monkeypatch, tmp_path, pairs, fitted):
+    cache_dir = str(tmp_path / 'features')
+    X = feature_engineer.build_features(pairs, feature_engineer.stop_words, cache_dir=cache_dir)
+    assert list(X.columns) == feature_engineer.feature_columns(2)
+    assert len(os.listdir(cache_dir)) == len(feature_engineer.FEATURE_GROUPS) - 1
+    # Seeded LDA inference: a rebuild gives what the cache holds
+    pd.testing.assert_frame_equal(feature_engineer.build_features(pairs, feature_engineer.stop_words), X)
+
+    # Group keys hold on to the functions they were declared with, so
+    # stubbing the module globals leaves them unchanged
+    def fail(*args, **kwargs):
+        raise AssertionError('recomputed a cached group')
+    for name in ['word_len', 'word_len_char', 'set_overlap_features', 'fuzzy_features', 'wmd_features',
+                 'question_vectors', 'topic_features', 'char_ngram_features']:
+        monkeypatch.setattr(feature_engineer, name, fail)
+    cached = feature_engineer.build_features(pairs, feature_engineer.stop_words, cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(cached, X)
+
+
+def test_feature_group_keys_track_backend_and_stop_words(monkeypatch, pairs, fitted):
+    import difflib
+    state = feature_engineer._module_extractor(feature_engineer.stop_words, None, False)
+    groups = {group.name: group for group in feature_engineer.FEATURE_GROUPS}
+    keys = {name: group.key(state, 'data') for name, group in groups.items()}
+
+    class Matcher(difflib.SequenceMatcher):
+        pass
+    monkeypatch.setattr(feature_engineer.fuzz, 'SequenceMatcher', Matcher)
+    assert groups['fuzzy'].key(state, 'data') != keys['fuzzy']
+    monkeypatch.setattr(feature_engineer, 'stop_words', feature_engineer.stop_words | {'quora'})
+    for name in ['vectors', 'topics']:
+        assert groups[name].key(state, 'data') != keys[name]
+    assert groups['text'].key(state, 'data') == keys['text']
+
+
+def test_fit_tfidf_matches_calculate_tfidf(pairs):
+    questions = pairs.question1.tolist() + pairs.question2.tolist()
+    expected = feature_engineer.calculate_tfidf(pd.Series(questions))
+    assert feature_engineer.fit_tfidf([questions[:3], questions[3:7], [], questions[7:]]) == expected
+
+
+def test_build_features_streaming(tmp_path, pairs, fitted):
+    import feature_store
+    path = str(tmp_path / 'test_clean.parquet')
+    pairs[['question1', 'question2']].to_parquet(path)
+    expected = feature_engineer.build_features(feature_engineer.prepare_df(path), feature_engineer.stop_words)
+
+    store_dir = str(tmp_path / 'test_features')
+    feature_engineer.build_features_streaming(path, store_dir, feature_engineer.stop_words, chunksize=2)
+    assert feature_store.read_manifest(store_dir)['groups'][0]['part_rows'] == [2, 2, 1]
+    assert sorted(feature_store.feature_columns(store_dir)) == sorted(expected.columns)
+    X = feature_store.read_features(store_dir, columns=list(expected.columns))
+    assert (X.dtypes == expected.dtypes).all()
+    # LDA inference starts from random topic weights, chunk by chunk
+    lda = [col for col in X.columns if col.startswith('lda_')]
+    pd.testing.assert_frame_equal(X.drop(columns=lda), expected.drop(columns=lda), check_dtype=False)
+    np.testing.assert_allclose(X[lda].values, expected[lda].values, atol=1e-2)
+    with pytest.raises(ValueError):
+        feature_engineer.build_features_streaming(path, store_dir, feature_engineer.stop_words)
+
+
+@pytest.fixture
+def extractor(monkeypatch, tmp_path, pairs, small_model):
+    # Fitted on pairs, with small_model as the word2vec file
+    monkeypatch.setattr(preprocessing, 'PREPROCESSING_CACHE_PATH', str(tmp_path / 'cache.sqlite'))
+    w2v_path = str(tmp_path / 'vectors.bin')
+    small_model.save_word2vec_format(w2v_path, binary=True)
+    return feature_engineer.QuoraFeatureExtractor(w2v_path, num_topics=2, lda_workers=1).fit(pairs)
+
+
+def test_extractor_save_and_load(monkeypatch, tmp_path, pairs, extractor):
+    assert extractor.weights == feature_engineer.calculate_tfidf(
+        pd.Series(pairs.question1.tolist() + pairs.question2.tolist()))
+    path = extractor.save(str(tmp_path / 'extractor.pkl'))
+    profile = stage_profile.StageProfile()
+    expected = extractor.transform(pairs, profile=profile)
+    assert list(expected.columns) == feature_engineer.feature_columns(2)
+    assert [row['stage'] for row in profile.summary()] == [
+        group.name for group in feature_engineer.FEATURE_GROUPS if group.name != 'entities']
+
+    # Loading refits nothing and brings back the embeddings as memory maps
+    def fail(*args, **kwargs):
+        raise AssertionError('refit a fitted model')
+    for name in ['calculate_tfidf', 'fit_tfidf', 'train_lda']:
+        monkeypatch.setattr(feature_engineer, name, fail)
+    loaded = feature_engineer.QuoraFeatureExtractor.load(path)
+    assert isinstance(loaded.model.vectors, np.memmap) and loaded.weights == extractor.weights
+    X = loaded.transform(pairs)
+    lda = [col for col in X.columns if col.startswith('lda_')]
+    pd.testing.assert_frame_equal(X.drop(columns=lda), expected.drop(columns=lda))
+    np.testing.assert_allclose(X[lda].values, expected[lda].values, atol=1e-2)
+
+    # The pickle knows what it was fit with, so a stale one is not reused
+    stops = feature_engineer.stop_words
+    assert loaded.fit_mismatches(pairs, extractor.w2v_path, 2, stops) == []
+    assert loaded.fit_mismatches(pairs, extractor.w2v_path, 3, stops) == ['num_topics']
+    assert loaded.fit_mismatches(pairs, 'other.bin', 2, set(stops) | {'quora'}) == ['w2v_path', 'stops']
+    assert loaded.fit_mismatches(pairs.iloc[1:], extractor.w2v_path, 2, stops) == ['train data']
+
+
+@pytest.mark.parametrize('fmt', ['npy', 'parquet'])
+def test_transform_file_in_shards(caplog, tmp_path, pairs, extractor, fmt):
+    import feature_store
+    path = str(tmp_path / 'test_clean.csv')
+    pairs[['question1', 'question2']].to_csv(path, index=False)
+    single, sharded = str(tmp_path / 'single'), str(tmp_path / 'sharded')
+    random_state = extractor.lda_model.random_state
+    extractor.transform_file(path, single, chunksize=2, fmt=fmt)
+    # Seeding the chunks leaves the fitted model's random state alone
+    assert extractor.lda_model.random_state is random_state
+    extractor.transform_file(path, sharded, chunksize=2, fmt=fmt, n_jobs=2)
+    # The workers read their rows from a Parquet copy of the csv
+    assert 'copying it to Parquet' in caplog.text
+
+    manifest = feature_store.read_manifest(sharded)
+    assert manifest == feature_store.read_manifest(single) and manifest['groups'][0]['part_rows'] == [2, 2, 1]
+    for group in manifest['groups']:
+        for file_name in group['parts']:
+            with open(os.path.join(single, file_name), 'rb') as f1, \
+                    open(os.path.join(sharded, file_name), 'rb') as f2:
+                assert f1.read() == f2.read()
+    assert not os.path.exists(sharded + '.shared')
+    assert sorted(feature_store.feature_columns(sharded)) == sorted(feature_engineer.feature_columns(2))
+
+
+def test_transform_file_widens_a_column_in_every_part(monkeypatch, tmp_path, pairs, extractor):
+    import feature_store
+    # len_char_q1 in a uint8 group, which only the second chunk overflows
+    feature_schema = feature_engineer.feature_schema
+    monkeypatch.setattr(feature_engineer, 'feature_schema', lambda *args: [
+        (col, np.dtype(np.uint8) if col == 'len_char_q1' else dtype) for col, dtype in feature_schema(*args)])
+    pairs.loc[3, 'question1'] = ' '.join(['Should I buy tiago or some other car?'] * 10)
+    path = str(tmp_path / 'test.parquet')
+    pairs[['question1', 'question2']].to_parquet(path)
+    single, sharded = str(tmp_path / 'single'), str(tmp_path / 'sharded')
+    extractor.transform_file(path, single, chunksize=2)
+    extractor.transform_file(path, sharded, chunksize=2, n_jobs=2)
+
+    manifest = feature_store.read_manifest(single)
+    assert manifest == feature_store.read_manifest(sharded)
+    groups = {group['name']: group for group in manifest['groups']}
+    assert 'len_char_q1' in groups['float32']['columns'] and 'uint8' in groups
+    for group in manifest['groups']:
+        assert group['part_rows'] == [2, 2, 1]
+        assert {np.load(os.path.join(single, f), mmap_mode='r').dtype.name for f in group['parts']} == {
+            group['name']}
+    expected = extractor.transform(feature_engineer.prepare_frame(pairs[['question1', 'question2']]))
+    X = feature_store.read_features(single, columns=list(expected.columns))
+    assert X['len_char_q1'].max() > 255
+    # LDA inference starts from random topic weights, chunk by chunk
+    pd.testing.assert_frame_equal(X, expected, check_dtype=False, atol=1e-4)
+
+
+def test_sharded_transform_file_cleans_in_process(monkeypatch, tmp_path, pairs, extractor):
+    import multiprocessing
+    import feature_store
+    # With several cores, a shard worker (a daemonic process) must not start a cleaning pool of its own
+    monkeypatch.setattr(multiprocessing, 'cpu_count', lambda: 4)
+    path = str(tmp_path / 'test.csv')
+    pairs[['question1', 'question2']].to_csv(path, index=False)
+    single, sharded = str(tmp_path / 'single'), str(tmp_path / 'sharded')
+    extractor.transform_file(path, sharded, chunksize=2, clean_text=True, n_jobs=2)
+    extractor.transform_file(path, single, chunksize=2, clean_text=True)
+    columns = feature_engineer.feature_columns(2)
+    pd.testing.assert_frame_equal(feature_store.read_features(sharded, columns=columns),
+                                  feature_store.read_features(single, columns=columns))
@@ -0,0 +1,109 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import feature_store
+
+pd = pytest.importorskip('pandas')
+
+
+@pytest.fixture
+def features():
+    rng = np.random.RandomState(0)
+    frame = pd.DataFrame({
+        'word_count_q1': rng.randint(0, 30, 100),
+        'word_match': rng.rand(100),
+        'wmd': np.where(rng.rand(100) < .1, np.inf, rng.rand(100) * 3),
+        'same_start': np.where(rng.rand(100) < .1, np.nan, rng.randint(0, 2, 100)),
+    })
+    frame['lda_topic_0_q1'] = rng.rand(100) / 3
+    return frame
+
+
+@pytest.mark.parametrize('fmt', ['npy', 'parquet'])
+def test_write_and_read_features(tmp_path, features, fmt):
+    store_dir = str(tmp_path / 'train_features')
+    groups = {'counts': ['word_count_q1', 'word_match', 'same_start'], 'distances': ['wmd', 'lda_topic_0_q1']}
+    feature_store.write_features(store_dir, features, groups=groups, fmt=fmt)
+    with open(os.path.join(store_dir, feature_store.MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    assert manifest['rows'] == 100 and [g['name'] for g in manifest['groups']] == ['counts', 'distances']
+    assert feature_store.feature_columns(store_dir) == groups['counts'] + groups['distances']
+
+    # float64 by default: the values come back exactly
+    everything = feature_store.read_features(store_dir)
+    pd.testing.assert_frame_equal(everything, features[groups['counts'] + groups['distances']], check_dtype=False)
+    subset = feature_store.read_features(store_dir, columns=['wmd', 'word_count_q1'])
+    pd.testing.assert_frame_equal(subset, features[['wmd', 'word_count_q1']], check_dtype=False)
+
+    matrix, columns = feature_store.load_group(store_dir, 'distances')
+    assert columns == groups['distances']
+    if fmt == 'npy':
+        assert isinstance(matrix, np.memmap) and matrix.flags.f_contiguous
+    np.testing.assert_array_equal(matrix, features[columns].values)
+
+    with pytest.raises(KeyError):
+        feature_store.read_features(store_dir, columns=['missing'])
+
+
+def test_float32_and_replaced_groups(tmp_path, features):
+    store_dir = str(tmp_path / 'store')
+    feature_store.write_features(store_dir, features, dtype=np.float32)
+    matrix, _ = feature_store.load_group(store_dir, 'features')
+    assert matrix.dtype == np.float32
+    np.testing.assert_array_equal(matrix, features.values.astype(np.float32))
+
+    # Rewriting a group as Parquet swaps its file and keeps the column order
+    feature_store.write_group(store_dir, 'features', features, fmt='parquet')
+    assert sorted(os.listdir(store_dir)) == ['features.parquet', feature_store.MANIFEST_FILE]
+    pd.testing.assert_frame_equal(feature_store.read_features(store_dir), features, check_dtype=False)
+
+    with pytest.raises(ValueError):
+        feature_store.write_group(store_dir, 'more', features[['wmd']])
+    with pytest.raises(ValueError):
+        feature_store.write_group(store_dir, 'short', features[['wmd']].rename(columns={'wmd': 'x'})[:10])
+
+
+def test_convert_csv(tmp_path, features):
+    csv_path = str(tmp_path / 'train_features.csv')
+    features.to_csv(csv_path, index=False)
+    feature_store.main([csv_path, str(tmp_path / 'store'), '--float32'])
+    subset = feature_store.read_features(str(tmp_path / 'store'), columns=['word_match'])
+    assert subset['word_match'].dtype == np.float32
+    np.testing.assert_allclose(subset['word_match'], features['word_match'], rtol=1e-7)
+
+
+@pytest.mark.parametrize('fmt', ['npy', 'parquet'])
+def test_append_group(tmp_path, features, fmt):
+    store_dir = str(tmp_path / 'test_features')
+    for start in range(0, 100, 30):
+        feature_store.append_group(store_dir, 'features', features[start:start + 30], fmt=fmt)
+    manifest = feature_store.read_manifest(store_dir)
+    assert manifest['rows'] == 100 and manifest['groups'][0]['part_rows'] == [30, 30, 30, 10]
+    pd.testing.assert_frame_equal(feature_store.read_features(store_dir), features, check_dtype=False)
+    pd.testing.assert_frame_equal(feature_store.read_features(store_dir, columns=['wmd']), features[['wmd']],
+                                  check_dtype=False)
+    np.testing.assert_array_equal(feature_store.load_group(store_dir, 'features')[0], features.values)
+
+    with pytest.raises(ValueError):
+        feature_store.append_group(store_dir, 'features', features[['wmd']], fmt=fmt)
+
+
+def test_parts_keep_the_group_dtype(tmp_path, features):
+    store_dir = str(tmp_path / 'test_features')
+    feature_store.append_group(store_dir, 'features', features[:50], dtype=np.float32)
+    with pytest.raises(ValueError, match='float64 part does not match the float32 parts'):
+        feature_store.append_group(store_dir, 'features', features[50:])
+    assert feature_store.read_manifest(store_dir)['groups'][0]['part_rows'] == [50]
+
+
+def test_parts_written_out_of_order(tmp_path, features):
+    store_dir = str(tmp_path / 'test_features')
+    parts = {index: feature_store.write_part(store_dir, 'features', index, features[start:start + 40])
+             for index, start in reversed(list(enumerate(range(0, 100, 40))))}
+    assert feature_store.read_manifest(store_dir)['rows'] is None
+    feature_store.add_parts(store_dir, 'features', [parts[index] for index in sorted(parts)])
+    assert feature_store.read_manifest(store_dir)['groups'][0]['part_rows'] == [40, 40, 20]
+    pd.testing.assert_frame_equal(feature_store.read_features(store_dir), features, check_dtype=False)
@@ -0,0 +1,270 @@
+import json
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import preprocessing
+from benchmarks import baseline_preprocessing
+from benchmarks.corpus import GOLDEN_QUESTIONS
+
+
+def _wordnet_available():
+    try:
+        from nltk.corpus import wordnet
+        wordnet.ensure_loaded()
+    except LookupError:
+        return False
+    return True
+
+
+@pytest.fixture
+def no_tokenizer(monkeypatch):
+    identity = lambda s: s
+    monkeypatch.setattr(preprocessing, 'tokenizer', identity)
+    monkeypatch.setattr(baseline_preprocessing, 'tokenizer', identity)
+
+
+@pytest.mark.skipif(not _wordnet_available(), reason='needs the NLTK wordnet corpus')
+@pytest.mark.parametrize('text', GOLDEN_QUESTIONS)
+def test_word_patterns_replace_matches_baseline(text):
+    for t in (text, text.lower()):
+        assert preprocessing.word_patterns_replace(t) == baseline_preprocessing.word_patterns_replace(t)
+
+
+@pytest.mark.parametrize('text', GOLDEN_QUESTIONS)
+def test_rule_chain_matches_baseline(no_tokenizer, text):
+    for t in (text, text.lower()):
+        assert preprocessing.word_patterns_replace(t) == baseline_preprocessing.word_patterns_replace(t)
+
+
+# The fragments the rules look for, glued together at random so that
+# neighbouring rules get every chance to interact
+FRAGMENTS = list("0123456789 $%…é,.!/^+=':?()<>\"-–_\0abegijkmsuvzAJKMV") + [
+    "what's", "'s", "'ve", "can't", "n't", "i'm", "'re", "'d", "'ll", " 9 11 ", "60k", " e g ", " b g ",
+    " u s ", "e - mail", " j k ", " J K ", " J.K. ", "mhz", "MHz", "hz", "bpm", "km ", "cm ", "kg ", "kgs ",
+    "mg ", "ml ", "ms ", "lpa ", "kva", "kph", "mph", "hours", "hour", "k ", " v", "-v", "<$", " / ", "  ",
+    "well-known", "x_ray", "co–op"]
+
+
+def random_texts(n, seed=1234):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 12))) for _ in range(n)]
+
+
+def test_rule_chain_matches_baseline_on_random_fragments(no_tokenizer):
+    for text in random_texts(20000):
+        assert preprocessing.word_patterns_replace(text) == baseline_preprocessing.word_patterns_replace(text)
+
+
+def _check_series_matches_scalar():
+    pd = pytest.importorskip('pandas')
+    texts = GOLDEN_QUESTIONS + [t.lower() for t in GOLDEN_QUESTIONS] + random_texts(5000, seed=99)
+    out = preprocessing.word_patterns_replace_series(pd.Series(texts, index=range(10, 10 + len(texts))))
+    assert list(out.index) == list(range(10, 10 + len(texts)))
+    assert out.tolist() == [preprocessing.word_patterns_replace(t) for t in texts]
+
+
+def test_series_matches_scalar_rule_chain(no_tokenizer):
+    _check_series_matches_scalar()
+
+
+@pytest.mark.skipif(not _wordnet_available(), reason='needs the NLTK wordnet corpus')
+def test_series_matches_scalar():
+    _check_series_matches_scalar()
+
+
+def test_fused_regex_renumbers_groups():
+    passes = preprocessing.compile_rules((
+        ('regex', ((r'([0-9])x', r'\1 x '),
+                   (r'([0-9])(y)([0-9])', r'\3\2\g<1>'))),
+    ))
+    assert passes[0]('1x 2y3 4x') == '1 x  3y2 4 x '
+
+
+def _apply(passes, text):
+    for apply_pass in passes:
+        text = apply_pass(text)
+    return text
+
+
+def test_fused_literals_match_rule_chain():
+    chain = preprocessing.compile_rules(preprocessing.WORD_PATTERN_RULES)
+    fused = preprocessing.compile_rules(preprocessing.WORD_PATTERN_RULES, fuse_literals=True)
+    for text in GOLDEN_QUESTIONS + [t.lower() for t in GOLDEN_QUESTIONS] + random_texts(20000, seed=7):
+        assert _apply(fused, text) == _apply(chain, text)
+
+
+def test_literal_groups_on_random_chains():
+    # Small alphabet, so that rules overlap and feed each other all the time
+    rng = random.Random(42)
+    word = lambda lo: ''.join(rng.choice('ab ') for _ in range(rng.randint(lo, 3)))
+    for _ in range(3000):
+        rules = tuple((word(1), word(0)) for _ in range(rng.randint(2, 6)))
+        chain = preprocessing.compile_rules((('replace', rules),))
+        fused = preprocessing.compile_rules((('replace', rules),), fuse_literals=True)
+        for _ in range(10):
+            text = ''.join(word(0) for _ in range(rng.randint(0, 5)))
+            assert fused[0](text) == chain[0](text), (rules, text)
+    groups = preprocessing.literal_groups(((',', ' '), ('.', ' '), (' 9 11 ', '911'), ('/', ' ')))
+    assert groups == [[(',', ' '), ('.', ' ')], [(' 9 11 ', '911'), ('/', ' ')]]
+
+
+@pytest.mark.skipif(not _wordnet_available(), reason='needs the NLTK wordnet corpus')
+def test_wordnet_lexicon_agrees_with_synsets(tmp_path):
+    from nltk.corpus import wordnet
+    lexicon = preprocessing.build_wordnet_lexicon(str(tmp_path / 'lexicon.txt.gz'))
+    rng = random.Random(0)
+    words = rng.sample(sorted(lexicon), 2000)
+    # Inflections and near misses of real words, plus a few odd inputs
+    words += [w + suffix for w in words[:300] for suffix in ('s', 'es', 'ed', 'ing', 'er', 'est', 'ies', 'x')]
+    words += [w[:-1] for w in words[:300]] + ['Dogs', 'GEESE', 'Neural', '', '14', '911', 'mail']
+    for w in words:
+        assert (w.lower() in lexicon) == bool(wordnet.synsets(w)), w
+
+
+@pytest.mark.skipif(not _wordnet_available(), reason='needs the NLTK wordnet corpus')
+@pytest.mark.parametrize('text', GOLDEN_QUESTIONS + [
+    'neural-based state-of-the-art x-ray e-mail f-14 a--b -lead trail- co_founder',
+    'well-known well-known well_known well-knwon'])
+def test_tokenizer_matches_baseline(text):
+    assert preprocessing.tokenizer(text) == baseline_preprocessing.tokenizer(text)
+
+
+def test_text_to_wordlist_options(no_tokenizer):
+    text = "The runners aren't running to the 2 stores"
+    assert preprocessing.text_to_wordlist(text) == 'the runners are not running to the 2 stores'
+    assert 'the' not in preprocessing.text_to_wordlist(text, remove_stopwords=True).split()
+    assert preprocessing.text_to_wordlist(text, stem_words=True).split()[1:5] == ['runner', 'are', 'not', 'run']
+
+
+@pytest.mark.skipif(not _wordnet_available(), reason='needs the NLTK wordnet corpus')
+def test_preprocess_corpus_keeps_input_order():
+    texts = GOLDEN_QUESTIONS * 5
+    expected = [preprocessing.text_to_wordlist(t, remove_stopwords=True) for t in texts]
+    assert list(preprocessing.preprocess_corpus(iter(texts), n_jobs=1, remove_stopwords=True)) == expected
+    assert list(preprocessing.preprocess_corpus(iter(texts), n_jobs=3, chunksize=7,
+                                                remove_stopwords=True)) == expected
+
+
+def test_preprocess_corpus_cache(no_tokenizer, tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    texts = GOLDEN_QUESTIONS * 3
+    expected = [preprocessing.text_to_wordlist(t) for t in texts]
+    assert list(preprocessing.preprocess_corpus(texts, n_jobs=1, cache_path=cache_path)) == expected
+
+    # A rerun with the same rules never calls the cleaner
+    def fail(*args, **kwargs):
+        raise AssertionError('cleaned a cached question')
+    monkeypatch.setattr(preprocessing, 'word_patterns_replace', fail)
+    assert list(preprocessing.preprocess_corpus(texts, n_jobs=1, cache_path=cache_path)) == expected
+
+    # ...while a different rule set version misses the cache
+    monkeypatch.setattr(preprocessing, '_ruleset_version', 'changed')
+    with pytest.raises(AssertionError):
+        list(preprocessing.preprocess_corpus(texts, n_jobs=1, cache_path=cache_path))
+
+
+def test_ruleset_version_tracks_rules(monkeypatch):
+    version = preprocessing.ruleset_version()
+    monkeypatch.setattr(preprocessing, '_ruleset_version', None)
+    monkeypatch.setattr(preprocessing, 'WORD_PATTERN_RULES', preprocessing.WORD_PATTERN_RULES[:-1])
+    assert preprocessing.ruleset_version() != version
+
+
+@pytest.mark.parametrize('change', ['compiler', 'lexicon'])
+def test_ruleset_version_tracks_compilers_and_lexicon(monkeypatch, change):
+    version = preprocessing.ruleset_version()
+    monkeypatch.setattr(preprocessing, '_ruleset_version', None)
+    if change == 'compiler':
+        compile_regex = lambda rules: preprocessing._compile_regex(rules)
+        monkeypatch.setitem(preprocessing._PASS_COMPILERS, 'regex', compile_regex)
+    else:
+        monkeypatch.setattr(preprocessing, '_wordnet_lexicon', preprocessing.load_wordnet_lexicon() | {'quora'})
+    assert preprocessing.ruleset_version() != version
+
+
+def test_import_is_lazy_and_quiet():
+    code = 'import sys, preprocessing; print(sorted(m for m in sys.modules if m.split(".")[0] == "nltk"))'
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  universal_newlines=True)
+    assert out == '[]\n'
+
+
+class FakeNltk(object):
+    # Capitalised words are tagged NNP and every NNP becomes its own entity
+    @staticmethod
+    def word_tokenize(text):
+        return text.split()
+
+    @staticmethod
+    def pos_tag(tokens):
+        return [(t, 'NNP' if t[:1].isupper() else 'NN') for t in tokens]
+
+    @staticmethod
+    def ne_chunk(tagged):
+        from nltk.tree import Tree
+        return Tree('S', [Tree('NE', [tp]) if tp[1] == 'NNP' else tp for tp in tagged])
+
+    @classmethod
+    def pos_tag_sents(cls, sentences):
+        return [cls.pos_tag(s) for s in sentences]
+
+    @classmethod
+    def ne_chunk_sents(cls, tagged_sentences):
+        return (cls.ne_chunk(t) for t in tagged_sentences)
+
+
+def test_continuous_chunks_batch_matches_single(monkeypatch, tmp_path):
+    monkeypatch.setattr(preprocessing, '_nltk', lambda: FakeNltk)
+    texts = ['Barack Obama is the husband of Michelle Obama', 'no entities here', '', 'Obama and Obama or Trump'] * 3
+    expected = [preprocessing.get_continuous_chunks(t) for t in texts]
+    assert expected[0] == ['Barack Obama', 'Michelle Obama'] and expected[1] == ['']
+    assert list(preprocessing.get_continuous_chunks_batch(texts, n_jobs=1, batch_size=5)) == expected
+
+    cache_path = str(tmp_path / 'cache.sqlite')
+    assert list(preprocessing.get_continuous_chunks_batch(texts, n_jobs=1, cache_path=cache_path)) == expected
+    monkeypatch.setattr(preprocessing, '_chunk_batch', None)  # everything must come from the cache now
+    assert list(preprocessing.get_continuous_chunks_batch(texts, n_jobs=1, cache_path=cache_path)) == expected
+    assert list(preprocessing.entity_table(['a', 'b'], texts[:2], n_jobs=1, cache_path=cache_path)) == [
+        ('a', 'Barack Obama'), ('a', 'Michelle Obama')]
+
+
+def test_rule_profiler(no_tokenizer, tmp_path):
+    texts = [t.lower() for t in GOLDEN_QUESTIONS]
+    expected = [preprocessing.word_patterns_replace(t) for t in texts]
+    profiler = preprocessing.enable_rule_profiling()
+    try:
+        assert [preprocessing.word_patterns_replace(t) for t in texts] == expected
+    finally:
+        assert preprocessing.disable_rule_profiling() is profiler
+
+    rules = {(r['kind'], r['pattern']): r for r in profiler.report()}
+    assert all(r['calls'] == len(texts) for r in rules.values())
+    dollar = rules['replace', '$']
+    assert dollar['hits'] == sum('$' in t for t in texts)
+    assert dollar['chars_matched'] == dollar['matches'] == sum(t.count('$') for t in texts)
+    # '$' -> ' dollar ' changes eight characters per match
+    assert dollar['chars_changed'] == 8 * dollar['matches'] > 0
+    hyphen = rules['replace', '-']
+    assert hyphen['chars_changed'] == 2 * hyphen['matches']
+    assert rules['replace', '?']['hits'] == 0  # '?' is gone after the shorthand filter
+
+    profiler.write_report(str(tmp_path / 'profile'))
+    assert len(json.load(open(str(tmp_path / 'profile.json')))) == len(profiler.rules)
+    assert 'never fired' in open(str(tmp_path / 'profile.txt')).read()
+
+
+def test_rule_profiler_merges_workers(no_tokenizer):
+    texts = GOLDEN_QUESTIONS * 3
+    counts = {}
+    for n_jobs in (1, 2):
+        profiler = preprocessing.enable_rule_profiling()
+        try:
+            list(preprocessing.preprocess_corpus(texts, n_jobs=n_jobs, chunksize=4))
+        finally:
+            preprocessing.disable_rule_profiling()
+        counts[n_jobs] = [values[:-1] for values in profiler.counts()]  # all but the seconds
+    assert counts[2] == counts[1] and counts[1][0][0] == len(texts)
@@ -0,0 +1,151 @@
+import csv
+
+import pytest
+
+import quora_data
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+HEADER = ['id', 'qid1', 'qid2', 'question1', 'question2', 'is_duplicate']
+ROWS = [
+    ['0', '1', '2', 'What is the step by step guide to invest in share market in india?',
+     'What is the step by step guide to invest in share market?', '0'],
+    ['1', '3', '4', 'Why?? "quoted", with commas?', '', '1'],
+    ['2', '5', '6', '', 'How do I\nwrite a newline?', '0'],
+    ['3', '7', '8', 'NA', 'null', '1'],
+]
+
+
+# test.csv has no label and question2 as its last column
+TEST_HEADER = ['test_id', 'question1', 'question2']
+TEST_ROWS = [
+    ['0', 'How does the Surface Pro himself 4 compare with iPad Pro?', 'Why did Microsoft choose core m3?'],
+    ['1', 'Should I have a hair transplant at age 24?', ''],
+    ['2', '', 'What but is the best way to send money from China to the US?'],
+    ['3', 'NA', 'null'],
+    ['4', '', ''],
+]
+
+
+def _write_raw(path, header, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+    return path
+
+
+@pytest.fixture
+def raw_csv(tmp_path):
+    path = str(tmp_path / 'train.csv')
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(HEADER)
+        for i in range(50):
+            for row in ROWS:
+                writer.writerow([str(int(row[0]) + 4 * i)] + row[1:])
+    return path
+
+
+def _notebook_clean(path):
+    # What xgboost_3.ipynb did to the whole file
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        read_data = f.read()
+    read_data = read_data.replace("?", " ")
+    read_data = read_data.replace(",\"\",", ",\" \",")
+    return read_data
+
+
+@pytest.mark.parametrize('n_jobs', [1, 2])
+def test_clean_csv_matches_notebook(raw_csv, n_jobs):
+    dst, columnar = quora_data.clean_csv(raw_csv, chunksize=7, n_jobs=n_jobs)
+    assert dst == raw_csv[:-4] + '_clean.csv' and columnar == raw_csv[:-4] + '_clean.parquet'
+    with open(dst, encoding='utf-8', newline='') as f:
+        assert f.read() == _notebook_clean(raw_csv)
+
+    expected = pd.read_csv(dst, keep_default_na=False)
+    pd.testing.assert_frame_equal(quora_data.read_table(columnar), expected, check_dtype=False)
+    assert quora_data.read_table(columnar)['question1'].tolist()[3] == 'NA'
+
+
+def test_clean_test_csv_matches_notebook(tmp_path):
+    # An empty last column, or one right after another empty question, is
+    # not caught by the notebook's ',"",' replacement and stays empty
+    raw = _write_raw(str(tmp_path / 'test.csv'), TEST_HEADER, TEST_ROWS * 30)
+    dst, columnar = quora_data.clean_csv(raw, chunksize=7, n_jobs=1)
+    with open(dst, encoding='utf-8', newline='') as f:
+        assert f.read() == _notebook_clean(raw)
+    frame = quora_data.read_table(columnar)
+    pd.testing.assert_frame_equal(quora_data.read_table(dst), frame, check_dtype=False)
+    assert frame.iloc[:5, 1:].values.tolist() == [
+        ['How does the Surface Pro himself 4 compare with iPad Pro ', 'Why did Microsoft choose core m3 '],
+        ['Should I have a hair transplant at age 24 ', ''],
+        [' ', 'What but is the best way to send money from China to the US '],
+        ['NA', 'null'],
+        [' ', '']]
+
+
+def test_feather_copy_and_iter_columns(raw_csv):
+    dst, columnar = quora_data.clean_csv(raw_csv, columnar='feather', chunksize=11, n_jobs=1)
+    columns = ('question1', 'question2', 'is_duplicate')
+    from_csv = list(quora_data.iter_columns(dst, columns))
+    from_feather = list(quora_data.iter_columns(columnar, columns))
+    assert len(from_csv) == len(from_feather) == 4 * 50
+    assert [(q1, q2, int(label)) for q1, q2, label in from_csv] == from_feather
+    assert from_feather[1] == ('Why   "quoted", with commas ', ' ', 1)
+
+
+def test_keep_empty(raw_csv):
+    dst, = quora_data.clean_csv(raw_csv, columnar=None, n_jobs=1, keep_empty=True)
+    assert next(q2 for _, q2 in quora_data.iter_columns(dst, ('question1', 'question2'))
+                if q2.strip() == '') == ''
+
+
+@pytest.mark.parametrize('columnar', ['parquet', 'feather'])
+def test_iter_chunks(raw_csv, columnar):
+    dst, path = quora_data.clean_csv(raw_csv, columnar=columnar, chunksize=40, n_jobs=1)
+    for source in (dst, path):
+        chunks = list(quora_data.iter_chunks(source, chunksize=15, columns=['id', 'question1']))
+        assert max(len(chunk) for chunk in chunks) == 15
+        pd.testing.assert_frame_equal(pd.concat(chunks), quora_data.read_table(source, columns=['id', 'question1']))
+
+
+@pytest.mark.parametrize('columnar', ['parquet', 'feather'])
+def test_read_rows(raw_csv, columnar):
+    dst, path = quora_data.clean_csv(raw_csv, columnar=columnar, chunksize=40, n_jobs=1)
+    for source in (dst, path):
+        expected = quora_data.read_table(source)
+        assert quora_data.count_rows(source) == len(expected) == 200
+        # Ranges across row groups and record batches, and past the end
+        for start, stop in [(0, 15), (35, 85), (190, 250), (200, 210)]:
+            chunk = quora_data.read_rows(source, start, stop)
+            pd.testing.assert_frame_equal(chunk, expected[start:stop], check_index_type=False,
+                                          check_dtype=start < len(expected))
+
+
+@pytest.mark.parametrize('columnar', ['parquet', 'feather'])
+def test_to_columnar(raw_csv, tmp_path, columnar):
+    # Copied as read, empty questions included, a row group per chunk
+    path = quora_data.to_columnar(raw_csv, str(tmp_path / ('pairs.' + columnar)), columnar, chunksize=3)
+    expected = quora_data.read_table(raw_csv)
+    assert quora_data.count_rows(path) == len(expected)
+    pd.testing.assert_frame_equal(quora_data.read_table(path), expected, check_dtype=False)
+    pd.testing.assert_frame_equal(quora_data.read_rows(path, 7, 12), expected[7:12], check_dtype=False,
+                                  check_index_type=False)
+
+
+@pytest.mark.parametrize('columnar', ['parquet', 'feather'])
+def test_questions_are_never_nan(raw_csv, tmp_path, columnar):
+    # '', 'NA' and 'null' are questions to every reader of every format
+    dst, path = quora_data.clean_csv(raw_csv, columnar=columnar, chunksize=40, n_jobs=1, keep_empty=True)
+    copy = quora_data.to_columnar(dst, str(tmp_path / ('copy.' + columnar)), columnar)
+    expected = [['', 'NA'], ['How do I\nwrite a newline ', 'null']]
+    for source in (dst, path, copy):
+        frames = [quora_data.read_table(source), next(quora_data.iter_chunks(source, chunksize=15)),
+                  quora_data.read_rows(source, 0, 15)]
+        for frame in frames:
+            assert frame.loc[2:3, ['question1', 'question2']].values.T.tolist() == expected
+        assert list(quora_data.iter_columns(source, ('question1', 'question2')))[2:4] == [
+            ('', 'How do I\nwrite a newline '), ('NA', 'null')]
@@ -0,0 +1,46 @@
+import json
+import time
+
+import numpy as np
+
+import stage_profile
+
+
+def test_stages_record_time_memory_and_rows(tmp_path):
+    profile = stage_profile.StageProfile()
+    with profile.stage('load') as record:
+        time.sleep(.05)
+        record.rows = 10
+    for _ in range(2):
+        with profile.stage('build', rows=1000):
+            with profile.stage('group'):
+                block = np.ones(2 ** 24)  # 128 MB, touched
+                del block
+
+    load, build, group = profile.summary()
+    assert load['stage'] == 'load' and load['calls'] == 1 and load['wall'] >= .05
+    assert load['rows_per_s'] == 10 / load['wall']
+    assert build['calls'] == 2 and build['rows'] == 2000 and group['depth'] == 1
+    assert group['rows'] is None and group['rows_per_s'] is None
+    # A peak of the inner stage counts for the outer one too
+    assert group['peak_rss'] > 100 * 2 ** 20 and build['peak_rss'] >= group['peak_rss']
+    assert load['peak_rss'] < 100 * 2 ** 20
+    assert abs(load['share'] + build['share'] - 1) < 1e-9
+
+    json_path, md_path = profile.write(str(tmp_path / 'reports' / 'profile'))
+    with open(json_path) as f:
+        report = json.load(f)
+    assert [row['stage'] for row in report['stages']] == ['load', 'build', 'group']
+    assert len(report['runs']) == 5 and report['runs'][2]['parents'] == ['build']
+    with open(md_path) as f:
+        table = f.read().splitlines()
+    assert len(table) == 5 and table[0].startswith('| stage |')
+
+
+def test_stage_without_profile():
+    with stage_profile.stage(None, 'group', 5) as record:
+        record.rows = 6
+    profile = stage_profile.StageProfile()
+    with stage_profile.stage(profile, 'group', 5):
+        pass
+    assert profile.summary()[0]['rows'] == 5
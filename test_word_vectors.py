@@ -0,0 +1,48 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+import word_vectors
+
+gensim = pytest.importorskip('gensim')
+
+
+@pytest.fixture
+def w2v_bin(tmp_path):
+    from gensim.models import KeyedVectors
+    words = ['the', 'quora', 'question', 'Pair', 'café', 'new_york', 'x\ry']
+    rng = np.random.RandomState(0)
+    kv = KeyedVectors(25)
+    vectors = rng.randn(len(words), 25).astype(np.float32)
+    if hasattr(kv, 'add_vectors'):
+        kv.add_vectors(words, vectors)
+    else:
+        kv.add(words, vectors)
+    path = str(tmp_path / 'vectors.bin')
+    kv.save_word2vec_format(path, binary=True)
+    return path
+
+
+def test_store_matches_word2vec_format(w2v_bin):
+    from gensim.models import KeyedVectors
+    expected = KeyedVectors.load_word2vec_format(w2v_bin, binary=True)
+
+    model = word_vectors.load_word_vectors(w2v_bin)
+    assert os.path.isdir(w2v_bin[:-4] + '_store')
+    assert isinstance(model.vectors, np.memmap) and model.vectors.dtype == np.float32
+    for w in ['the', 'café', 'x\ry']:
+        assert w in model
+        np.testing.assert_array_equal(model[w], expected[w])
+    assert 'missing' not in model
+
+    # The normalized model reads the store's second matrix and shares the word index
+    norm_model = word_vectors.load_word_vectors(w2v_bin[:-4] + '_store', normalized=True, like=model)
+    assert isinstance(norm_model.vectors, np.memmap)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # init_sims is deprecated in gensim 4
+        expected.init_sims(replace=True)
+    np.testing.assert_allclose(norm_model.vectors, expected.vectors, rtol=1e-6)
+    np.testing.assert_allclose(np.linalg.norm(norm_model.vectors, axis=1), 1, rtol=1e-6)
+
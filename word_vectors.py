@@ -0,0 +1,124 @@
+"""Memory-mapped store for the word2vec embeddings.
+
+    python word_vectors.py GoogleNews-vectors-negative300.bin [store_dir]
+
+converts a word2vec binary once into store_dir (default: the .bin path
+without extension + '_store'):
+
+    vocab.txt         one word per line, in the order of the matrix rows
+    vectors.npy       float32 vectors as in the .bin
+    vectors_norm.npy  the same vectors scaled to unit L2 norm
+
+load_word_vectors opens the matrices with mmap_mode='r', so loading takes
+seconds instead of minutes and every process on the host shares one
+page-cached copy instead of holding its own 3.6 GB.
+"""
+import os
+import argparse
+import time
+
+import numpy as np
+
+VOCAB_FILE = 'vocab.txt'
+VECTORS_FILE = 'vectors.npy'
+NORM_VECTORS_FILE = 'vectors_norm.npy'
+
+
+def default_store_dir(path):
+    return os.path.splitext(path)[0] + '_store'
+
+
+def convert(path, store_dir=None, binary=True, chunk_rows=100000):
+    """Write the vocab and the raw and normalized float32 matrices of a word2vec file to store_dir."""
+    from gensim.models import KeyedVectors
+
+    if store_dir is None:
+        store_dir = default_store_dir(path)
+    os.makedirs(store_dir, exist_ok=True)
+    kv = KeyedVectors.load_word2vec_format(path, binary=binary)
+    words = getattr(kv, 'index_to_key', None) or kv.index2word
+
+    # Written under temporary names and renamed last, so an interrupted
+    # conversion never looks like a complete store
+    tmp = lambda name: os.path.join(store_dir, name + '.tmp')
+    vectors = np.lib.format.open_memmap(tmp(VECTORS_FILE), mode='w+', dtype=np.float32, shape=kv.vectors.shape)
+    norm_vectors = np.lib.format.open_memmap(tmp(NORM_VECTORS_FILE), mode='w+', dtype=np.float32,
+                                             shape=kv.vectors.shape)
+    for start in range(0, len(words), chunk_rows):
+        chunk = np.asarray(kv.vectors[start:start + chunk_rows], dtype=np.float32)
+        vectors[start:start + len(chunk)] = chunk
+        # Same arithmetic as gensim's init_sims(replace=True)
+        norms = np.sqrt((chunk ** 2).sum(-1))[..., np.newaxis]
+        norm_vectors[start:start + len(chunk)] = (chunk / norms).astype(np.float32)
+    vectors.flush()
+    norm_vectors.flush()
+    del vectors, norm_vectors
+    with open(tmp(VOCAB_FILE), 'w', encoding='utf-8', newline='') as f:
+        for w in words:
+            f.write(w + '\n')
+
+    for name in (VECTORS_FILE, NORM_VECTORS_FILE, VOCAB_FILE):
+        os.replace(tmp(name), os.path.join(store_dir, name))
+    return store_dir
+
+
+def _keyed_vectors(words, vectors, like=None):
+    # A gensim KeyedVectors around an existing (memory-mapped) matrix, for
+    # gensim 4 (index_to_key) as well as gensim 3 (vocab/index2word). The
+    # word index of like is shared rather than rebuilt.
+    from gensim.models import KeyedVectors
+
+    kv = KeyedVectors(vectors.shape[1])
+    if hasattr(kv, 'index_to_key'):
+        kv.index_to_key = like.index_to_key if like is not None else words
+        kv.key_to_index = like.key_to_index if like is not None else {w: i for i, w in enumerate(words)}
+    else:
+        from gensim.models.keyedvectors import Vocab
+        kv.index2word = like.index2word if like is not None else words
+        kv.vocab = like.vocab if like is not None else {
+            w: Vocab(index=i, count=len(words) - i) for i, w in enumerate(words)}
+    kv.vectors = vectors
+    return kv
+
+
+def load_vocab(store_dir):
+    with open(os.path.join(store_dir, VOCAB_FILE), encoding='utf-8', newline='') as f:
+        return f.read().split('\n')[:-1]
+
+
+def load_word_vectors(path, normalized=False, like=None):
+    """KeyedVectors backed by the read-only memory map of a store.
+
+    path is a store directory or a word2vec .bin; a .bin is converted to
+    its default store the first time. normalized picks the unit-norm
+    matrix, i.e. what init_sims(replace=True) used to produce. like, a
+    model loaded from the same store, lends its word index instead of
+    reading vocab.txt again.
+    """
+    store_dir = path
+    if not os.path.isdir(path):
+        store_dir = default_store_dir(path)
+        if not os.path.exists(os.path.join(store_dir, VOCAB_FILE)):
+            convert(path, store_dir)
+    words = load_vocab(store_dir) if like is None else None
+    vectors = np.load(os.path.join(store_dir, NORM_VECTORS_FILE if normalized else VECTORS_FILE), mmap_mode='r')
+    kv = _keyed_vectors(words, vectors, like)
+    if normalized and hasattr(kv, 'vectors_norm'):
+        kv.vectors_norm = vectors
+    return kv
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='word2vec file, e.g. GoogleNews-vectors-negative300.bin')
+    parser.add_argument('store_dir', nargs='?', help="default: the path without extension + '_store'")
+    parser.add_argument('--text', action='store_true', help='the word2vec file is in text format')
+    args = parser.parse_args(argv)
+
+    st = time.time()
+    store_dir = convert(args.path, args.store_dir, binary=not args.text)
+    print('%s -> %s (%.1fs)' % (args.path, store_dir, time.time() - st))
+
+
+if __name__ == '__main__':
+    main()